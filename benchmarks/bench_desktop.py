@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+	Time window enumeration and thumbnails against synthetic desktops
+	
+	Starts a private Xvfb server, and for each window count, fills
+	it with that many titled windows, nested into stacks of the given
+	depth. Some are left unmapped, and some are too small, so that
+	x11.get_windows() has to filter them out. Then times each stage
+	of getting them into the UI:
+		enumerate: x11.get_windows() into WindowInfo records
+		thumbs: thumbs.create_all() of those records
+		list: MainUI.populate_thumb_store() of those records
+		load: MainUI.load_visible_thumbs() of every record
+		
+	The results are written to a JSON file, which is the baseline for
+	the next run. If it already holds results, any stage which has
+	got slower than them by more than the tolerance is reported, the
+	exit status is 2, and the baseline is left as it was (unless
+	--update-baseline is given, to accept the new numbers).
+	
+	Needs Xvfb and ffmpeg on the PATH.
+"""
+import os
+import sys
+import json
+import time
+import types
+import tempfile
+import argparse
+import platform
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from x112v4l2 import x11
+from x112v4l2 import thumbs
+
+
+COUNTS = [10, 100, 1000]
+DEPTH = 4
+OUTPUT_FILENAME = os.path.join(os.path.dirname(__file__), 'bench_desktop.json')
+# A stage this much slower than before counts as a regression
+TOLERANCE = 0.25
+
+SCREEN_WIDTH = 1920
+SCREEN_HEIGHT = 1080
+# Size of the outermost window of each stack;
+# each nested window is inset from its parent by INSET
+WINDOW_WIDTH = 400
+WINDOW_HEIGHT = 300
+INSET = 10
+# Every so many windows is unmapped, and another is made too small
+UNMAPPED_EVERY = 10
+TINY_EVERY = 10
+
+
+def start_xvfb():
+	"""
+		Start a private Xvfb server
+		
+		Returns a 2-tuple of (display name, subprocess.Popen instance).
+	"""
+	read_fd, write_fd = os.pipe()
+	proc = subprocess.Popen(
+		[
+			'Xvfb', '-displayfd', str(write_fd), '-nolisten', 'tcp',
+			'-screen', '0', '{}x{}x24'.format(SCREEN_WIDTH, SCREEN_HEIGHT),
+		],
+		pass_fds=[write_fd],
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+	)
+	os.close(write_fd)
+	# Xvfb writes the display number once it's ready for clients
+	with os.fdopen(read_fd) as display_pipe:
+		number = display_pipe.readline().strip()
+	if not number:
+		proc.kill()
+		raise RuntimeError('Xvfb failed to start')
+	return (':{}'.format(number), proc)
+	
+def populate(display, count, depth):
+	"""
+		Create `count` windows on the `display`, in stacks of `depth`
+		
+		Returns how many of them x11.get_windows() ought to find.
+	"""
+	screen = display.screen()
+	columns = max(1, (SCREEN_WIDTH - WINDOW_WIDTH) // 40)
+	expected = 0
+	parent = None
+	parent_viewable = True
+	for idx in range(count):
+		level = idx % depth
+		if level == 0:
+			stack = idx // depth
+			parent = screen.root
+			parent_viewable = True
+			x = (stack % columns) * 40
+			y = (stack // columns * 40) % (SCREEN_HEIGHT - WINDOW_HEIGHT)
+		else:
+			x = y = INSET
+		width = WINDOW_WIDTH - level * INSET * 2
+		height = WINDOW_HEIGHT - level * INSET * 2
+		if idx % TINY_EVERY == 1:
+			width = height = x11.MIN_SIZE // 2
+			
+		window = parent.create_window(
+			x, y, width, height, 0,
+			screen.root_depth,
+			background_pixel=screen.white_pixel,
+		)
+		window.set_wm_name('Window {} ({}x{}, level {})'.format(idx, width, height, level))
+		mapped = idx % UNMAPPED_EVERY != 0
+		if mapped:
+			window.map()
+		viewable = mapped and parent_viewable
+		if viewable and width >= x11.MIN_SIZE and height >= x11.MIN_SIZE:
+			expected += 1
+		# Tiny windows can't hold the next level, so the stack restarts
+		if width >= WINDOW_WIDTH // 2:
+			parent = window
+			parent_viewable = viewable
+	display.sync()
+	return expected
+	
+def timed(func, *args):
+	"""
+		Returns a 2-tuple of (seconds taken, result) of calling `func`
+	"""
+	start = time.perf_counter()
+	result = func(*args)
+	return (time.perf_counter() - start, result)
+	
+def enumerate_windows(display_name):
+	"""
+		Returns WindowInfo records of the display's windows
+		
+		As X11Worker.probe() does, but only for the one display.
+	"""
+	screens = x11.get_screens([display_name])
+	return list(x11.get_windows(screens.values()))
+	
+def get_model(ui):
+	"""
+		Returns a stand-in MainUI, with just enough for its thumb model
+	"""
+	model = types.SimpleNamespace(
+		THUMB_COLUMN_WINDOW=ui.MainUI.THUMB_COLUMN_WINDOW,
+		THUMB_COLUMN_PIXBUF=ui.MainUI.THUMB_COLUMN_PIXBUF,
+		thumb_store=ui.Gtk.ListStore(object, str, ui.GdkPixbuf.Pixbuf),
+		thumb_placeholder=ui.GdkPixbuf.Pixbuf.new_from_file(ui.MainUI.THUMB_PLACEHOLDER),
+		deviceuis=[],
+		# With no batch running, as after create_all()
+		thumb_jobs=thumbs.ThumbJobs(),
+	)
+	model.load_thumb_pixbuf = lambda window: ui.MainUI.load_thumb_pixbuf(model, window)
+	return model
+	
+def run(display_name, ui, count, depth):
+	"""
+		Returns a dict of the results for a desktop of `count` windows
+	"""
+	# The windows go away again when this connection is closed
+	display = x11.get_display(display_name)
+	try:
+		expected = populate(display, count, depth)
+		
+		results = {'expected': expected}
+		results['enumerate'], windows = timed(enumerate_windows, display_name)
+		results['found'] = len(windows)
+		results['thumbs'], _ = timed(thumbs.create_all, windows)
+		
+		model = get_model(ui)
+		results['list'], _ = timed(ui.MainUI.populate_thumb_store, model, windows)
+		results['load'], _ = timed(
+			ui.MainUI.load_visible_thumbs,
+			model,
+			[win.id for win in windows],
+		)
+	finally:
+		display.close()
+	return results
+	
+def compare(previous, current, tolerance):
+	"""
+		Returns a list of messages about stages which have regressed
+	"""
+	regressions = []
+	for count, results in sorted(current.items(), key=lambda item: int(item[0])):
+		before = previous.get(count)
+		if not before:
+			continue
+		for stage in ['enumerate', 'thumbs', 'list', 'load']:
+			if not before.get(stage) or stage not in results:
+				continue
+			change = results[stage] / before[stage] - 1
+			if change > tolerance:
+				regressions.append('{} windows, {}: {:.3f}s -> {:.3f}s ({:+.0f}%)'.format(
+					count, stage, before[stage], results[stage], change * 100,
+				))
+	return regressions
+	
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('counts', nargs='*', type=int, default=COUNTS,
+		help='numbers of windows to try (default: {})'.format(COUNTS))
+	parser.add_argument('--depth', type=int, default=DEPTH,
+		help='how deeply windows are nested (default: {})'.format(DEPTH))
+	parser.add_argument('--output', default=OUTPUT_FILENAME,
+		help='JSON file of results to compare with and replace')
+	parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+		help='slowdown counted as a regression (default: {})'.format(TOLERANCE))
+	parser.add_argument('--update-baseline', action='store_true',
+		help='replace the previous results even if there are regressions')
+	args = parser.parse_args()
+	
+	# Keep the user's own thumbnails out of it
+	thumbs.CACHE_PATH = tempfile.mkdtemp(prefix='bench_desktop.')
+	display_name, xvfb = start_xvfb()
+	current = {}
+	try:
+		# Gtk needs a display by the time it's imported
+		os.environ['DISPLAY'] = display_name
+		from x112v4l2.gtk import ui
+		
+		for count in args.counts:
+			results = run(display_name, ui, count, args.depth)
+			current[str(count)] = results
+			print(
+				'{count:>6} windows ({found} found, {expected} expected): '
+				'enumerate {enumerate:.3f}s, thumbs {thumbs:.3f}s, '
+				'list {list:.3f}s, load {load:.3f}s'.format(count=count, **results)
+			)
+			if results['found'] != results['expected']:
+				print('        window filtering found the wrong number of windows!')
+	finally:
+		xvfb.terminate()
+		xvfb.wait()
+		thumbs.rmdir()
+		
+	try:
+		with open(args.output) as results_file:
+			previous = json.load(results_file).get('results', {})
+	except (OSError, ValueError):
+		previous = {}
+	regressions = compare(previous, current, args.tolerance)
+	
+	if not regressions or args.update_baseline:
+		with open(args.output, 'w') as results_file:
+			json.dump({
+				'recorded': time.time(),
+				'machine': platform.node(),
+				'python': platform.python_version(),
+				'depth': args.depth,
+				'results': dict(previous, **current),
+			}, results_file, indent='\t', sort_keys=True)
+			
+	if regressions:
+		print('Regressions since the previous results:')
+		for message in regressions:
+			print('  ' + message)
+		if not args.update_baseline:
+			print('The previous results were kept; use --update-baseline to replace them')
+		sys.exit(2)
+		
+	
+if __name__ == '__main__':
+	main()
+	
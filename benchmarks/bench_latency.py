@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+	Compare the latency of each capture profile on the same source
+	
+	Streams the given area of a screen with each profile in turn
+	(into a pipe, rather than a device) and reports how long frames
+	take from being grabbed to being written out, in milliseconds.
+	The area should be changing on every frame, eg. a playing video;
+	see x112v4l2.latency for why.
+	
+	Usage: bench_latency.py screen x y width height [fps] [seconds]
+	eg. bench_latency.py :0.0 0 0 1280 720 30 10
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from x112v4l2 import ffmpeg
+from x112v4l2 import latency
+
+
+def main():
+	if len(sys.argv) < 6:
+		print(__doc__)
+		sys.exit(1)
+	screen, x, y, width, height = sys.argv[1:6]
+	fps = int(sys.argv[6]) if len(sys.argv) > 6 else 30
+	seconds = float(sys.argv[7]) if len(sys.argv) > 7 else latency.MEASURE_SECONDS
+	command_kwargs = {
+		'source_screen': screen,
+		'source_x': x,
+		'source_y': y,
+		'source_width': width,
+		'source_height': height,
+		'output_filename': '-',
+		'fps': fps,
+	}
+	
+	baseline = None
+	for profile in ffmpeg.PROFILES:
+		stats = latency.summarise(latency.measure(
+			dict(command_kwargs, profile=profile),
+			seconds=seconds,
+		))
+		if not stats['frames']:
+			print('{:>12}: no frames could be matched; is the source changing?'.format(profile))
+			continue
+		if baseline is None:
+			baseline = stats['median']
+		print(
+			'{profile:>12}: median {median:6.1f} ms ({rel:+.1f} ms), '
+			'p95 {p95:6.1f} ms, min {min:6.1f} ms, max {max:6.1f} ms, '
+			'{frames} frames'.format(
+				profile=profile,
+				rel=stats['median'] - baseline,
+				**stats
+			)
+		)
+		
+	
+if __name__ == '__main__':
+	main()
+	
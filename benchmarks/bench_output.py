@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+	Compare the bandwidth and CPU cost of raw and MJPEG output
+	
+	For each resolution, streams a test pattern in real time through
+	each codec's output settings (as compile_command() would use them)
+	into a pipe, and reports the bytes per second written (which is
+	what the loopback device and every consumer would have to move),
+	along with the frames per second achieved and the CPU used.
+	Generating the test pattern costs the same for every codec, so
+	compare the CPU figures with each other, rather than with zero.
+	
+	Usage: bench_output.py [fps] [seconds] [mjpeg quality] [threads]
+"""
+import os
+import sys
+import time
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from x112v4l2 import ffmpeg
+from x112v4l2 import procstats
+
+
+RESOLUTIONS = [(1280, 720), (1920, 1080), (2560, 1440), (3840, 2160)]
+# What to mux each codec's stream as, for writing into a pipe
+FORMATS = {
+	ffmpeg.CODEC_RAW: 'rawvideo',
+	ffmpeg.CODEC_MJPEG: 'mjpeg',
+}
+# Ignore this long at the start, while ffmpeg gets going
+WARMUP_SECONDS = 1
+
+
+def count_bytes(pipe, counts):
+	"""
+		Read `pipe` until it's closed, adding up the bytes in `counts`
+	"""
+	while True:
+		data = pipe.read(65536)
+		if not data:
+			return
+		counts[0] += len(data)
+		
+def run(width, height, fps, codec, seconds, quality, threads):
+	"""
+		Returns (bytes per second, fps, CPU percent) of a stream
+	"""
+	started = time.monotonic()
+	proc = subprocess.Popen(
+		[
+			'ffmpeg', '-nostdin', '-loglevel', 'info', '-re',
+			'-f', 'lavfi',
+			'-i', 'testsrc2=size={}x{}:rate={}'.format(width, height, fps),
+		] + ffmpeg.get_codec_args(codec, quality=quality, threads=threads) + [
+			# Stop by itself, with time to spare for the sampling
+			'-t', str(WARMUP_SECONDS + seconds + 1),
+			'-f', FORMATS[codec], '-',
+		],
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.PIPE,
+		stderr=subprocess.PIPE,
+	)
+	counts = [0]
+	reader = threading.Thread(target=count_bytes, args=(proc.stdout, counts))
+	reader.start()
+	# Don't let the log fill up its pipe
+	log = []
+	logger = threading.Thread(target=lambda: log.append(proc.stderr.read()))
+	logger.start()
+	
+	time.sleep(WARMUP_SECONDS)
+	start = procstats.sample(proc.pid)
+	start_bytes = counts[0]
+	time.sleep(seconds)
+	end = procstats.sample(proc.pid)
+	end_bytes = counts[0]
+	proc.wait()
+	run_time = time.monotonic() - started
+	reader.join()
+	logger.join()
+	
+	progress = ffmpeg.parse_progress(log[0].decode('utf8', errors='replace')) or {}
+	if start is None or end is None:
+		return (0, 0, 0)
+	elapsed = end.time - start.time
+	return (
+		(end_bytes - start_bytes) / elapsed,
+		# Over the whole run; a stream which can't keep up runs late
+		int(progress.get('frame', 0)) / run_time,
+		(end.cpu_time - start.cpu_time) / elapsed * 100,
+	)
+	
+
+def main():
+	fps = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+	seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+	quality = int(sys.argv[3]) if len(sys.argv) > 3 else ffmpeg.MJPEG_QUALITY
+	threads = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+	print('{} fps for {}s each; MJPEG quality {}, {} threads'.format(
+		fps, seconds, quality, threads or 'auto',
+	))
+	for width, height in RESOLUTIONS:
+		baseline = None
+		for codec in ffmpeg.CODECS:
+			rate, achieved, cpu = run(width, height, fps, codec, seconds, quality, threads)
+			if baseline is None:
+				baseline = rate
+			print(
+				'{size:>10} {codec:>9}: {mbps:8.1f} MB/s ({rel:5.1f}% of raw), '
+				'{achieved:5.1f} fps, CPU {cpu:5.1f}%'.format(
+					size='{}x{}'.format(width, height),
+					codec=codec,
+					mbps=rate / 1000000,
+					rel=rate / baseline * 100 if baseline else 0,
+					achieved=achieved,
+					cpu=cpu,
+				)
+			)
+			
+		
+if __name__ == '__main__':
+	main()
+	
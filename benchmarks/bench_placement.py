@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+	Compare stream throughput under each CPU placement policy
+	
+	Runs several synthetic ffmpeg "streams" at once (a test pattern,
+	scaled and converted as a real stream would be, into a null sink)
+	and reports the frames per second each achieves under each
+	placement policy. POLICY_NONE is the unpinned baseline.
+	
+	Usage: bench_placement.py [streams] [seconds]
+"""
+import os
+import sys
+import time
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from x112v4l2 import ffmpeg
+from x112v4l2 import placement
+
+
+SOURCE = 'testsrc2=size=1920x1080:rate=1000'
+FILTERS = 'scale=width=1280:height=720'
+
+
+def run(policy, streams, seconds):
+	"""
+		Returns the fps achieved by each stream under the `policy`
+	"""
+	stream_ids = list(range(streams))
+	placements = placement.plan(stream_ids, policy=policy)
+	procs = []
+	for stream_id in stream_ids:
+		cpus = placements[stream_id] if placements else None
+		procs.append(subprocess.Popen(
+			(placement.get_command_prefix(cpus) if cpus else []) + [
+				'ffmpeg', '-nostdin', '-loglevel', 'info',
+				'-f', 'lavfi', '-i', SOURCE,
+				'-vf', FILTERS,
+				'-pix_fmt', 'yuv420p',
+				'-threads', str(len(cpus) if cpus else 0),
+				'-f', 'null', '-',
+			],
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.PIPE,
+		))
+	
+	time.sleep(seconds)
+	fps = []
+	for proc in procs:
+		proc.terminate()
+		output = proc.stderr.read().decode('utf8', errors='replace')
+		proc.wait()
+		progress = ffmpeg.parse_progress(output) or {}
+		fps.append(int(progress.get('frame', 0)) / seconds)
+	return fps
+	
+
+def main():
+	streams = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+	seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+	print('{} streams for {}s each, on {} cores'.format(
+		streams,
+		seconds,
+		len(placement.get_cores()),
+	))
+	baseline = None
+	for policy in placement.POLICIES:
+		fps = run(policy, streams, seconds)
+		total = sum(fps)
+		if baseline is None:
+			baseline = total
+		print('{policy:>10}: {total:8.1f} fps total ({rel:+.1f}%), per stream: {each}'.format(
+			policy=policy,
+			total=total,
+			rel=(total / baseline - 1) * 100 if baseline else 0,
+			each=', '.join('{:.1f}'.format(val) for val in fps),
+		))
+	
+
+if __name__ == '__main__':
+	main()
+	
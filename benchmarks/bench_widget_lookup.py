@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+	Micro-benchmark of widget lookups during refresh_output_config()
+	
+	Records which widgets refresh_output_config() looks up, then times
+	looking all of them up by each way of doing it:
+		tree walk: utils.find_child_by_id() from the device's widget,
+			as get_widget() did before the index
+		builder: Gtk.Builder.get_object() per lookup
+		indexed: the dict made once by utils.index_widgets()
+	Building the index is timed separately, as a one-off cost.
+	
+	Needs an X display for Gtk (eg. run under xvfb-run).
+"""
+import os
+import sys
+import timeit
+from concurrent import futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from x112v4l2.gtk import ui
+from x112v4l2.gtk import utils
+
+
+ROUNDS = 1000
+
+
+def get_lookups(device):
+	"""
+		Returns the names refresh_output_config() looks up, in order
+	"""
+	names = []
+	get_widget = device.get_widget
+	def recording_get_widget(name):
+		names.append(name)
+		return get_widget(name)
+		
+	device.get_widget = recording_get_widget
+	try:
+		device.handler.refresh_output_config()
+	finally:
+		del device.get_widget
+	return names
+	
+
+def main():
+	main_ui = ui.MainUI(executor=futures.ThreadPoolExecutor(max_workers=1))
+	device = main_ui.add_device(path='/dev/video99', label='Benchmark')
+	for name, value in [
+		('source_screen', ':0.0'),
+		('source_x', '0'),
+		('source_y', '0'),
+		('source_width', '1280'),
+		('source_height', '720'),
+		('output_fps', '30'),
+	]:
+		device.get_widget(name).set_text(value)
+		
+	names = get_lookups(device)
+	# A builder of the same glade file, to compare its own lookups
+	builder = ui.Gtk.Builder()
+	builder.add_from_file(device.DEVICE_GLADE)
+	index = utils.index_widgets(builder)
+	
+	def walk():
+		for name in names:
+			utils.find_child_by_id(device.widget, name)
+			
+	def get_object():
+		for name in names:
+			builder.get_object(name)
+			
+	def indexed():
+		for name in names:
+			index.get(name)
+			
+	timings = [
+		('tree walk', timeit.timeit(walk, number=ROUNDS)),
+		('builder', timeit.timeit(get_object, number=ROUNDS)),
+		('indexed', timeit.timeit(indexed, number=ROUNDS)),
+	]
+	building = timeit.timeit(lambda: utils.index_widgets(builder), number=ROUNDS)
+	
+	print('{} lookups per refresh_output_config(), x {}'.format(len(names), ROUNDS))
+	baseline = timings[0][1]
+	for label, seconds in timings:
+		print('  {:10} {:8.3f} ms/call ({:7.1f}x)'.format(
+			label + ':',
+			seconds / ROUNDS * 1000,
+			baseline / seconds,
+		))
+	print('  building the index: {:.3f} ms, once per tab'.format(building / ROUNDS * 1000))
+	
+	main_ui.executor.shutdown(wait=True)
+	
+
+if __name__ == '__main__':
+	main()
+	
@@ -0,0 +1,133 @@
+"""
+	Tests of the ffmpeg command building
+"""
+import re
+import unittest
+from unittest import mock
+
+from x112v4l2 import ffmpeg
+
+
+FILTER_RE = re.compile(r'(\w+)=([^,\[]*)')
+
+
+def get_sizes(filters, width, height):
+	"""
+		Returns a list of (filter name, input size, output size) of
+		a chain of `filters` which starts at `width`x`height`
+	"""
+	sizes = []
+	for name, options in FILTER_RE.findall(', '.join(filters)):
+		values = dict(
+			option.split('=', 1) if '=' in option else (str(idx), option)
+			for idx, option in enumerate(options.split(':'))
+		)
+		if name == 'crop':
+			out = (int(values['0']), int(values['1']))
+		elif name == 'scale':
+			out = (int(values['width']), int(values['height']))
+			if values.get('force_original_aspect_ratio') == 'decrease':
+				out = ffmpeg.get_fit_size(width, height, *out)
+		elif name == 'pad':
+			out = (int(values['width']), int(values['height']))
+		else:
+			continue
+		sizes.append((name, (width, height), out))
+		width, height = out
+	return sizes
+	
+
+class FitFiltersTest(unittest.TestCase):
+
+	SIZES = [
+		(1920, 1080), (1920, 1200), (1280, 720), (640, 480),
+		(960, 1080), (3840, 2160), (1080, 1920),
+	]
+	
+	def assert_fits(self, filters, source, output):
+		sizes = get_sizes(filters, *source)
+		for name, before, after in sizes:
+			if name == 'pad':
+				self.assertGreaterEqual(after[0], before[0], filters)
+				self.assertGreaterEqual(after[1], before[1], filters)
+		final = sizes[-1][2] if sizes else source
+		self.assertEqual(final, output, filters)
+		
+	def test_fits(self):
+		for source in self.SIZES:
+			for output in self.SIZES:
+				for scale in [True, False]:
+					for maintain_aspect in [True, False]:
+						self.assert_fits(
+							ffmpeg.get_fit_filters(
+								*source, *output,
+								scale=scale,
+								maintain_aspect=maintain_aspect,
+							),
+							source,
+							output,
+						)
+						
+	def test_composite(self):
+		regions = [
+			{'screen': ':0.0', 'x': 0, 'y': 0, 'width': 1920, 'height': 1080},
+			{'screen': ':0.0', 'x': 1920, 'y': 0, 'width': 1920, 'height': 1080},
+		]
+		for layout in [ffmpeg.LAYOUT_SIDE_BY_SIDE, ffmpeg.LAYOUT_PIP]:
+			for scale in [True, False]:
+				laid_out = ffmpeg.layout_regions(regions, layout, 1920, 1080)
+				input_args, filter_args = ffmpeg.get_composite_args(
+					laid_out, 1920, 1080, 30, scale=scale,
+				)
+				chains = [
+					chain for chain in filter_args[1].split('; ')
+					if 'crop=' in chain
+				]
+				self.assertEqual(len(chains), len(regions))
+				for chain, region in zip(chains, laid_out):
+					filters = chain.split(']', 1)[1].rsplit('[', 1)[0].split(', ')
+					self.assert_fits(
+						filters,
+						(region['width'], region['height']),
+						(region['out_width'], region['out_height']),
+					)
+					
+
+class CodecArgsTest(unittest.TestCase):
+
+	def test_quality(self):
+		args = ffmpeg.get_codec_args(ffmpeg.CODEC_MJPEG, quality='31')
+		self.assertEqual(args[args.index('-q:v') + 1], '31')
+		for quality in ['1', '32']:
+			with self.assertRaises(ValueError):
+				ffmpeg.get_codec_args(ffmpeg.CODEC_MJPEG, quality=quality)
+		# Raw streams don't have a quality
+		ffmpeg.get_codec_args(ffmpeg.CODEC_RAW, quality='32')
+		
+
+class FpsModeTest(unittest.TestCase):
+
+	def get_option(self, version):
+		ffmpeg.get_fps_mode_option.cache_clear()
+		self.addCleanup(ffmpeg.get_fps_mode_option.cache_clear)
+		with mock.patch.object(ffmpeg, 'get_version', return_value=version):
+			return ffmpeg.get_fps_mode_option()
+			
+	def test_versions(self):
+		self.assertEqual(self.get_option('4.4.2-0ubuntu0.22.04.1'), '-vsync')
+		self.assertEqual(self.get_option('n5.0.1'), '-vsync')
+		self.assertEqual(self.get_option('5.1.2'), '-fps_mode')
+		self.assertEqual(self.get_option('7.0.2-static'), '-fps_mode')
+		self.assertEqual(self.get_option('N-112345-gdeadbeef'), '-fps_mode')
+		self.assertEqual(self.get_option(None), '-fps_mode')
+		
+
+class ParseTimeTest(unittest.TestCase):
+
+	def test_times(self):
+		self.assertAlmostEqual(ffmpeg.parse_time('00:01:04.10'), 64.1)
+		self.assertAlmostEqual(ffmpeg.parse_time('01:00:00.00'), 3600)
+		self.assertAlmostEqual(ffmpeg.parse_time('-00:00:00.03'), -0.03)
+		self.assertIsNone(ffmpeg.parse_time('N/A'))
+		self.assertIsNone(ffmpeg.parse_time(None))
+		
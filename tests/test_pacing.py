@@ -0,0 +1,78 @@
+"""
+	Tests of the frame pacing analysis
+"""
+import io
+import unittest
+
+from x112v4l2 import pacing
+
+
+def get_frames(times, checksums=None):
+	"""
+		Returns (time, checksum) frames at the given `times` (in ms)
+	"""
+	if checksums is None:
+		checksums = range(len(times))
+	return [(when / 1000, checksum) for when, checksum in zip(times, checksums)]
+	
+
+class AnalyseTest(unittest.TestCase):
+
+	def test_too_few_frames(self):
+		results = pacing.analyse(get_frames([0]))
+		self.assertEqual(results['frames'], 1)
+		self.assertIsNone(results['intervals'])
+		self.assertIn('No frames', pacing.summarise(results))
+		
+	def test_even(self):
+		results = pacing.analyse(get_frames([idx * 45 for idx in range(26)]))
+		self.assertEqual(results['frames'], 26)
+		self.assertEqual(results['duplicates'], 0)
+		self.assertAlmostEqual(results['fps'], 1000 / 45)
+		intervals = results['intervals']
+		self.assertEqual(intervals['count'], 25)
+		for name in ['min', 'max', 'mean', 'p50', 'p99']:
+			self.assertAlmostEqual(intervals[name], 45)
+		self.assertAlmostEqual(intervals['jitter'], 0)
+		self.assertEqual(dict(intervals['histogram'])[50], 25)
+		
+	def test_bursts(self):
+		# 30 fps on average, but delivered in pairs
+		times = []
+		for idx in range(15):
+			times += [idx * 66.6, idx * 66.6 + 1]
+		intervals = pacing.analyse(get_frames(times))['intervals']
+		histogram = dict(intervals['histogram'])
+		self.assertEqual(histogram[5], 15)
+		self.assertEqual(histogram[70], 14)
+		self.assertGreater(intervals['jitter'], 30)
+		
+	def test_duplicates(self):
+		# Even delivery, but every frame repeated once
+		times = [idx * 20 for idx in range(21)]
+		results = pacing.analyse(get_frames(times, [idx // 2 for idx in range(21)]))
+		self.assertEqual(results['duplicates'], 10)
+		self.assertAlmostEqual(results['fps'], 50)
+		self.assertAlmostEqual(results['unique_fps'], 25)
+		self.assertAlmostEqual(results['unique_intervals']['p50'], 40)
+		# The headline is the delivery, not the content
+		summary = pacing.summarise(results)
+		self.assertIn('p50 20.0 ms', summary)
+		self.assertIn('48% duplicate', summary)
+		
+	def test_idle_source(self):
+		# A static source is all duplicates, but still evenly paced
+		results = pacing.analyse(get_frames([idx * 40 for idx in range(26)], [0] * 26))
+		self.assertEqual(results['duplicates'], 25)
+		self.assertIsNone(results['unique_intervals'])
+		self.assertAlmostEqual(results['intervals']['jitter'], 0)
+		self.assertIn('p99 40.0 ms', pacing.summarise(results))
+		self.assertNotIn('Unique', pacing.format_report(results))
+		
+	def test_read_raw(self):
+		frame_size = 4 * 2 * 3 // 2
+		data = b''.join(bytes([idx // 2]) * frame_size for idx in range(6))
+		frames = pacing.read_raw(io.BytesIO(data + b'\0'), 4, 2)
+		self.assertEqual(len(frames), 6)
+		self.assertEqual(pacing.analyse(frames)['duplicates'], 3)
+		
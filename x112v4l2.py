@@ -2,10 +2,25 @@
 """
 	Main script for the x112v4l2 application GUI
 """
+import logging
+import argparse
+
+from x112v4l2 import trace
 from x112v4l2.gtk import ui
 
 
 if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Stream X11 windows to v4l2loopback devices')
+	parser.add_argument(
+		'--trace',
+		metavar='FILENAME',
+		default=trace.FILENAME,
+		help='write a Chrome/Perfetto trace of where the time went to this file on exit',
+	)
+	args = parser.parse_args()
+	
+	logging.basicConfig(level=logging.INFO)
+	trace.start(args.trace)
 	window = ui.MainUI()
 	window.run()
 	
@@ -0,0 +1,151 @@
+"""
+	Gubbins for finding the fastest ffmpeg options for a stream
+	
+	Candidate options are trialled against the real source, writing
+	into a null sink, one option at a time: each option keeps
+	whichever value did best with the others at their best so far.
+	A trial is better if it achieves the wanted fps where the other
+	doesn't, or else if it uses less CPU (when both achieve it) or
+	gets closer to the wanted fps (when neither does).
+"""
+import time
+import signal
+import logging
+import collections
+import subprocess
+
+from x112v4l2 import ffmpeg
+from x112v4l2 import procstats
+
+
+logger = logging.getLogger(__name__)
+
+# How long to run each candidate for
+TRIAL_SECONDS = 2
+# Ignore this long at the start of each trial, while ffmpeg gets going
+WARMUP_SECONDS = 0.5
+# A trial must achieve this fraction of the wanted fps to count
+TARGET_RATIO = 0.95
+
+# The options to try, and the values to try for each.
+# The first value of each is ffmpeg's own default.
+OPTIONS = collections.OrderedDict([
+	('use_shm', [True, False]),
+	('draw_mouse', [True, False]),
+	('pix_fmt', ['yuv420p', 'yuyv422']),
+	('sws_flags', ['bicubic', 'bilinear', 'fast_bilinear', 'area', 'neighbor']),
+	('threads', [0, 1, 2]),
+])
+# If nothing achieves the wanted fps, try these fractions of it
+FPS_FACTORS = [0.75, 0.5]
+
+
+Result = collections.namedtuple('Result', [
+	'options',
+	# Achieved frames per second
+	'fps',
+	# CPU usage, where 100 is one whole core
+	'cpu_percent',
+])
+
+
+def trial(command_kwargs, options, seconds=TRIAL_SECONDS):
+	"""
+		Run ffmpeg with the given `options` into a null sink
+		
+		`command_kwargs` are passed to ffmpeg.compile_command(),
+		along with the `options`.
+		Returns a Result, with an fps of 0 if ffmpeg failed.
+	"""
+	kwargs = dict(command_kwargs)
+	kwargs.update(options)
+	kwargs.update(
+		output_filename='-',
+		output_format='null',
+		loglevel='info',
+		record_filename=None,
+	)
+	proc = subprocess.Popen(
+		['ffmpeg', '-nostdin'] + ffmpeg.compile_command(**kwargs)[1:],
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.PIPE,
+	)
+	time.sleep(WARMUP_SECONDS)
+	start = procstats.sample(proc.pid)
+	time.sleep(seconds)
+	end = procstats.sample(proc.pid)
+	proc.send_signal(signal.SIGINT)
+	try:
+		output = proc.communicate(timeout=5)[1]
+	except subprocess.TimeoutExpired:
+		proc.kill()
+		output = proc.communicate()[1]
+		
+	progress = ffmpeg.parse_progress(output.decode('utf8', errors='replace'))
+	if start is None or end is None or not progress:
+		# ffmpeg fell over before the end of the trial
+		return Result(options=options, fps=0, cpu_percent=0)
+	elapsed = end.time - start.time
+	# The progress is of the whole run, so discount the warmup
+	frames = int(progress.get('frame', 0))
+	return Result(
+		options=options,
+		fps=frames / (elapsed + WARMUP_SECONDS),
+		cpu_percent=(end.cpu_time - start.cpu_time) / elapsed * 100,
+	)
+	
+def is_better(result, than, fps):
+	"""
+		Whether `result` beats the `than` result, for a wanted `fps`
+	"""
+	if than is None:
+		return result.fps > 0
+	target = fps * TARGET_RATIO
+	if (result.fps >= target) != (than.fps >= target):
+		return result.fps >= target
+	if result.fps >= target:
+		return result.cpu_percent < than.cpu_percent
+	return result.fps > than.fps
+	
+def tune(command_kwargs, seconds=TRIAL_SECONDS):
+	"""
+		Find the fastest working options for a stream
+		
+		`command_kwargs` should be the arguments to pass to
+		ffmpeg.compile_command() for the stream, including its
+		(non-zero) fps.
+		Returns the best Result, whose options include the fps to
+		use, or None if nothing worked at all.
+	"""
+	fps = int(command_kwargs['fps'])
+	if not fps:
+		raise ValueError('Can only tune streams with a limited fps')
+	best_options = {name: values[0] for name, values in OPTIONS.items()}
+	best = trial(command_kwargs, dict(best_options, fps=fps), seconds)
+	if not best.fps:
+		best = None
+		
+	for name, values in OPTIONS.items():
+		for value in values:
+			if value == best_options[name]:
+				continue
+			options = dict(best_options, fps=fps)
+			options[name] = value
+			result = trial(command_kwargs, options, seconds)
+			logger.debug('Trialled %r: %r', options, result)
+			if is_better(result, best, fps):
+				best = result
+				best_options[name] = value
+				
+	if best is not None and best.fps < fps * TARGET_RATIO:
+		# Even the best couldn't keep up; see what it can manage
+		for factor in FPS_FACTORS:
+			options = dict(best.options, fps=max(1, int(fps * factor)))
+			result = trial(command_kwargs, options, seconds)
+			if result.fps >= options['fps'] * TARGET_RATIO:
+				best = result
+				break
+				
+	return best
+	
@@ -0,0 +1,155 @@
+"""
+	Gubbins for estimating how many streams this machine can handle
+	
+	The cost of a stream is modelled as the number of source pixels
+	it processes per second, divided by how many pixels per second
+	one core can manage in the stream's scaling mode.
+	The latter rates are calibrated by timing ffmpeg on this machine.
+"""
+import os
+import json
+import time
+import subprocess
+
+from x112v4l2 import ffmpeg
+
+
+# Scaling modes
+MODE_CONVERT = 'convert'
+MODE_SCALE = 'scale'
+MODES = [MODE_CONVERT, MODE_SCALE]
+
+# What to do when starting a stream would exceed capacity
+ADMISSION_OFF = 'off'
+ADMISSION_WARN = 'warn'
+ADMISSION_REFUSE = 'refuse'
+ADMISSION = os.environ.get('X112V4L2_ADMISSION') or ADMISSION_WARN
+# Only plan to use this fraction of the available cores
+HEADROOM = 0.8
+
+# Whether to lower the fps of streams which are dropping frames
+DEGRADE = bool(os.environ.get('X112V4L2_DEGRADE'))
+# Degrade when more than this fraction of frames are dropped...
+DEGRADE_DROP_RATE = 0.05
+# ...but no more often than once every this many seconds
+DEGRADE_COOLDOWN = 10
+# Each degradation multiplies the fps by this, down to MIN_FPS
+DEGRADE_FPS_FACTOR = 0.75
+MIN_FPS = 5
+# The fps assumed for streams with no fps limit
+UNLIMITED_FPS = 120
+
+# Conservative guesses of pixels per second per core,
+# for use until calibration has been done
+DEFAULT_RATES = {
+	MODE_CONVERT: 150e6,
+	MODE_SCALE: 50e6,
+}
+CALIBRATION_SIZE = (1280, 720)
+CALIBRATION_FRAMES = 600
+CACHE_FILENAME = os.path.join(
+	os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+	'x112v4l2',
+	'capacity.json',
+)
+
+
+def get_mode(source_width, source_height, output_width, output_height, composite=False):
+	"""
+		Returns the scaling mode of a stream with the given dimensions
+	"""
+	if composite:
+		return MODE_SCALE
+	if (source_width, source_height) == (output_width, output_height):
+		return MODE_CONVERT
+	return MODE_SCALE
+	
+def get_cost(pixels, fps, mode, rates=DEFAULT_RATES):
+	"""
+		Returns how many cores a stream is expected to keep busy
+		
+		`pixels` is how many source pixels are grabbed per frame;
+		for a composite stream, that's the grabs of all its regions.
+	"""
+	return pixels * fps / rates[mode]
+	
+def get_budget(cores=None):
+	"""
+		Returns how many cores' worth of streams we're prepared to run
+	"""
+	if cores is None:
+		cores = len(os.sched_getaffinity(0))
+	return cores * HEADROOM
+	
+
+def measure_rate(mode, size=CALIBRATION_SIZE, frames=CALIBRATION_FRAMES):
+	"""
+		Time ffmpeg processing `frames` in the given `mode` on one thread
+		
+		Returns the number of source pixels per second achieved.
+	"""
+	width, height = size
+	filters = ['format=bgr0']
+	if mode == MODE_SCALE:
+		filters.append('scale=width={w}:height={h}'.format(w=width * 2 // 3, h=height * 2 // 3))
+	# A static source is cheap to generate, so we mostly
+	# measure the conversion/scaling, as x11grab would need
+	proc = subprocess.Popen(
+		[
+			'ffmpeg', '-nostdin', '-loglevel', 'info',
+			'-f', 'lavfi', '-i', 'color=size={w}x{h}:rate=1000'.format(w=width, h=height),
+			'-frames:v', str(frames),
+			'-vf', ', '.join(filters),
+			'-pix_fmt', 'yuv420p',
+			'-threads', '1',
+			'-filter_threads', '1',
+			'-f', 'null', '-',
+		],
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.PIPE,
+	)
+	started = time.monotonic()
+	output = proc.communicate()[1].decode('utf8', errors='replace')
+	elapsed = time.monotonic() - started
+	progress = ffmpeg.parse_progress(output) or {}
+	frames = int(progress.get('frame', 0))
+	return frames * width * height / elapsed
+	
+def calibrate():
+	"""
+		Measure the pixel rates of this machine, and cache them
+		
+		Returns a dict of {mode: pixels per second per core}.
+	"""
+	rates = {mode: measure_rate(mode) for mode in MODES}
+	if not all(rates.values()):
+		# Something went wrong; don't cache nonsense
+		return dict(DEFAULT_RATES)
+	os.makedirs(os.path.dirname(CACHE_FILENAME), exist_ok=True)
+	with open(CACHE_FILENAME, 'w') as cache_file:
+		json.dump(rates, cache_file)
+	return rates
+	
+def load_rates():
+	"""
+		Returns previously calibrated rates, or None
+	"""
+	try:
+		with open(CACHE_FILENAME) as cache_file:
+			rates = json.load(cache_file)
+	except (OSError, ValueError):
+		return None
+	if set(rates) != set(MODES):
+		return None
+	return rates
+	
+
+def get_degraded_fps(fps):
+	"""
+		Returns a lower fps to try, or None if it can't go lower
+	"""
+	new_fps = max(MIN_FPS, int(fps * DEGRADE_FPS_FACTOR))
+	if new_fps >= fps:
+		return None
+	return new_fps
+	
@@ -0,0 +1,66 @@
+"""
+	Gubbins for remembering settings between runs
+	
+	Settings are kept per device, keyed on the device's path, in a
+	JSON file under the user's config directory.
+"""
+import os
+import json
+
+
+CONFIG_FILENAME = os.path.join(
+	os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config'),
+	'x112v4l2',
+	'devices.json',
+)
+
+
+def load(filename=CONFIG_FILENAME):
+	"""
+		Returns a dict of {device path: settings dict}
+		
+		A missing or unreadable file gives an empty dict.
+	"""
+	try:
+		with open(filename) as config_file:
+			config = json.load(config_file)
+	except (OSError, ValueError):
+		return {}
+	if not isinstance(config, dict):
+		return {}
+	return config
+	
+def save(config, filename=CONFIG_FILENAME):
+	"""
+		Write out the given dict of {device path: settings dict}
+		
+		The file is replaced atomically, so a crash can't leave it
+		half-written.
+	"""
+	os.makedirs(os.path.dirname(filename), exist_ok=True)
+	temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+	with open(temp_filename, 'w') as config_file:
+		json.dump(config, config_file, indent='\t', sort_keys=True)
+	os.replace(temp_filename, filename)
+	
+def get_device(path, filename=CONFIG_FILENAME):
+	"""
+		Returns the settings dict of the device at `path`
+	"""
+	return load(filename).get(path, {})
+	
+def update_device(path, filename=CONFIG_FILENAME, **settings):
+	"""
+		Change some of the settings of the device at `path`
+		
+		Settings with a value of None are removed.
+	"""
+	config = load(filename)
+	device = config.setdefault(path, {})
+	for key, value in settings.items():
+		if value is None:
+			device.pop(key, None)
+		else:
+			device[key] = value
+	save(config, filename)
+	
@@ -0,0 +1,201 @@
+"""
+	Gubbins for controlling a running app over a local socket
+	
+	The app listens on a Unix socket, named by the
+	X112V4L2_CONTROL_SOCKET environment variable; any "{pid}" in the
+	name is replaced by the app's process ID, so that several
+	instances can run at once.
+	
+	The protocol is one JSON object per line, in both directions.
+	Requests look like:
+		{"id": 1, "method": "start", "params": {"path": "/dev/video0"}}
+	and responses like:
+		{"id": 1, "result": ...}
+	or, if something went wrong:
+		{"id": 1, "error": "No such device: /dev/video9"}
+	Connections can be kept open for any number of requests.
+	The methods are list_devices, get_device, get_stats,
+	search_windows, start, stop, restart and set_source; see
+	x112v4l2.gtk.api for their params.
+	
+	From the command line:
+		python3 -m x112v4l2.control SOCKET METHOD [NAME=VALUE ...]
+	where each VALUE is JSON, or else a plain string.
+"""
+import os
+import sys
+import json
+import stat
+import errno
+import socket
+import logging
+import threading
+import socketserver
+
+
+SOCKET_PATH = os.environ.get('X112V4L2_CONTROL_SOCKET') or None
+# Seconds to wait for the UI to carry out a request
+TIMEOUT = 5
+
+logger = logging.getLogger(__name__)
+
+class ControlError(Exception):
+	"""
+		A request couldn't be carried out; the message goes back to the client
+	"""
+	
+
+class Handler(socketserver.StreamRequestHandler):
+	"""
+		Answers each line of JSON on a connection
+	"""
+	def handle(self):
+		for line in self.rfile:
+			if not line.strip():
+				continue
+			request_id = None
+			try:
+				request = json.loads(line.decode('utf8'))
+				if not isinstance(request, dict):
+					raise ControlError('Requests should be JSON objects')
+				request_id = request.get('id')
+				params = request.get('params') or {}
+				if not isinstance(params, dict):
+					raise ControlError('The params should be a JSON object')
+				result = self.server.dispatch(str(request.get('method')), params)
+				response = {'id': request_id, 'result': result}
+			except (ControlError, ValueError, TypeError) as exc:
+				response = {'id': request_id, 'error': str(exc)}
+			except Exception as exc:
+				# Not the client's fault, but they still deserve an answer
+				logger.exception('Control request failed: %r', line)
+				response = {
+					'id': request_id,
+					'error': '{}: {}'.format(type(exc).__name__, exc),
+				}
+			self.wfile.write(json.dumps(response).encode('utf8') + b'\n')
+			
+		
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+	
+
+class ControlServer(object):
+	"""
+		Serves control requests on a Unix socket, from its own thread
+		
+		Requests are passed to `dispatch(method, params)` on the
+		connection's thread; whatever it returns (which must be
+		JSON-able) is sent back. It should raise ControlError for
+		bad requests.
+	"""
+	def __init__(self, path, dispatch):
+		self.path = path
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		remove_stale_socket(path)
+		# Nobody else gets a chance to connect before it's ours alone
+		umask = os.umask(0o077)
+		try:
+			self.server = UnixServer(path, Handler)
+		finally:
+			os.umask(umask)
+		self.server.dispatch = dispatch
+		os.chmod(path, 0o600)
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+		try:
+			os.unlink(self.path)
+		except FileNotFoundError:
+			pass
+			
+		
+def remove_stale_socket(path):
+	"""
+		Remove a socket left at `path` by an instance which didn't
+		clean up after itself
+		
+		Raises OSError if something else is there, including a
+		socket which is still being listened on.
+	"""
+	try:
+		mode = os.stat(path).st_mode
+	except FileNotFoundError:
+		return
+	if not stat.S_ISSOCK(mode):
+		raise OSError(errno.EEXIST, 'Not a socket', path)
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		try:
+			sock.connect(path)
+		except ConnectionRefusedError:
+			# Nobody's listening
+			os.unlink(path)
+			return
+	raise OSError(errno.EADDRINUSE, 'Another instance is listening', path)
+	
+def start(dispatch, path=SOCKET_PATH):
+	"""
+		Start serving control requests, if there's a socket `path`
+		
+		Returns a list of servers, each of which has a stop() method.
+		If the socket can't be served, that's logged and the app
+		carries on without.
+	"""
+	if not path:
+		return []
+	path = path.format(pid=os.getpid())
+	try:
+		return [ControlServer(path, dispatch)]
+	except OSError as exc:
+		logger.error('Unable to serve control requests on %s: %s', path, exc)
+		return []
+	
+def request(path, method, **params):
+	"""
+		Make a single request of the app listening on `path`
+		
+		Returns the result, or raises ControlError.
+	"""
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.settimeout(TIMEOUT * 2)
+		sock.connect(path)
+		sock.sendall(json.dumps({
+			'id': 0,
+			'method': method,
+			'params': params,
+		}).encode('utf8') + b'\n')
+		with sock.makefile('rb') as responses:
+			line = responses.readline()
+	if not line:
+		raise ControlError('No response')
+	response = json.loads(line.decode('utf8'))
+	if 'error' in response:
+		raise ControlError(response['error'])
+	return response.get('result')
+	
+
+def main(args):
+	if len(args) < 2:
+		print(__doc__)
+		return 1
+	params = {}
+	for arg in args[2:]:
+		name, _, value = arg.partition('=')
+		try:
+			params[name] = json.loads(value)
+		except ValueError:
+			params[name] = value
+	try:
+		result = request(args[0], args[1], **params)
+	except ControlError as exc:
+		print('Error: {}'.format(exc), file=sys.stderr)
+		return 1
+	print(json.dumps(result, indent='\t', sort_keys=True))
+	return 0
+	
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
+	
@@ -1,10 +1,58 @@
 """
 	Gubbins for interfacing with ffmpeg
 """
+import re
 import math
+import functools
 import subprocess
 
 
+# Ways of laying out multiple source regions in one output
+LAYOUT_SIDE_BY_SIDE = 'side-by-side'
+LAYOUT_PIP = 'pip'
+# Picture-in-picture insets are this fraction of the output size
+PIP_SCALE = 0.3
+
+# The first ffmpeg to have -fps_mode, rather than -vsync
+FPS_MODE_VERSION = (5, 1)
+
+# Capture profiles
+PROFILE_DEFAULT = 'default'
+PROFILE_LOW_LATENCY = 'low-latency'
+PROFILES = [PROFILE_DEFAULT, PROFILE_LOW_LATENCY]
+
+# Stream codecs
+CODEC_RAW = 'rawvideo'
+CODEC_MJPEG = 'mjpeg'
+CODECS = [CODEC_RAW, CODEC_MJPEG]
+# MJPEG quality, from 2 (best) to 31 (smallest)
+MJPEG_QUALITY = 5
+MJPEG_QUALITY_BEST = 2
+MJPEG_QUALITY_WORST = 31
+# MJPEG wants full-range formats; these match the raw ones
+MJPEG_PIX_FMTS = {
+	'yuv420p': 'yuvj420p',
+	'yuyv422': 'yuvj422p',
+}
+
+# Encoding settings for recordings; cheap on CPU, rather than small
+RECORD_ARGS = [
+	'-c:v', 'libx264',
+	'-preset', 'ultrafast',
+	'-crf', '23',
+	'-pix_fmt', 'yuv420p',
+]
+
+# The crop filter which picks the source out of a retargetable stream
+RETARGET_FILTER = 'crop@source'
+# Seconds ahead of the stream to queue retargeting commands for, so
+# that they've all been read by the time they take effect; ffmpeg
+# reads a command from stdin at most every 100ms
+RETARGET_DELAY = 0.6
+
+# Matches the key=value pairs of ffmpeg's progress reports
+PROGRESS_RE = re.compile(r'(\w+)=\s*(\S+)')
+
 def get_version():
 	"""
 		Get the version of ffmpeg which is installed
@@ -27,6 +75,390 @@ def get_version():
 	# Uhh, dunno
 	return '<Unknown>'
 	
+@functools.lru_cache()
+def get_fps_mode_option():
+	"""
+		Returns the option which sets how output frames are timed
+		
+		ffmpeg 5.1 renamed -vsync to -fps_mode; newer versions warn
+		about the old name, and older ones don't know the new one.
+		Versions which can't be parsed (eg. git builds) are taken
+		to be new.
+	"""
+	try:
+		version = get_version()
+	except OSError:
+		version = None
+	found = re.match(r'n?(\d+)\.(\d+)', version or '')
+	if found and (int(found.group(1)), int(found.group(2))) < FPS_MODE_VERSION:
+		return '-vsync'
+	return '-fps_mode'
+	
+
+def get_grab_args(
+	screen, x, y, width, height, fps,
+	use_shm=None,
+	draw_mouse=None,
+	profile=PROFILE_DEFAULT,
+):
+	"""
+		Returns ffmpeg input arguments to grab an area of a screen
+		
+		The x11grab `use_shm` and `draw_mouse` options are only
+		given to ffmpeg if they're not None.
+		Any input arguments of the `profile` are included.
+		
+		If the `width` and `height` are None, the whole screen is
+		grabbed.
+	"""
+	grab_args = list(get_profile_args(profile)[0])
+	if use_shm is not None:
+		grab_args += ['-use_shm', str(int(use_shm))]
+	if draw_mouse is not None:
+		grab_args += ['-draw_mouse', str(int(draw_mouse))]
+	grab_args += [
+		'-f', 'x11grab',
+		# NB. High framerate for screenshots, so we're not left waiting
+		'-framerate', str(fps if fps else 120),
+	]
+	if width is not None and height is not None:
+		grab_args += ['-s', '{w}x{h}'.format(w=width, h=height)]
+	return grab_args + [
+		'-i', '{screen}+{x},{y}'.format(
+			screen=getattr(screen, 'full_id', screen),
+			x=x,
+			y=y,
+		),
+	]
+	
+def get_codec_args(codec=CODEC_RAW, pix_fmt='yuv420p', quality=None, threads=0):
+	"""
+		Returns ffmpeg output arguments to encode a stream
+		
+		Raw streams are written in the given `pix_fmt`. MJPEG streams
+		use the nearest full-range equivalent, at the given `quality`
+		(by default, MJPEG_QUALITY).
+		The number of encoding `threads` can be limited; 0 lets
+		ffmpeg decide.
+	"""
+	if codec == CODEC_RAW:
+		codec_args = ['-vcodec', CODEC_RAW, '-pix_fmt', pix_fmt]
+	elif codec == CODEC_MJPEG:
+		quality = int(quality or MJPEG_QUALITY)
+		if not MJPEG_QUALITY_BEST <= quality <= MJPEG_QUALITY_WORST:
+			raise ValueError('MJPEG quality should be from {} to {}'.format(
+				MJPEG_QUALITY_BEST, MJPEG_QUALITY_WORST,
+			))
+		codec_args = [
+			'-vcodec', CODEC_MJPEG,
+			'-pix_fmt', MJPEG_PIX_FMTS.get(pix_fmt, 'yuvj420p'),
+			'-q:v', str(quality),
+		]
+	else:
+		raise ValueError('Unknown codec: {!r}'.format(codec))
+	return codec_args + ['-threads', str(int(threads))]
+	
+def get_profile_args(profile):
+	"""
+		Returns extra (input, output) ffmpeg arguments for a profile
+		
+		PROFILE_LOW_LATENCY trades smoothness for latency: it stops
+		ffmpeg probing and queueing input, passes frames through as
+		they're grabbed rather than holding/duplicating them to keep
+		a constant rate, and flushes every frame straight out.
+	"""
+	if profile == PROFILE_DEFAULT:
+		return ([], [])
+	if profile == PROFILE_LOW_LATENCY:
+		return (
+			[
+				'-fflags', 'nobuffer',
+				'-probesize', '32',
+				'-analyzeduration', '0',
+				'-thread_queue_size', '1',
+			],
+			[
+				'-flags', 'low_delay',
+				get_fps_mode_option(), 'passthrough',
+				'-max_delay', '0',
+				'-flush_packets', '1',
+			],
+		)
+	raise ValueError('Unknown profile: {!r}'.format(profile))
+	
+def get_fit_size(source_width, source_height, output_width, output_height):
+	"""
+		Returns the (width, height) a source is scaled to, to fit
+		inside an output while keeping its aspect ratio
+		
+		This is what ffmpeg's force_original_aspect_ratio=decrease
+		makes of it.
+	"""
+	def rescale(value, num, den):
+		# Rounded to the nearest, as ffmpeg's av_rescale()
+		return (value * num + den // 2) // den
+		
+	return (
+		min(output_width, rescale(output_height, source_width, source_height)),
+		min(output_height, rescale(output_width, source_height, source_width)),
+	)
+	
+def get_fit_filters(
+	source_width, source_height,
+	output_width, output_height,
+	scale=True,
+	maintain_aspect=True,
+	sws_flags=None,
+):
+	"""
+		Returns a list of filters which fit a source into an output
+		
+		See compile_command() for the meanings of `scale` and
+		`maintain_aspect`. A source which is bigger than the output
+		in either dimension is always scaled down to fit, since it
+		can't be padded out to a smaller size.
+		Any scaling is done with the given `sws_flags`.
+	"""
+	filters = []
+	if output_width == source_width and output_height == source_height:
+		return filters
+	flags = ':flags={}'.format(sws_flags) if sws_flags else ''
+	
+	if scale and not maintain_aspect:
+		# Stretch to fit
+		filters.append(
+			'scale=width={w}:height={h}{flags}'.format(
+				w=output_width,
+				h=output_height,
+				flags=flags,
+			)
+		)
+		return filters
+		
+	fit_size = (source_width, source_height)
+	if scale or source_width > output_width or source_height > output_height:
+		fit_size = get_fit_size(source_width, source_height, output_width, output_height)
+	if fit_size != (source_width, source_height):
+		# Scale the video
+		filters.append(
+			'scale=width={w}:height={h}:force_original_aspect_ratio=decrease{flags}'.format(
+				w=output_width,
+				h=output_height,
+				flags=flags,
+			)
+		)
+	if fit_size != (output_width, output_height):
+		# Apply padding
+		filters.append(
+			'pad=width={w}:height={h}:x=(ow-iw)/2:y=(oh-ih)/2'.format(
+				w=output_width,
+				h=output_height,
+			)
+		)
+	return filters
+	
+
+def layout_regions(regions, layout, output_width, output_height):
+	"""
+		Decide where in the output each source region should go
+		
+		`regions` should be an iterable of dicts, each providing the
+		screen, x, y, width and height of an area to capture.
+		
+		With LAYOUT_SIDE_BY_SIDE, the output is divided into equal
+		columns, one per region.
+		With LAYOUT_PIP, the first region fills the output, and the
+		rest are stacked up as insets in the bottom-right corner.
+		
+		Returns a list of copies of the `regions`, with the addition
+		of out_x, out_y, out_width and out_height values.
+	"""
+	regions = [dict(region) for region in regions]
+	output_width = int(output_width)
+	output_height = int(output_height)
+	if layout == LAYOUT_PIP:
+		inset_width = math.ceil(output_width * PIP_SCALE / 2) * 2
+		inset_height = math.ceil(output_height * PIP_SCALE / 2) * 2
+		for idx, region in enumerate(regions):
+			if not idx:
+				region.update(
+					out_x=0, out_y=0,
+					out_width=output_width, out_height=output_height,
+				)
+				continue
+			region.update(
+				out_x=output_width - inset_width,
+				out_y=max(0, output_height - inset_height * idx),
+				out_width=inset_width,
+				out_height=inset_height,
+			)
+		
+	elif layout == LAYOUT_SIDE_BY_SIDE:
+		column_width = math.floor(output_width / len(regions) / 2) * 2
+		for idx, region in enumerate(regions):
+			region.update(
+				out_x=column_width * idx, out_y=0,
+				out_width=column_width, out_height=output_height,
+			)
+		
+	else:
+		raise ValueError('Unknown layout: {!r}'.format(layout))
+	
+	return regions
+	
+def get_grab_areas(regions):
+	"""
+		Returns the smallest area of each screen covering all `regions`
+		
+		The return value is a dict of {screen_id: (x, y, width, height)}
+	"""
+	bounds = {}
+	for region in regions:
+		screen = getattr(region['screen'], 'full_id', region['screen'])
+		left = int(region['x'])
+		top = int(region['y'])
+		right = left + int(region['width'])
+		bottom = top + int(region['height'])
+		if screen in bounds:
+			old = bounds[screen]
+			left = min(left, old[0])
+			top = min(top, old[1])
+			right = max(right, old[2])
+			bottom = max(bottom, old[3])
+		bounds[screen] = (left, top, right, bottom)
+	
+	return {
+		screen: (left, top, right - left, bottom - top)
+		for screen, (left, top, right, bottom) in bounds.items()
+	}
+	
+def get_grab_cost(regions):
+	"""
+		Compare the cost of one grab per screen with one per region
+		
+		Returns a 2-tuple of the number of pixels captured per frame
+		when grabbing the area covering the `regions` on each screen,
+		and when grabbing each region separately.
+		NB. If regions are far apart, the single grab can be bigger!
+	"""
+	combined = sum(
+		width * height
+		for x, y, width, height in get_grab_areas(regions).values()
+	)
+	separate = sum(
+		int(region['width']) * int(region['height'])
+		for region in regions
+	)
+	return (combined, separate)
+	
+def get_composite_args(
+	regions, output_width, output_height, fps,
+	scale=True,
+	maintain_aspect=True,
+	sws_flags=None,
+	**grab_kwargs
+):
+	"""
+		Returns ffmpeg arguments to composite `regions` into one output
+		
+		The `regions` should have been through layout_regions().
+		Each screen is grabbed only once, with each region cropped
+		out of the grab, fitted into its place (as for
+		get_fit_filters()), and overlaid onto a blank background.
+		
+		Any `grab_kwargs` are passed on to get_grab_args().
+		Returns a 2-tuple of (input arguments, filter arguments).
+	"""
+	areas = get_grab_areas(regions)
+	screens = list(areas)
+	input_args = []
+	for screen in screens:
+		input_args += get_grab_args(screen, *areas[screen], fps=fps, **grab_kwargs)
+	
+	graph = [
+		'color=c=black:s={w}x{h}:r={fps}[base0]'.format(
+			w=output_width,
+			h=output_height,
+			fps=fps if fps else 120,
+		),
+	]
+	# Split each grab into as many copies as there are regions on it
+	splits = {}
+	for screen in screens:
+		count = sum(
+			1 for region in regions
+			if getattr(region['screen'], 'full_id', region['screen']) == screen
+		)
+		idx = screens.index(screen)
+		splits[screen] = ['grab{}_{}'.format(idx, num) for num in range(count)]
+		graph.append('[{idx}:v]split={count}{outs}'.format(
+			idx=idx,
+			count=count,
+			outs=''.join('[{}]'.format(name) for name in splits[screen]),
+		))
+	
+	for idx, region in enumerate(regions):
+		screen = getattr(region['screen'], 'full_id', region['screen'])
+		area = areas[screen]
+		width = int(region['width'])
+		height = int(region['height'])
+		filters = ['crop={w}:{h}:{x}:{y}'.format(
+			w=width,
+			h=height,
+			x=int(region['x']) - area[0],
+			y=int(region['y']) - area[1],
+		)]
+		filters += get_fit_filters(
+			width, height,
+			int(region['out_width']), int(region['out_height']),
+			scale=scale,
+			maintain_aspect=maintain_aspect,
+			sws_flags=sws_flags,
+		)
+		graph.append('[{grab}]{filters}[region{idx}]'.format(
+			grab=splits[screen].pop(0),
+			filters=', '.join(filters),
+			idx=idx,
+		))
+		graph.append(
+			'[base{idx}][region{idx}]overlay=x={x}:y={y}:shortest=1[{out}]'.format(
+				idx=idx,
+				x=int(region['out_x']),
+				y=int(region['out_y']),
+				out='base{}'.format(idx + 1) if idx + 1 < len(regions) else 'out',
+			)
+		)
+	
+	return (input_args, ['-filter_complex', '; '.join(graph), '-map', '[out]'])
+	
+
+def parse_progress(output):
+	"""
+		Extract the most recent progress report from ffmpeg output
+		
+		ffmpeg periodically writes lines to stderr like:
+			frame=  123 fps= 30 q=-0.0 size=N/A time=00:00:04.10 ... drop=0
+		Returns a dict of the key/values (as strings) from the last
+		such line in the `output` text, or None if there isn't one.
+	"""
+	start = output.rfind('frame=')
+	if start < 0:
+		return None
+	line = re.split('[\r\n]', output[start:], 1)[0]
+	return dict(PROGRESS_RE.findall(line))
+	
+def parse_time(text):
+	"""
+		Returns the seconds of a progress report's time (eg.
+		"00:01:04.10"), or None if there isn't one (eg. "N/A")
+	"""
+	found = re.match(r'(-?)(\d+):(\d+):(\d+(?:\.\d+)?)$', text or '')
+	if not found:
+		return None
+	sign, hours, minutes, seconds = found.groups()
+	value = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+	return -value if sign else value
+	
 
 def compile_command(
 	source_screen, source_x, source_y, source_width, source_height,
@@ -37,6 +469,20 @@ def compile_command(
 	scale=True,
 	maintain_aspect=True,
 	loglevel='error',
+	regions=None,
+	threads=0,
+	pix_fmt='yuv420p',
+	sws_flags=None,
+	use_shm=None,
+	draw_mouse=None,
+	output_format='v4l2',
+	profile=PROFILE_DEFAULT,
+	extra_filters=None,
+	record_filename=None,
+	record_args=None,
+	retarget=False,
+	codec=CODEC_RAW,
+	quality=None,
 ):
 	"""
 		Build an ffmpeg command suitable for the given arguments
@@ -59,6 +505,35 @@ def compile_command(
 		have pillar/letterbox padding added.
 		Otherwise, the source will be stretched to fit the specified
 		output resolution.
+		
+		To composite several areas into the one output, supply a list
+		of `regions` from layout_regions(); they are used instead of
+		the single source rectangle.
+		
+		The number of `threads` ffmpeg uses for encoding can be
+		limited (eg. to the number of CPUs it's allowed); 0 lets
+		ffmpeg decide.
+		
+		Streams are encoded with the given `codec` (see
+		get_codec_args() for it and `quality`).
+		A stream's `pix_fmt`, the scaler's `sws_flags`, and the
+		x11grab `use_shm` and `draw_mouse` options can be tuned for
+		speed; None leaves them at ffmpeg's defaults.
+		Streams are written in the given `output_format`, which can
+		be 'null' (with an `output_filename` of '-') for testing.
+		
+		The `profile` is one of PROFILES; see get_profile_args().
+		Any `extra_filters` are added to the end of a single source's
+		filters (eg. for measuring the stream).
+		
+		If a `record_filename` is given, a stream is also recorded
+		to that file, encoded with the `record_args` (by default,
+		RECORD_ARGS). The one capture is split after filtering, so
+		recording costs an encode, but not another grab or scale.
+		
+		If `retarget` is True, a single source stream grabs the whole
+		screen and crops the source out of it, so that the source can
+		be moved while the stream is running; see get_retarget_input().
 	"""
 	# Validation/defaulting
 	if not output_width:
@@ -77,49 +552,91 @@ def compile_command(
 	input_args = [
 		'ffmpeg',
 		'-loglevel', loglevel,
-		# Input options
-		'-f', 'x11grab',
-		# NB. High framerate for screenshots, so we're not left waiting
-		'-framerate', str(fps if fps else 120),
-		'-s', '{w}x{h}'.format(w=source_width, h=source_height),
-		'-i', '{screen}+{x},{y}'.format(
-			screen=getattr(source_screen, 'full_id', source_screen),
-			x=source_x,
-			y=source_y,
-		),
 	]
 	
-	# Filters (eg. scaling, letterboxing, etc.)
-	filter_args = []
-	if output_width != source_width or output_height != source_height:
-		if scale and not maintain_aspect:
-			# Stretch to fit
-			filter_args.append(
-				'scale=width={w}:height={h}'.format(w=output_width, h=output_height)
-			)
-			
-		else:
-			if scale and output_width != source_width and output_height != source_height:
-				# Scale the video
-				filter_args.append(
-					'scale=width={w}:height={h}:force_original_aspect_ratio=decrease'.format(
-						w=output_width,
-						h=output_height,
-					)
-				)
-			source_aspect = source_width / source_height
-			output_aspect = output_width / output_height
-			if not scale or source_aspect != output_aspect:
-				# Apply padding
-				filter_args.append(
-					'pad=width={w}:height={h}:x=(ow-iw)/2:y=(oh-ih)/2'.format(
-						w=output_width,
-						h=output_height,
-					)
-				)
+	if regions:
+		grab_args, filter_args = get_composite_args(
+			regions,
+			output_width,
+			output_height,
+			fps,
+			scale=scale,
+			maintain_aspect=maintain_aspect,
+			sws_flags=sws_flags,
+			use_shm=use_shm,
+			draw_mouse=draw_mouse,
+			profile=profile,
+		)
+		input_args += grab_args
+		
+	elif retarget and fps:
+		input_args += get_grab_args(
+			source_screen, 0, 0, None, None, fps,
+			use_shm=use_shm,
+			draw_mouse=draw_mouse,
+			profile=profile,
+		)
+		filter_args = ['{filter}=w={w}:h={h}:x={x}:y={y}'.format(
+			filter=RETARGET_FILTER,
+			w=source_width,
+			h=source_height,
+			x=source_x,
+			y=source_y,
+		)]
+		
+	else:
+		input_args += get_grab_args(
+			source_screen,
+			source_x,
+			source_y,
+			source_width,
+			source_height,
+			fps,
+			use_shm=use_shm,
+			draw_mouse=draw_mouse,
+			profile=profile,
+		)
+		filter_args = []
 		
-	if filter_args:
-		filter_args = ['-vf', ', '.join(filter_args)]
+	if not regions:
+		# Filters (eg. scaling, letterboxing, etc.)
+		filter_args += get_fit_filters(
+			source_width, source_height,
+			output_width, output_height,
+			scale=scale,
+			maintain_aspect=maintain_aspect,
+			sws_flags=sws_flags,
+		)
+		filter_args += extra_filters or []
+		if filter_args and record_filename and fps:
+			filter_args = [
+				'-filter_complex', '[0:v]{}[out]'.format(', '.join(filter_args)),
+				'-map', '[out]',
+			]
+		elif filter_args:
+			filter_args = ['-vf', ', '.join(filter_args)]
+		elif record_filename and fps:
+			filter_args = ['-filter_complex', '[0:v]null[out]', '-map', '[out]']
+	
+	record_output_args = []
+	if record_filename and fps:
+		# Split the final output between the stream and the recording
+		filter_args = [
+			'-filter_complex', filter_args[1] + '; [out]split=2[stream][record]',
+			'-map', '[stream]',
+		]
+		record_output_args = (
+			['-map', '[record]']
+			+ (RECORD_ARGS if record_args is None else list(record_args))
+			+ [record_filename]
+		)
+	if sws_flags and '-filter_complex' in filter_args:
+		# -sws_flags only reaches simple filter graphs; this also
+		# covers any scaler ffmpeg adds to convert pixel formats
+		idx = filter_args.index('-filter_complex') + 1
+		filter_args[idx] = 'sws_flags={}; {}'.format(sws_flags, filter_args[idx])
+	elif sws_flags:
+		filter_args = ['-sws_flags', sws_flags] + filter_args
 	
 	# Output
 	output_args = []
@@ -132,16 +649,101 @@ def compile_command(
 		]
 	else:
 		# Persistent stream
-		output_args += [
-			'-vcodec', 'rawvideo',
-			'-pix_fmt', 'yuv420p',
-			'-threads', '0',
-			'-f', 'v4l2',
+		output_args += get_codec_args(
+			codec,
+			pix_fmt=pix_fmt,
+			quality=quality,
+			threads=threads,
+		) + get_profile_args(profile)[1] + [
+			'-f', output_format,
 			output_filename,
-		]
+		] + record_output_args
 	
 	return input_args + filter_args + output_args
 	
+def can_retarget(running_kwargs, kwargs):
+	"""
+		Whether a stream can be moved onto a new source in place
+		
+		`running_kwargs` are the compile_command() arguments of a
+		running stream, and `kwargs` those it should now have.
+		Only the source rectangle of a `retarget` stream can change.
+		Its size can only change if the source is being stretched to
+		fit the output; otherwise the output would change size too.
+	"""
+	if not running_kwargs.get('retarget') or running_kwargs.get('regions'):
+		return False
+	source_names = ['source_x', 'source_y', 'source_width', 'source_height']
+	# The recording's filename is stamped with the time it's asked for
+	ignored_names = source_names + ['record_filename']
+	def get_others(command_kwargs):
+		return {
+			name: value
+			for name, value in command_kwargs.items()
+			if name not in ignored_names
+		}
+	if get_others(running_kwargs) != get_others(kwargs):
+		return False
+	
+	same_size = all(
+		int(running_kwargs[name]) == int(kwargs[name])
+		for name in ['source_width', 'source_height']
+	)
+	if same_size:
+		return True
+	# A stretch is the only fit which always gives the same size
+	stretched = kwargs.get('scale', True) and not kwargs.get('maintain_aspect', True)
+	return bool(stretched and get_fit_filters(
+		int(running_kwargs['source_width']),
+		int(running_kwargs['source_height']),
+		int(running_kwargs.get('output_width') or 0),
+		int(running_kwargs.get('output_height') or 0),
+		scale=True,
+		maintain_aspect=False,
+	))
+	
+def get_retarget_input(running_kwargs, kwargs, stream_time):
+	"""
+		Returns the bytes to write to a retargetable ffmpeg's stdin
+		to move its source from that of `running_kwargs` to that of
+		`kwargs` (see can_retarget())
+		
+		ffmpeg reads one command at a time, at most every 100ms, so
+		sending the changes one by one would show the source half
+		moved for a few frames. Instead, each change is queued (with
+		the "C" key) for the same time: RETARGET_DELAY after
+		`stream_time`, which should be no earlier than the timestamp
+		(in seconds) of the stream's latest frame. Queued commands
+		are all applied before the first frame at or after that time.
+		When shrinking, the size is changed first, otherwise the
+		position: the crop filter keeps its position within the
+		screen, but not its size.
+	"""
+	changes = []
+	for name, option in [
+		('source_x', 'x'),
+		('source_y', 'y'),
+		('source_width', 'w'),
+		('source_height', 'h'),
+	]:
+		if int(running_kwargs[name]) != int(kwargs[name]):
+			changes.append((option, int(kwargs[name])))
+	shrinking = (
+		int(kwargs['source_width']) * int(kwargs['source_height'])
+		< int(running_kwargs['source_width']) * int(running_kwargs['source_height'])
+	)
+	if shrinking:
+		changes.reverse()
+	return b''.join(
+		'C{filter} {time:.3f} {option} {value}\n'.format(
+			filter=RETARGET_FILTER,
+			time=stream_time + RETARGET_DELAY,
+			option=option,
+			value=value,
+		).encode('ascii')
+		for option, value in changes
+	)
+	
 
 def screenshot(screen_id, geometry, filename, max_width=None, max_height=None):
 	"""
@@ -227,22 +829,22 @@ def stream(screen_id, geometry, fps, filename):
 
 def capture_window(window, filename, **kwargs):
 	"""
-		Take a screenshot of the given X `window`
+		Take a screenshot of the given x11.WindowInfo `window`
 	"""
 	return screenshot(
-		screen_id=window.screen.full_id,
-		geometry=window.get_abs_geometry(),
+		screen_id=window.screen_id,
+		geometry=window.geometry,
 		filename=filename,
 		**kwargs
 	)
 	
 def stream_window(window, fps, filename):
 	"""
-		Stream the given X `window`
+		Stream the given x11.WindowInfo `window`
 	"""
 	return stream(
-		screen_id=window.screen.full_id,
-		geometry=window.get_abs_geometry(),
+		screen_id=window.screen_id,
+		geometry=window.geometry,
 		fps=fps,
 		filename=filename,
 	)
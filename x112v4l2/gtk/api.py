@@ -0,0 +1,233 @@
+"""
+	The methods of the control socket (see x112v4l2.control)
+	
+	Anything which touches the UI is run on the GTK main loop, so the
+	connection's thread just waits for the answer; the main loop is
+	only held up for as long as the request takes to carry out.
+"""
+from concurrent import futures
+
+from gi.repository import GLib
+
+from x112v4l2 import control
+
+
+def get_window_record(window):
+	"""
+		Returns a JSON-able dict of an x11.WindowInfo
+	"""
+	return dict(window._asdict())
+	
+
+class ControlAPI(object):
+	"""
+		Carries out control requests against a MainUI
+	"""
+	# Methods which don't touch the UI, so needn't wait for the main loop
+	THREADED = ['search_windows']
+	
+	def __init__(self, ui):
+		self.ui = ui
+		
+	
+	def dispatch(self, method, params):
+		"""
+			Carry out the request to call `method` with `params`
+			
+			Called from the connection's thread. A request which
+			times out before the main loop gets to it is cancelled;
+			one which is already under way carries on regardless.
+		"""
+		func = getattr(self, 'do_' + method, None)
+		if func is None:
+			raise control.ControlError('Unknown method: {}'.format(method))
+		if method in self.THREADED:
+			return func(**params)
+			
+		future = futures.Future()
+		def run():
+			if not future.set_running_or_notify_cancel():
+				return False
+			try:
+				future.set_result(func(**params))
+			except Exception as exc:
+				future.set_exception(exc)
+			return False
+			
+		GLib.idle_add(run)
+		try:
+			return future.result(timeout=control.TIMEOUT)
+		except futures.TimeoutError:
+			if future.cancel():
+				raise control.ControlError('Timed out waiting for the UI; nothing was done')
+			raise control.ControlError('Timed out waiting for the UI; the request is still under way')
+			
+	def get_device(self, path):
+		"""
+			Returns the DeviceUI of the device at `path`
+		"""
+		for device in self.ui.deviceuis:
+			if device.path == path:
+				return device
+		raise control.ControlError('No such device: {}'.format(path))
+		
+	def get_status(self, device):
+		"""
+			Returns a JSON-able dict of the state of a DeviceUI
+		"""
+		running = device.is_process_running()
+		status = {
+			'path': device.path,
+			'label': device.label,
+			'running': running,
+			'stopping': running and device.process_stopping,
+			'pid': device.process.pid if running else None,
+			'returncode': device.process.returncode if device.process and not running else None,
+			'source': device.get_source_config(),
+			'source_window_id': device.source_window_id,
+			'source_warning': device.source_warning,
+			'capacity_message': device.capacity_message,
+			'command': device.get_process_command(),
+		}
+		if running:
+			status.update({
+				'progress': device.process_progress,
+				'drop_rate': device.drop_rate,
+				'stats': device.process_monitor.latest if device.process_monitor else None,
+				'cpus': sorted(device.placement) if device.placement else None,
+			})
+		return status
+		
+	
+	def do_list_devices(self):
+		"""
+			Returns a list of {path, label, running} of every device
+		"""
+		return [
+			{
+				'path': device.path,
+				'label': device.label,
+				'running': device.is_process_running(),
+			}
+			for device in self.ui.deviceuis
+		]
+		
+	def do_get_device(self, path):
+		"""
+			Returns the full status of the device at `path`
+		"""
+		return self.get_status(self.get_device(path))
+		
+	def do_get_stats(self):
+		"""
+			Returns the status of every device, and their total CPU usage
+		"""
+		history = self.ui.stats_history
+		return {
+			'devices': [self.get_status(device) for device in self.ui.deviceuis],
+			'cpu_percent': history[-1] if history else None,
+		}
+		
+	def do_search_windows(self, title='', refresh=False):
+		"""
+			Returns the windows whose titles contain `title`
+			
+			The windows are as of the UI's last X11 probe, unless
+			`refresh` is true. As for x11.search_windows(), the match
+			is case-insensitive.
+		"""
+		if refresh:
+			try:
+				windows = self.ui.x11_worker.probe().result(timeout=control.TIMEOUT).windows
+			except futures.TimeoutError:
+				raise control.ControlError('Timed out probing X11')
+		else:
+			windows = self.ui.x11_windows
+			if windows == self.ui.STATE_RELOADING:
+				raise control.ControlError('Windows are being reloaded')
+		title = title.lower()
+		return [
+			get_window_record(window)
+			for window in windows
+			if title in window.title.lower()
+		]
+		
+	def do_start(self, path):
+		"""
+			Start the stream of the device at `path`
+		"""
+		device = self.get_device(path)
+		if device.is_process_running():
+			raise control.ControlError('Already running: {}'.format(path))
+		if not device.get_process_command():
+			raise control.ControlError('No source/output set for: {}'.format(path))
+		device.start_process()
+		if not device.is_process_running():
+			raise control.ControlError(
+				device.capacity_message or 'The stream didn\'t start: {}'.format(path)
+			)
+		return self.get_status(device)
+		
+	def do_stop(self, path):
+		"""
+			Ask the stream of the device at `path` to stop
+		"""
+		device = self.get_device(path)
+		device.stop_process()
+		return self.get_status(device)
+		
+	def do_restart(self, path):
+		"""
+			Restart the stream of the device at `path`
+		"""
+		device = self.get_device(path)
+		device.restart_process()
+		return self.get_status(device)
+		
+	def do_set_source(
+		self, path,
+		window_id=None,
+		screen=None, x=None, y=None, width=None, height=None,
+		restart=False,
+	):
+		"""
+			Change the source of the device at `path`
+			
+			Either give the `window_id` of a known window, or any of
+			the `screen`, `x`, `y`, `width` and `height` of the area.
+			A running stream is moved onto the new source in place if
+			it can be; otherwise it's only restarted if `restart` is
+			true. Returns {retargeted, restarted}.
+		"""
+		device = self.get_device(path)
+		if window_id is not None:
+			windows = self.ui.x11_windows
+			if windows == self.ui.STATE_RELOADING:
+				windows = []
+			for window in windows:
+				if window.id == int(window_id):
+					break
+			else:
+				raise control.ControlError('No such window: {}'.format(window_id))
+			device.set_source_window(window)
+		else:
+			device.source_window_id = None
+			for name, value in [
+				('screen', screen),
+				('x', x),
+				('y', y),
+				('width', width),
+				('height', height),
+			]:
+				if value is not None:
+					device.get_widget('source_' + name).set_text(str(value))
+		device.handler.refresh_output_config()
+		
+		result = {'retargeted': False, 'restarted': False}
+		if device.is_process_running():
+			result['retargeted'] = device.retarget_process()
+			if not result['retargeted'] and restart:
+				device.restart_process()
+				result['restarted'] = True
+		return result
+		
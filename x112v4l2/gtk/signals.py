@@ -8,9 +8,13 @@ from gi.repository import GObject
 
 from x112v4l2 import v4l2
 from x112v4l2 import v4l2
-from x112v4l2 import x11
 from x112v4l2 import ffmpeg
 from x112v4l2 import thumbs
+from x112v4l2 import autotune
+from x112v4l2 import pacing
+from x112v4l2 import latency
+from x112v4l2 import session
+from x112v4l2 import trace
 
 
 class MultiHandler(object):
@@ -76,6 +80,13 @@ class MainHandler(BaseHandler):
 		"""
 			Triggered when the main window is shown
 		"""
+		snapshot = session.load() if session.RESTORE else None
+		if snapshot:
+			# Get the streams going first, and check up on them later
+			self.ui.restore_session(snapshot)
+			GObject.idle_add(self.verify_session)
+			return
+		
 		self.refresh_v4l2_info()
 		self.refresh_ffmpeg_info()
 		# We want to do the X11 bit once we're all finished,
@@ -83,7 +94,20 @@ class MainHandler(BaseHandler):
 		GObject.idle_add(self.refresh_x11_info)
 		GObject.idle_add(self.regen_x11_thumbs)
 		
+	def verify_session(self, *args):
+		"""
+			Re-probe everything after restoring a session
+		"""
+		future = self.probe_x11()
+		future.add_done_callback(
+			self.ui.future_callback(self.ui.verify_session)
+		)
+		self.refresh_v4l2_info()
+		self.refresh_ffmpeg_info()
+		GObject.idle_add(self.regen_x11_thumbs)
+		
 	
+	@trace.traced()
 	def refresh_v4l2_info(self, *args):
 		"""
 			Recheck the state of the v4l2loopback kernel module
@@ -95,16 +119,19 @@ class MainHandler(BaseHandler):
 		
 		# Async info-getting
 		avail_future = self.ui.executor.submit(v4l2.get_module_available)
+		self.ui.time_future(avail_future, 'probe_seconds', probe='v4l2_available')
 		avail_future.add_done_callback(
 			self.ui.future_callback(self.ui.show_v4l2_available)
 		)
 		
 		loaded_future = self.ui.executor.submit(v4l2.get_module_loaded)
+		self.ui.time_future(loaded_future, 'probe_seconds', probe='v4l2_loaded')
 		loaded_future.add_done_callback(
 			self.ui.future_callback(self.ui.show_v4l2_loaded)
 		)
 		
 		devices_future = self.ui.executor.submit(v4l2.get_devices)
+		self.ui.time_future(devices_future, 'probe_seconds', probe='v4l2_devices')
 		devices_future.add_done_callback(
 			self.ui.future_callback(self.ui.show_v4l2_devices)
 		)
@@ -114,44 +141,73 @@ class MainHandler(BaseHandler):
 			Applies any changes made to the v4l2 configuration
 		"""
 		## TODO: Indicate we're updating
-		names = self.ui.get_device_names()
-		devices_future = self.ui.executor.submit(v4l2.configure_devices, names)
+		try:
+			specs = self.ui.get_device_specs()
+		except ValueError:
+			# The reason's already on show
+			return
+		devices_future = self.ui.executor.submit(
+			v4l2.configure_devices,
+			[label for label, params in specs],
+			[params for label, params in specs],
+		)
 		devices_future.add_done_callback(
 			self.ui.future_callback(self.refresh_v4l2_info)
 		)
 		
 	
-	def refresh_x11_info(self, *args):
+	@trace.traced()
+	def probe_x11(self):
 		"""
-			Recheck the X11 situation
+			Start rechecking the X11 situation
+			
+			The UI is updated once the probe is done.
+			Returns a future of the x11.Probe.
 		"""
 		# Indicate stuff is reloading
 		self.ui.show_x11_display_info(self.ui.STATE_RELOADING)
 		self.ui.show_x11_screen_info(self.ui.STATE_RELOADING)
 		self.ui.show_x11_window_info(self.ui.STATE_RELOADING)
 		
-		# Xlib classes aren't picklable, so we can't future this :/
-		displays = x11.get_displays()
-		self.ui.show_x11_display_info(displays)
-		screens = x11.get_screens()
-		self.ui.show_x11_screen_info(screens)
-		windows = x11.get_windows()
-		self.ui.show_x11_window_info(list(windows))
+		# Xlib classes aren't picklable, so X11 gets its own thread
+		future = self.ui.x11_worker.probe()
+		self.ui.time_future(future, 'probe_seconds', probe='x11')
+		future.add_done_callback(
+			self.ui.future_callback(self.ui.show_x11_info)
+		)
+		return future
+		
+	@trace.traced()
+	def refresh_x11_info(self, *args):
+		"""
+			Recheck the X11 situation
+		"""
+		self.probe_x11()
 		
 	def regen_x11_thumbs(self, *args):
 		"""
 			(Re-)Generate thumbnails of all X11 windows
 		"""
-		self.refresh_x11_info()
-		
 		self.ui.show_x11_thumb_path(thumbs.CACHE_PATH)
 		self.ui.show_x11_thumbs(self.ui.STATE_RELOADING)
 		
-		future = self.ui.executor.submit(thumbs.create_all)
+		future = self.probe_x11()
 		future.add_done_callback(
-			self.ui.future_callback(self.ui.show_x11_thumbs)
+			self.ui.future_callback(self.create_x11_thumbs)
 		)
 		
+	def create_x11_thumbs(self, probe):
+		"""
+			Generate thumbnails of the windows found by an X11 `probe`
+		"""
+		self.ui.start_thumb_jobs(probe)
+		
+	def toggle_live_thumbs(self, widget, *args):
+		"""
+			Switch background refreshing of thumbnails on or off
+		"""
+		self.ui.set_live_thumbs(widget.get_active())
+		
 	
 	def refresh_ffmpeg_info(self, *args):
 		"""
@@ -162,6 +218,7 @@ class MainHandler(BaseHandler):
 		self.ui.show_ffmpeg_version(self.ui.STATE_RELOADING)
 		
 		version_future = self.ui.executor.submit(ffmpeg.get_version)
+		self.ui.time_future(version_future, 'probe_seconds', probe='ffmpeg_version')
 		version_future.add_done_callback(
 			self.ui.future_callback(self.ui.show_ffmpeg_installed)
 		)
@@ -175,26 +232,52 @@ class DeviceHandler(BaseHandler):
 	"""
 		Handler for events triggered from a device tab
 	"""
-	def update_source_config(self, container, item, *args):
+	def update_source_config(self, container, path, *args):
 		"""
 			Update the source config based on thumbnail selection
 		"""
-		if item is None:
+		if path is None:
 			return
 		
 		# Find the source window instance
-		source_window = getattr(item, 'source_window', None)
+		source_window = self.ui.get_thumb_window(path)
 		if not source_window:
-			for child in item.get_children():
-				source_window = getattr(child, 'source_window', None)
-				if source_window is not None:
-					break
-		
-		if not source_window:
-			raise TypeError('No source window found on object: {!r}'.format(item))
+			raise TypeError('No source window found at path: {!r}'.format(path))
 		
 		self.ui.set_source_window(source_window)
 		self.refresh_output_config()
+		if self.ui.is_process_running() and self.ui.process_kwargs.get('retarget'):
+			# Switch over without a restart, if the stream allows it
+			if not self.ui.retarget_process():
+				self.ui.restart_process()
+		
+	
+	def filter_thumbs(self, *args):
+		"""
+			Show only the thumbs whose titles match the search
+		"""
+		self.ui.filter_thumbs()
+		
+	def load_visible_thumbs(self, *args):
+		"""
+			Load the images of thumbs which have come into view
+		"""
+		self.ui.main_ui.load_visible_thumbs(self.ui.get_visible_thumb_ids())
+		
+	
+	def add_source_region(self, *args):
+		"""
+			Composite the current source along with any others
+		"""
+		self.ui.add_source_region()
+		self.refresh_output_config()
+		
+	def clear_source_regions(self, *args):
+		"""
+			Stop compositing multiple regions
+		"""
+		self.ui.clear_source_regions()
+		self.refresh_output_config()
 		
 	
 	def refresh_output_config(self, *args):
@@ -202,6 +285,7 @@ class DeviceHandler(BaseHandler):
 			Update the state of the output config controls
 		"""
 		self.ui.update_output_size()
+		self.ui.show_source_regions()
 		self.ui.update_process_command()
 		self.ui.show_process_state()
 		
@@ -228,8 +312,62 @@ class DeviceHandler(BaseHandler):
 		"""
 			Stop-start the ffmpeg subprocess
 		"""
-		# We can do it this way because stop_process blocks :/
-		self.stop_process(*args)
-		self.start_process(*args)
+		self.ui.restart_process()
+		
+	def autotune_process(self, *args):
+		"""
+			Trial ffmpeg options to find the fastest for this stream
+		"""
+		if self.ui.is_process_running():
+			# It'd be competing with itself
+			self.ui.show_tuning('Stop the stream before tuning it')
+			return
+		if not self.ui.get_process_command():
+			self.ui.show_tuning('Set a source and output before tuning')
+			return
+		kwargs = self.ui.get_command_kwargs()
+		if not int(kwargs['fps']):
+			self.ui.show_tuning('Only streams with an fps limit can be tuned')
+			return
+		
+		self.ui.show_tuning(self.ui.STATE_RELOADING)
+		future = self.ui.executor.submit(autotune.tune, kwargs)
+		future.add_done_callback(
+			self.ui.future_callback(self.ui.set_tuning)
+		)
+		
+	def analyse_pacing(self, *args):
+		"""
+			Read the stream back from the device, to see how evenly it's paced
+		"""
+		if not self.ui.is_process_running():
+			self.ui.show_pacing('Start the stream before analysing it')
+			return
+		
+		self.ui.show_pacing(self.ui.STATE_RELOADING)
+		future = self.ui.executor.submit(pacing.analyse_device, self.ui.path)
+		future.add_done_callback(
+			self.ui.future_callback(self.ui.show_pacing)
+		)
+		
+	def check_buffer_latency(self, *args):
+		"""
+			Measure how long the stream's frames wait in the device
+		"""
+		if not self.ui.is_process_running():
+			self.ui.show_buffer_latency('Start the stream before checking it')
+			return
+		kwargs = self.ui.process_kwargs
+		
+		self.ui.show_buffer_latency(self.ui.STATE_RELOADING)
+		future = self.ui.executor.submit(
+			latency.measure_device,
+			self.ui.path,
+			kwargs['output_width'],
+			kwargs['output_height'],
+		)
+		future.add_done_callback(
+			self.ui.future_callback(self.ui.show_buffer_latency)
+		)
 		
 	
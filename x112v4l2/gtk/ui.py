@@ -3,8 +3,13 @@
 """
 import math
 import os
+import signal
 import subprocess
 import fcntl
+import time
+import logging
+import functools
+import collections
 from concurrent import futures
 
 import gi
@@ -12,13 +17,30 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
 from gi.repository import GLib
 from gi.repository import GObject
+from gi.repository import GdkPixbuf
 
+from x112v4l2 import x11
+from x112v4l2 import v4l2
 from x112v4l2 import thumbs
 from x112v4l2 import ffmpeg
+from x112v4l2 import proclog
+from x112v4l2 import procstats
+from x112v4l2 import metrics
+from x112v4l2 import placement
+from x112v4l2 import capacity
+from x112v4l2 import latency
+from x112v4l2 import pacing
+from x112v4l2 import config
+from x112v4l2 import session
+from x112v4l2 import trace
+from x112v4l2 import control
+from x112v4l2.gtk import api
 from x112v4l2.gtk import signals
 from x112v4l2.gtk import utils
 
 
+logger = logging.getLogger(__name__)
+
 class BaseUI(object):
 	"""
 		Core functionality for all UI classes.
@@ -56,29 +78,109 @@ class BaseUI(object):
 			to the function as the first argument, followed by any
 			additional arguments specified here.
 		"""
+		if not trace.TRACER.enabled:
+			def callback(future):
+				return GObject.idle_add(func, future.result(), *args, **kwargs)
+				
+			return callback
+			
+		# Also trace the callback, and how long it waited to run
+		def call(queued, result):
+			with trace.TRACER.span(
+				func.__name__,
+				category='callback',
+				queued_ms=(trace.get_timestamp() - queued) / 1000,
+			):
+				func(result, *args, **kwargs)
+			
 		def callback(future):
-			return GObject.idle_add(func, future.result(), *args, **kwargs)
+			return GObject.idle_add(call, trace.get_timestamp(), future.result())
 			
 		return callback
 		
+	def time_future(self, future, metric, **labels):
+		"""
+			Record how long the `future` takes, in the `metric` summary
+		"""
+		started = time.monotonic()
+		name = '.'.join([metric] + [str(value) for value in labels.values()])
+		span_id = trace.TRACER.begin_async(name, category='future', **labels)
+		def callback(future):
+			metrics.REGISTRY.observe(metric, time.monotonic() - started, **labels)
+			trace.TRACER.end_async(span_id, name, category='future')
+			
+		future.add_done_callback(callback)
+		
 	
 class MainUI(BaseUI):
 	"""
 		General wrapper around all the main window functionality
 	"""
 	MAIN_GLADE = os.path.join(os.path.dirname(__file__), 'main.glade')
+	THUMB_PLACEHOLDER = os.path.join(os.path.dirname(__file__), 'placeholder.png')
+	
+	# Columns of the shared thumbnail model
+	THUMB_COLUMN_WINDOW = 0
+	THUMB_COLUMN_TITLE = 1
+	THUMB_COLUMN_PIXBUF = 2
+	# Seconds between samples of stream resource usage
+	STATS_INTERVAL = 1
+	# Probe results which are saved in session snapshots
+	PROBES = ['v4l2_available', 'v4l2_loaded', 'v4l2_devices', 'ffmpeg_version']
 	
 	
 	def __init__(self, **kwargs):
 		super().__init__(**kwargs)
 		
+		self.launched = time.monotonic()
+		# The latest probe results, by name
+		self.probes = {}
+		# Restored devices whose streams aren't running yet
+		self.restoring = set()
 		# The current DeviceUI instances
 		self.deviceuis = []
-		# The most recent X11 window information
+		# The most recent X11 window information, as x11.WindowInfo
 		self.x11_windows = []
+		self.x11_worker = x11.X11Worker()
+		# Live thumbnail refreshing
+		self.live_thumbs = False
+		self.live_thumbs_source = None
+		self.thumb_scheduler = thumbs.RefreshScheduler()
+		# Regenerating all the thumbnails
+		self.thumb_jobs = thumbs.ThumbJobs()
+		self.thumb_jobs_source = None
+		self.thumb_jobs_started = None
+		self.thumb_jobs_span = None
+		# One row per window, shared by every device's thumb list
+		self.thumb_store = Gtk.ListStore(object, str, GdkPixbuf.Pixbuf)
+		self.thumb_placeholder = GdkPixbuf.Pixbuf.new_from_file(self.THUMB_PLACEHOLDER)
+		# {win.id: TreeIter} of the rows in the thumb_store
+		self.thumb_rows = {}
+		# IDs of windows whose thumbnail images have been loaded
+		self.thumb_loaded = set()
+		# Total CPU usage of all streams over time
+		self.stats_history = collections.deque(maxlen=procstats.HISTORY_LENGTH)
+		# Pixels per second per core, for estimating stream costs
+		self.capacity_rates = capacity.load_rates()
+		# When a stream was last degraded for dropping frames
+		self.last_degraded = None
 		
 		self.handler = signals.MainHandler(ui=self)
 		self.load_main_window()
+		self.get_widget('v4l2_device_names').get_buffer().connect(
+			'changed', self.show_v4l2_device_params,
+		)
+		self.exporters = metrics.start()
+		self.control_servers = control.start(api.ControlAPI(self).dispatch)
+		if self.capacity_rates is None:
+			self.capacity_rates = capacity.DEFAULT_RATES
+			if capacity.ADMISSION != capacity.ADMISSION_OFF or capacity.DEGRADE:
+				future = self.executor.submit(capacity.calibrate)
+				future.add_done_callback(self.future_callback(self.set_capacity_rates))
+		self.stats_source = GLib.timeout_add_seconds(
+			self.STATS_INTERVAL,
+			self.update_process_stats,
+		)
 		
 	
 	def run(self):
@@ -86,21 +188,131 @@ class MainUI(BaseUI):
 		Gtk.main()
 		
 	def stop(self):
-		for device in self.deviceuis:
-			device.stop()
+		"""
+			Stop everything, and quit once all the streams have ended
+			
+			All the devices are stopped at the same time, so the total
+			wait is that of the slowest, rather than the sum of them.
+		"""
+		self.save_session()
+		self.set_live_thumbs(False)
+		self.finish_thumb_jobs()
+		GLib.source_remove(self.stats_source)
+		started = time.monotonic()
+		pending = set(self.deviceuis)
+		
+		def stopped(device):
+			pending.discard(device)
+			if not pending:
+				self.finish_stop(started)
+			
+		if not pending:
+			return self.finish_stop(started)
+		for device in list(pending):
+			device.stop(callback=functools.partial(stopped, device))
+		
+	def finish_stop(self, started):
+		"""
+			Quit, once all devices have been stopped
+		"""
+		logger.info(
+			'Stopped %d device(s) in %.2fs',
+			len(self.deviceuis),
+			time.monotonic() - started,
+		)
+		for exporter in self.exporters:
+			exporter.stop()
+		for server in self.control_servers:
+			server.stop()
+		self.x11_worker.shutdown()
 		self.executor.shutdown(wait=True)
 		return Gtk.main_quit()
 		
 		
+	def save_session(self):
+		"""
+			Snapshot the state of everything, for restore_session()
+		"""
+		try:
+			session.save(
+				probes={
+					name: self.probes[name]
+					for name in self.PROBES if name in self.probes
+				},
+				devices=[device.get_snapshot() for device in self.deviceuis],
+			)
+		except OSError as err:
+			logger.warning('Unable to save session: %s', err)
+		
+	def restore_session(self, snapshot):
+		"""
+			Bring back the devices and streams of a saved session
+			
+			The saved probe results are shown straight away, and all
+			the streams which were running are started at once.
+			verify_session() should be called afterwards, to check
+			everything against reality.
+		"""
+		probes = snapshot['probes']
+		self.show_v4l2_available(probes.get('v4l2_available', False))
+		self.show_v4l2_loaded(probes.get('v4l2_loaded', False))
+		self.show_ffmpeg_installed(probes.get('ffmpeg_version') is not None)
+		self.show_ffmpeg_version(probes.get('ffmpeg_version'))
+		self.show_v4l2_devices([
+			{'path': device['path'], 'label': device['label']}
+			for device in snapshot['devices']
+		])
+		
+		for device, device_snapshot in zip(self.deviceuis, snapshot['devices']):
+			device.apply_snapshot(device_snapshot)
+			if device_snapshot['running'] and device.get_process_command():
+				self.restoring.add(device)
+		for device in list(self.restoring):
+			device.start_process()
+			if not device.is_process_running():
+				# eg. refused by admission control
+				self.restoring.discard(device)
+		logger.info('Restoring %d stream(s)', len(self.restoring))
+		
+	def finish_restoring(self, device):
+		"""
+			Note that a restored `device` is streaming (or has failed)
+			
+			Once all of them are, the time since launch is recorded.
+		"""
+		if device not in self.restoring:
+			return
+		self.restoring.discard(device)
+		if self.restoring:
+			return
+		duration = time.monotonic() - self.launched
+		logger.info('All restored streams running %.2fs after launch', duration)
+		metrics.REGISTRY.set('restore_seconds', duration)
+		
+	def verify_session(self, probe):
+		"""
+			Check restored devices against the X11 `probe` results
+			
+			The thumbnails from the cache are shown in the meantime,
+			until they can be regenerated.
+		"""
+		self.show_x11_info(probe)
+		self.populate_thumb_store(self.x11_windows)
+		for device in self.deviceuis:
+			device.verify_source(self.x11_windows)
+		
+	
 	def load_main_window(self):
 		"""
 			Loads the main window UI from file
 		"""
 		builder = Gtk.Builder()
-		builder.add_from_file(self.MAIN_GLADE)
+		with trace.TRACER.span('load glade', filename=self.MAIN_GLADE):
+			builder.add_from_file(self.MAIN_GLADE)
 		builder.connect_signals(self.handler)
 		# We want the main window
 		self.main_window = builder.get_object('main')
+		self.widgets = utils.index_widgets(builder)
 		# We also want the device-tab widget
 		self.device_list = builder.get_object('device_list')
 		
@@ -112,17 +324,59 @@ class MainUI(BaseUI):
 		"""
 			Return the `name`d widget, or None
 		"""
-		return utils.find_child_by_id(self.main_window, name)
+		widget = self.widgets.get(name)
+		if widget is None:
+			# Not from our glade file; have a rummage
+			widget = utils.find_child_by_id(self.main_window, name)
+		return widget
 		
 	
-	def get_device_names(self):
+	def get_device_specs(self):
 		"""
-			Returns the list of device names from the UI
+			Returns a list of (label, params) of the devices in the UI
+			
+			See v4l2.parse_device_lines(); raises ValueError if any
+			line doesn't make sense.
 		"""
 		device_names_widget = self.get_widget('v4l2_device_names')
-		names = device_names_widget.get_buffer().get_property('text')
-		names = [name.strip() for name in names.split('\n') if name.strip()]
-		return names
+		return v4l2.parse_device_lines(
+			device_names_widget.get_buffer().get_property('text')
+		)
+		
+	def show_v4l2_device_params(self, *args):
+		"""
+			Show how much memory the devices in the UI could take up
+			
+			Or, why they can't be applied.
+		"""
+		widget = self.get_widget('v4l2_device_params_info')
+		try:
+			specs = self.get_device_specs()
+		except ValueError as exc:
+			widget.set_label(str(exc))
+			return
+		if not specs:
+			widget.set_label('')
+			return
+		module_params = dict(
+			v4l2.MODULE_DEFAULTS,
+			**v4l2.get_shared_params([params for label, params in specs])
+		)
+		memory = v4l2.get_memory(
+			module_params['max_buffers'],
+			module_params['max_width'],
+			module_params['max_height'],
+		)
+		widget.set_label(
+			'{buffers} buffers of up to {width}x{height} each: '
+			'up to {memory} per device, {total} in all'.format(
+				buffers=module_params['max_buffers'],
+				width=module_params['max_width'],
+				height=module_params['max_height'],
+				memory=procstats.format_bytes(memory),
+				total=procstats.format_bytes(memory * len(specs)),
+			)
+		)
 		
 	def clear_devices(self):
 		"""
@@ -151,7 +405,7 @@ class MainUI(BaseUI):
 		first_page = self.device_list.get_nth_page(0)
 		first_label = self.device_list.get_tab_label(first_page)
 		
-		tab_label = Gtk.Label('{}\n{}'.format(label, path))
+		tab_label = Gtk.Label(self.get_device_tab_text(path, label))
 		# There's no way to completely copy widget style,
 		# and label justification can't be set through CSS,
 		# so we manually make sure the justification is consistent.
@@ -162,6 +416,51 @@ class MainUI(BaseUI):
 		self.deviceuis.append(device)
 		return device
 		
+	def remove_device(self, device):
+		"""
+			Stops the given DeviceUI, and removes its tab
+		"""
+		device.stop()
+		self.deviceuis.remove(device)
+		self.device_list.remove_page(self.device_list.page_num(device.widget))
+		
+	def get_device_tab_text(self, path, label):
+		"""
+			Returns the text of the tab of the device at `path`
+		"""
+		return '{}\n{}'.format(label, path)
+		
+	def reconcile_devices(self, devices):
+		"""
+			Make the device tabs match the given v4l2 `devices`
+			
+			Devices are matched up by path: tabs of devices which have
+			gone are removed, new devices get new tabs, and the rest
+			are left alone (along with their streams), though they may
+			be relabelled or reordered.
+		"""
+		wanted = collections.OrderedDict((dev['path'], dev) for dev in devices)
+		for device in list(self.deviceuis):
+			if device.path not in wanted:
+				self.remove_device(device)
+				
+		existing = {device.path: device for device in self.deviceuis}
+		for path, dev in wanted.items():
+			device = existing.get(path)
+			if device is None:
+				self.add_device(path=path, label=dev['label'])
+			elif device.label != dev['label']:
+				device.label = dev['label']
+				tab_label = self.device_list.get_tab_label(device.widget)
+				tab_label.set_text(self.get_device_tab_text(path, dev['label']))
+				
+		# Keep the tabs in the same order as the devices
+		order = list(wanted)
+		self.deviceuis.sort(key=lambda device: order.index(device.path))
+		for idx, device in enumerate(self.deviceuis):
+			# The first page is the status page
+			self.device_list.reorder_child(device.widget, idx + 1)
+			
 	
 	def show_v4l2_available(self, state):
 		"""
@@ -171,6 +470,7 @@ class MainUI(BaseUI):
 		if state == self.STATE_RELOADING:
 			icon = self.ICON_RELOAD
 		else:
+			self.probes['v4l2_available'] = state
 			icon = self.ICON_YES if state else self.ICON_NO
 		mod_avail_widget.set_from_icon_name(icon, Gtk.IconSize.BUTTON)
 		
@@ -182,6 +482,7 @@ class MainUI(BaseUI):
 		if state == self.STATE_RELOADING:
 			icon = self.ICON_RELOAD
 		else:
+			self.probes['v4l2_loaded'] = state
 			icon = self.ICON_YES if state else self.ICON_NO
 		mod_loaded_widget.set_from_icon_name(icon, Gtk.IconSize.BUTTON)
 		
@@ -192,22 +493,39 @@ class MainUI(BaseUI):
 		# Update the summary's total device count
 		num_devices_widget = self.get_widget('v4l2_num_devices')
 		if devices == self.STATE_RELOADING:
+			# Leave the tabs (and their streams) be until we know more
 			num_devices_widget.set_label(self.STATE_RELOADING_LABEL)
-			devices = []
-		else:
-			num_devices_widget.set_label(str(len(list(devices))))
-		
-		# Populate the list of device names
+			return
+		devices = list(devices)
+		num_devices_widget.set_label(str(len(devices)))
+		self.probes['v4l2_devices'] = devices
+		
+		# Populate the list of device names, with the module's
+		# settings wherever they're not its defaults
+		module_params = v4l2.get_module_params()
+		params = {
+			name: module_params[module_name]
+			for name, module_name in v4l2.SHARED_PARAMS
+			if module_params[module_name] != v4l2.MODULE_DEFAULTS[module_name]
+		}
 		device_names_widget = self.get_widget('v4l2_device_names')
 		buff = device_names_widget.get_buffer()
-		buff.set_text('\n'.join(dev['label'] for dev in devices))
+		buff.set_text('\n'.join(
+			v4l2.format_device_line(dev['label'], dict(params, video_nr=dev.get('video_nr')))
+			for dev in devices
+		))
 		
-		# Re/populate the device tabs
-		self.clear_devices()
-		for device in devices:
-			self.add_device(path=device['path'], label=device['label'])
+		self.reconcile_devices(devices)
 		
 	
+	def show_x11_info(self, probe):
+		"""
+			Update all the X11 info UI from an x11.Probe
+		"""
+		self.show_x11_display_info(probe.displays)
+		self.show_x11_screen_info(probe.screens)
+		self.show_x11_window_info(probe.windows)
+		
 	def show_x11_display_info(self, displays):
 		"""
 			Update X11 display info UI
@@ -256,8 +574,353 @@ class MainUI(BaseUI):
 		# We're doing it live!
 		count_widget.set_label(str(len(thumbs)))
 		
+		started = time.monotonic()
+		self.populate_thumb_store(self.x11_windows)
 		for device in self.deviceuis:
 			device.show_thumbs(self.x11_windows)
+		self.show_x11_thumb_rebuild_time(time.monotonic() - started)
+		
+	def start_thumb_jobs(self, probe):
+		"""
+			Start making thumbnails of the windows of an X11 `probe`
+			
+			Any batch which is still going is cancelled. Thumbnails
+			which are on-screen are made first, then those of focused
+			windows, then the biggest.
+		"""
+		self.finish_thumb_jobs()
+		self.thumb_jobs.start(
+			probe.windows,
+			visible_ids=self.get_visible_thumb_ids(),
+			active_ids=probe.active_ids,
+		)
+		self.thumb_jobs_started = time.monotonic()
+		self.thumb_jobs_span = trace.TRACER.begin_async('thumb_jobs', category='thumbs')
+		self.thumb_jobs_source = GLib.timeout_add(
+			thumbs.JOBS_INTERVAL,
+			self.poll_thumb_jobs,
+		)
+		# Get going straight away
+		self.poll_thumb_jobs()
+		
+	def poll_thumb_jobs(self):
+		"""
+			Keep the thumbnail jobs going, showing each as it's made
+		"""
+		cpu = self.stats_history[-1] if self.stats_history else 0
+		for window in self.thumb_jobs.poll(thumbs.get_parallel(cpu)):
+			self.update_thumb(window)
+		if not self.thumb_jobs.is_done():
+			return True
+		
+		metrics.REGISTRY.observe(
+			'thumb_refresh_seconds',
+			time.monotonic() - self.thumb_jobs_started,
+			mode='all',
+		)
+		results = self.thumb_jobs.results
+		self.finish_thumb_jobs()
+		self.show_x11_thumbs(results)
+		return False
+		
+	def finish_thumb_jobs(self):
+		"""
+			Stop polling the thumbnail jobs, cancelling any left
+		"""
+		if self.thumb_jobs_source is not None:
+			GLib.source_remove(self.thumb_jobs_source)
+			self.thumb_jobs_source = None
+		self.thumb_jobs.cancel()
+		trace.TRACER.end_async(self.thumb_jobs_span, 'thumb_jobs', category='thumbs')
+		self.thumb_jobs_span = None
+		
+	def show_x11_thumb_rebuild_time(self, duration):
+		"""
+			Show how many seconds it took to rebuild the thumb lists
+		"""
+		widget = self.get_widget('x11_thumb_rebuild_indicator')
+		widget.set_label('{:.0f} ms'.format(duration * 1000))
+		
+	def load_thumb_pixbuf(self, window):
+		"""
+			Returns the thumbnail image of `window` as a Pixbuf
+			
+			If no thumbnail could be loaded, a placeholder is returned.
+		"""
+		filename = os.path.join(thumbs.CACHE_PATH, thumbs.get_win_filename(window))
+		try:
+			return GdkPixbuf.Pixbuf.new_from_file(filename)
+		except GLib.Error:
+			return self.thumb_placeholder
+		
+	@trace.traced()
+	def populate_thumb_store(self, windows):
+		"""
+			Refill the shared thumbnail model from the given `windows`
+			
+			Rows start off with the placeholder image; thumbnails are
+			only decoded as they're scrolled into view (see
+			load_visible_thumbs), and then only once, however many
+			device tabs are showing them.
+		"""
+		self.thumb_store.clear()
+		self.thumb_rows = {}
+		self.thumb_loaded = set()
+		for win in windows:
+			self.thumb_rows[win.id] = self.thumb_store.append([
+				win,
+				win.title,
+				self.thumb_placeholder,
+			])
+		for device in self.deviceuis:
+			self.load_visible_thumbs(device.get_visible_thumb_ids())
+		
+	@trace.traced()
+	def load_visible_thumbs(self, win_ids):
+		"""
+			Load the thumbnail images of the given window IDs
+			
+			Images which have already been loaded are left alone.
+		"""
+		if not self.thumb_jobs.is_done():
+			# Make the ones being looked at first
+			self.thumb_jobs.prioritise(win_ids)
+		for win_id in win_ids:
+			if win_id in self.thumb_loaded or win_id not in self.thumb_rows:
+				continue
+			row = self.thumb_store[self.thumb_rows[win_id]]
+			row[self.THUMB_COLUMN_PIXBUF] = self.load_thumb_pixbuf(row[self.THUMB_COLUMN_WINDOW])
+			self.thumb_loaded.add(win_id)
+		
+	def update_windows(self, windows):
+		"""
+			Take note of freshly-read X11 `windows`
+			
+			Any changes are noted by the thumb scheduler, and the
+			records in the thumb list are replaced.
+		"""
+		self.thumb_scheduler.check_states(windows)
+		if self.x11_windows == self.STATE_RELOADING:
+			return
+		by_id = {win.id: win for win in windows}
+		self.x11_windows = [by_id.get(win.id, win) for win in self.x11_windows]
+		for window in windows:
+			if window.id in self.thumb_rows:
+				row = self.thumb_store[self.thumb_rows[window.id]]
+				row[self.THUMB_COLUMN_WINDOW] = window
+				row[self.THUMB_COLUMN_TITLE] = window.title
+		
+	def update_thumb(self, window):
+		"""
+			Reload the thumbnail image of the given `window`
+			
+			If the image hasn't been loaded yet, it's left until it's
+			scrolled into view.
+		"""
+		if window.id in self.thumb_loaded:
+			self.thumb_loaded.discard(window.id)
+			self.load_visible_thumbs([window.id])
+		
+	def get_visible_thumb_ids(self):
+		"""
+			Returns the IDs of windows whose thumbnails are on-screen
+		"""
+		page = self.device_list.get_current_page()
+		# The first page is the status page, not a device
+		if page < 1 or page > len(self.deviceuis):
+			return []
+		return self.deviceuis[page - 1].get_visible_thumb_ids()
+		
+	def plan_placement(self, starting=None):
+		"""
+			Decide which CPUs each running stream should use
+			
+			The `starting` DeviceUI, if given, is included even though
+			its process isn't running yet.
+			Returns a dict of {device path: set of CPUs}, or None
+			if streams aren't being placed.
+		"""
+		devices = [
+			device for device in self.deviceuis
+			if device is starting or device.is_process_running()
+		]
+		return placement.plan([device.path for device in devices])
+		
+	def rebalance_streams(self):
+		"""
+			Re-place all running streams, eg. after one starts or stops
+		"""
+		placements = self.plan_placement()
+		if placements is None:
+			return
+		for device in self.deviceuis:
+			if device.path in placements and device.is_process_running():
+				device.set_placement(placements[device.path])
+		
+	def get_running_stream_count(self):
+		"""
+			Returns how many devices have a running ffmpeg process
+		"""
+		return sum(
+			1 for device in self.deviceuis
+			if device.is_process_running()
+		)
+		
+	def set_capacity_rates(self, rates):
+		"""
+			Use newly calibrated pixel rates for stream costs
+		"""
+		logger.info('Calibrated capacity: %r', rates)
+		self.capacity_rates = rates
+		for device in self.deviceuis:
+			device.show_capacity()
+			
+	def get_capacity_usage(self, starting=None):
+		"""
+			Returns the estimated number of cores used by all streams
+			
+			The `starting` DeviceUI, if given, is included even though
+			its process isn't running yet.
+		"""
+		usage = 0
+		for device in self.deviceuis:
+			if device is starting:
+				usage += device.get_capacity_cost()
+			elif device.is_process_running():
+				usage += device.process_cost
+		return usage
+		
+	def check_capacity(self, starting):
+		"""
+			Check whether the `starting` DeviceUI's stream will fit
+			
+			Returns a 2-tuple of whether it may start, and a message
+			to show about it (or None if there's nothing to say).
+		"""
+		if capacity.ADMISSION == capacity.ADMISSION_OFF:
+			return (True, None)
+		usage = self.get_capacity_usage(starting=starting)
+		budget = capacity.get_budget()
+		if usage <= budget:
+			return (True, None)
+			
+		message = 'Streams would need ~{usage:.1f} cores, but only {budget:.1f} are budgeted'.format(
+			usage=usage,
+			budget=budget,
+		)
+		logger.warning('%s: %s', starting.path, message)
+		return (capacity.ADMISSION != capacity.ADMISSION_REFUSE, message)
+		
+	def degrade_streams(self):
+		"""
+			Lower the fps of the most costly stream, if any are struggling
+		"""
+		now = time.monotonic()
+		if self.last_degraded is not None and now - self.last_degraded < capacity.DEGRADE_COOLDOWN:
+			return
+		running = [device for device in self.deviceuis if device.is_process_running()]
+		if not any(
+			device.drop_rate > capacity.DEGRADE_DROP_RATE
+			for device in running
+		):
+			return
+			
+		for device in sorted(running, key=lambda device: device.process_cost, reverse=True):
+			if device.degrade():
+				self.last_degraded = now
+				return
+				
+	def set_live_thumbs(self, enabled):
+		"""
+			Start or stop refreshing thumbnails in the background
+		"""
+		self.live_thumbs = enabled
+		if not enabled and self.live_thumbs_source is not None:
+			GLib.source_remove(self.live_thumbs_source)
+			self.live_thumbs_source = None
+		elif enabled and self.live_thumbs_source is None:
+			self.schedule_live_thumb(self.thumb_scheduler.min_delay)
+		
+	def schedule_live_thumb(self, delay):
+		"""
+			Refresh the next thumbnail after `delay` seconds
+		"""
+		self.live_thumbs_source = GLib.timeout_add(
+			int(delay * 1000),
+			self.refresh_live_thumb,
+		)
+		
+	@trace.traced()
+	def refresh_live_thumb(self):
+		"""
+			Start refreshing whichever thumbnail most needs it
+		"""
+		self.live_thumbs_source = None
+		started = time.monotonic()
+		windows = self.x11_windows
+		if windows == self.STATE_RELOADING or not windows:
+			self.schedule_live_thumb(self.thumb_scheduler.max_delay)
+			return False
+		
+		scheduler = self.thumb_scheduler
+		scheduler.forget_missing(windows)
+		# Look for changes in the background, for next time
+		future = self.x11_worker.refresh(scheduler.get_checks(windows))
+		future.add_done_callback(self.future_callback(self.update_windows))
+		window = scheduler.choose(windows, self.get_visible_thumb_ids())
+		filename, proc = thumbs.create(window)
+		
+		GLib.timeout_add(50, self.finish_live_thumb, window, proc, started)
+		return False
+		
+	def finish_live_thumb(self, window, proc, started):
+		"""
+			Show a refreshed thumbnail once its ffmpeg has finished
+		"""
+		if proc.poll() is None:
+			# Check again later
+			return True
+		
+		duration = time.monotonic() - started
+		metrics.REGISTRY.observe('thumb_refresh_seconds', duration, mode='live')
+		self.thumb_scheduler.record(window)
+		if not proc.returncode:
+			self.update_thumb(window)
+		
+		if self.live_thumbs and self.live_thumbs_source is None:
+			self.schedule_live_thumb(self.thumb_scheduler.get_delay(
+				duration,
+				running_streams=self.get_running_stream_count(),
+			))
+		return False
+		
+	
+	def update_process_stats(self):
+		"""
+			Sample the resource usage of all streams, and show it
+		"""
+		running = 0
+		cpu = 0
+		rss = 0
+		for device in self.deviceuis:
+			stats = device.update_process_stats()
+			if stats is None:
+				continue
+			running += 1
+			cpu += stats['cpu_percent']
+			rss += stats['rss']
+		self.stats_history.append(cpu)
+		if capacity.DEGRADE:
+			self.degrade_streams()
+		
+		widget = self.get_widget('ffmpeg_streams_indicator')
+		widget.set_label('{running} running: CPU {cpu:.0f}% (peak {peak:.0f}%), RSS {rss}'.format(
+			running=running,
+			cpu=cpu,
+			peak=max(self.stats_history),
+			rss=procstats.format_bytes(rss),
+		))
+		return True
 		
 	
 	def show_ffmpeg_installed(self, state):
@@ -280,6 +943,7 @@ class MainUI(BaseUI):
 		if version == self.STATE_RELOADING:
 			widget.set_label(self.STATE_RELOADING_LABEL)
 		else:
+			self.probes['ffmpeg_version'] = version
 			widget.set_label(str(version))
 		
 	
@@ -288,17 +952,21 @@ class DeviceUI(BaseUI):
 		Wrapper around device-specific functionality
 	"""
 	DEVICE_GLADE = os.path.join(os.path.dirname(__file__), 'device.glade')
-	THUMB_GLADE = os.path.join(os.path.dirname(__file__), 'device-thumb.glade')
 	
 	OUTPUT_SIZE_MANUAL = 'output_manual_sizing'
 	OUTPUT_SIZE_SOURCE = 'output_match_source_size'
+	# Milliseconds between updates of the process output display
+	LOG_FLUSH_INTERVAL = 250
+	# Seconds to wait after asking ffmpeg to stop before killing it
+	STOP_TIMEOUT = 5
 	
 	
 	def __init__(self, path, label, main_ui, windows=None, **kwargs):
 		"""
 			Create a new device UI inside the given `container`
 			
-			If `windows` is supplied, the thumb list will be populated.
+			The thumb list is bound to the `main_ui`s shared model.
+			If `windows` is supplied, the thumb list is made usable.
 		"""
 		super().__init__(**kwargs)
 		self.path = path
@@ -307,19 +975,79 @@ class DeviceUI(BaseUI):
 		self.handler = signals.DeviceHandler(ui=self)
 		self.widget = self.load_config_widget()
 		
-		self.clear_thumbs()
+		# Each tab filters the shared model by its own search
+		self.thumb_filter_model = self.main_ui.thumb_store.filter_new()
+		self.thumb_filter_model.set_visible_func(self.is_thumb_visible)
+		thumb_list = self.get_widget('thumb_list')
+		thumb_list.set_model(self.thumb_filter_model)
+		# Load thumbnails as they come into view
+		thumb_list.get_vadjustment().connect('value-changed', self.handler.load_visible_thumbs)
+		thumb_list.connect('size-allocate', self.handler.load_visible_thumbs)
 		if windows:
 			self.show_thumbs(windows=windows)
 		
+		# The X11 window the source was last set from, if any
+		self.source_window_id = None
+		# Any problem found with the source when restoring
+		self.source_warning = None
+		# Why the running stream isn't being recorded, if it should be
+		self.record_warning = None
+		# Additional areas to composite into the output
+		self.source_regions = []
+		# ffmpeg options found by autotune
+		self.tuning = config.get_device(self.path).get('tuning', {})
+		self.show_tuning()
+		self.get_widget('output_record_dir').set_text(
+			GLib.get_user_special_dir(GLib.UserDirectory.DIRECTORY_VIDEOS)
+			or os.path.expanduser('~')
+		)
+		
 		self.process = None
+		# The compile_command() arguments the process was started with
+		self.process_kwargs = None
+		# The CPUs the process should run on; None for anywhere
+		self.placement = None
+		self.process_monitor = None
+		# The latest progress report from ffmpeg, and when it came
+		# (by the monotonic clock)
+		self.process_progress = None
+		self.process_progress_received = None
+		# Fraction of frames dropped since the previous stats update
+		self.drop_rate = 0
+		self.last_frame_counts = None
+		# The estimated cores used by the process (see capacity)
+		self.process_cost = 0
+		# Any warning from admission control
+		self.capacity_message = None
+		self.process_stopping = False
+		self.stop_timeout_source = None
+		# Functions to call once the current process has exited
+		self.exit_callbacks = []
+		self.stdout_log = proclog.RingLog(
+			spool_filename=proclog.get_spool_filename(self.path, 'stdout'),
+		)
+		self.stderr_log = proclog.RingLog(
+			spool_filename=proclog.get_spool_filename(self.path, 'stderr'),
+		)
+		self.log_flush_source = None
 		self.clear_process_stdout()
 		self.clear_process_stderr()
 		
-	def stop(self):
+	def stop(self, callback=None):
 		"""
 			Stop all activity for this device
-		"""
-		self.stop_process()
+			
+			This doesn't wait for the process to end; if a `callback`
+			is supplied, it will be called once everything has stopped.
+		"""
+		def stopped():
+			self.stdout_log.close()
+			self.stderr_log.close()
+			metrics.REGISTRY.remove(device=self.path)
+			if callback:
+				callback()
+			
+		self.stop_process(callback=stopped)
 		
 	
 	def load_config_widget(self):
@@ -327,7 +1055,8 @@ class DeviceUI(BaseUI):
 			Loads the device config UI from file
 		"""
 		builder = Gtk.Builder()
-		builder.add_from_file(self.DEVICE_GLADE)
+		with trace.TRACER.span('load glade', filename=self.DEVICE_GLADE):
+			builder.add_from_file(self.DEVICE_GLADE)
 		builder.connect_signals(signals.MultiHandler(
 			self.handler,
 			self.main_ui.handler,
@@ -335,36 +1064,25 @@ class DeviceUI(BaseUI):
 		config = builder.get_object('device_config')
 		if config is None:
 			raise KeyError('No device_config in {}'.format(self.DEVICE_GLADE))
+		self.widgets = utils.index_widgets(builder)
 		return config
 		
-	def load_thumb_widget(self):
-		"""
-			Loads the thumb_list item widget
-		"""
-		builder = Gtk.Builder()
-		builder.add_from_file(self.THUMB_GLADE)
-		widget = builder.get_object('thumb')
-		return widget
-		
 	
 	def get_widget(self, name):
 		"""
 			Return the `name`d widget, or None
 		"""
-		return utils.find_child_by_id(self.widget, name)
+		widget = self.widgets.get(name)
+		if widget is None:
+			# Not from our glade file; have a rummage
+			widget = utils.find_child_by_id(self.widget, name)
+		return widget
 		
 	
-	def clear_thumbs(self):
-		"""
-			Remove all thumbnails from the list
-		"""
-		thumb_list = self.get_widget('thumb_list')
-		for row in thumb_list.get_children():
-			thumb_list.remove(row)
-		
+	@trace.traced()
 	def show_thumbs(self, windows):
 		"""
-			Show/update the list of window thumbnails
+			Show the state of the (shared) list of window thumbnails
 		"""
 		button_widget = self.get_widget('regen_x11_thumbs_button')
 		if windows == self.main_ui.STATE_RELOADING:
@@ -372,45 +1090,148 @@ class DeviceUI(BaseUI):
 			button_widget.set_sensitive(False)
 			return
 		
-		self.clear_thumbs()
-		for win in windows:
-			thumb = self.add_thumb(
-				label=win.get_wm_name(),
-				image=os.path.join(thumbs.CACHE_PATH, thumbs.get_win_filename(win)),
-			)
-			# Associate the thumb with the window, for later reference
-			thumb.source_window = win
-			
 		button_widget.set_sensitive(True)
 		
-	def add_thumb(self, label, image):
+	def is_thumb_visible(self, model, treeiter, data=None):
+		"""
+			Whether a row of the thumb model passes the title filter
+		"""
+		search = self.get_widget('thumb_filter').get_text().strip().lower()
+		if not search:
+			return True
+		title = model[treeiter][self.main_ui.THUMB_COLUMN_TITLE] or ''
+		return search in title.lower()
+		
+	def filter_thumbs(self):
+		"""
+			Re-apply the title filter to the thumb list
+		"""
+		self.thumb_filter_model.refilter()
+		self.main_ui.load_visible_thumbs(self.get_visible_thumb_ids())
+		
+	def get_thumb_window(self, path):
+		"""
+			Returns the X11 window of the thumb_list item at `path`
+		"""
+		model = self.get_widget('thumb_list').get_model()
+		return model[path][self.main_ui.THUMB_COLUMN_WINDOW]
+		
+	def get_visible_thumb_ids(self):
 		"""
-			Add a single thumbnail to the list of window thumbnails
+			Returns the IDs of windows whose thumbs are scrolled into view
 		"""
 		thumb_list = self.get_widget('thumb_list')
-		thumb = self.load_thumb_widget()
-		# The label part
-		label_widget = utils.find_child_by_id(thumb, 'label')
-		label_widget.set_text(label)
-		# The image part
-		image_widget = utils.find_child_by_id(thumb, 'image')
-		image_widget.set_from_file(image)
-		# Finally, add it to the list
-		thumb_list.add(thumb)
-		return thumb
+		visible = thumb_list.get_visible_range()
+		if not visible:
+			return []
+		model = thumb_list.get_model()
+		first = visible[0].get_indices()[0]
+		last = visible[1].get_indices()[0]
+		return [
+			model[idx][self.main_ui.THUMB_COLUMN_WINDOW].id
+			for idx in range(first, last + 1)
+		]
 		
 	
 	def set_source_window(self, window):
 		"""
 			Set the source details from the given `window`
 		"""
-		geom = window.get_abs_geometry()
-		self.get_widget('source_screen').set_text(str(window.screen.full_id))
+		geom = window.geometry
+		self.source_window_id = window.id
+		self.source_warning = None
+		self.get_widget('source_screen').set_text(window.screen_id)
 		self.get_widget('source_x').set_text(str(geom['x']))
 		self.get_widget('source_y').set_text(str(geom['y']))
 		self.get_widget('source_width').set_text(str(geom['width']))
 		self.get_widget('source_height').set_text(str(geom['height']))
 		
+	def get_source_config(self):
+		"""
+			Returns the source area from the UI as a dict
+			
+			The dict has keys of screen, x, y, width and height.
+			The values are the (unvalidated) strings from the UI.
+		"""
+		return {
+			name: self.get_widget('source_' + name).get_text()
+			for name in ['screen', 'x', 'y', 'width', 'height']
+		}
+		
+	def verify_source(self, windows):
+		"""
+			Check the source window still exists, where it was
+			
+			Any problem is shown along with the process state.
+		"""
+		if self.source_window_id is None:
+			return
+		window = None
+		for win in windows:
+			if win.id == self.source_window_id:
+				window = win
+				break
+		
+		source = self.get_source_config()
+		if window is None:
+			self.source_warning = 'The source window no longer exists'
+		elif any(
+			str(window.geometry[name]) != source[name]
+			for name in ['x', 'y', 'width', 'height']
+		):
+			self.source_warning = 'The source window has moved or changed size'
+		if self.source_warning:
+			logger.warning('%s: %s', self.path, self.source_warning)
+			self.show_process_state()
+		
+	def add_source_region(self):
+		"""
+			Add the current source area to the regions to composite
+		"""
+		region = self.get_source_config()
+		if not all(region.values()):
+			return
+		self.source_regions.append(region)
+		
+	def clear_source_regions(self):
+		"""
+			Go back to streaming only the single source area
+		"""
+		self.source_regions = []
+		
+	def get_source_regions(self):
+		"""
+			Returns the regions to composite, laid out for the output
+			
+			Returns None if there aren't multiple regions to composite.
+		"""
+		if len(self.source_regions) < 2:
+			return None
+		return ffmpeg.layout_regions(
+			self.source_regions,
+			self.get_widget('source_layout').get_active_id(),
+			self.get_widget('output_width').get_text(),
+			self.get_widget('output_height').get_text(),
+		)
+		
+	def show_source_regions(self):
+		"""
+			Update the summary of regions to composite
+			
+			When compositing, this includes how the cost of grabbing
+			compares to that of grabbing each region separately.
+		"""
+		widget = self.get_widget('source_regions_summary')
+		if len(self.source_regions) < 2:
+			widget.set_label('{} region(s) added'.format(len(self.source_regions)))
+			return
+		
+		combined, separate = ffmpeg.get_grab_cost(self.source_regions)
+		widget.set_label('{count} regions: grabbing {pct:.0f}% of the pixels of separate grabs'.format(
+			count=len(self.source_regions),
+			pct=combined / separate * 100,
+		))
+		
 	
 	def get_output_sizing_method(self):
 		"""
@@ -481,15 +1302,14 @@ class DeviceUI(BaseUI):
 		height_widget.set_text(str(height))
 		
 	
-	def get_process_command(self):
+	def get_command_kwargs(self, record=True):
 		"""
-			Provide ffmpeg command based on what the UI displays
+			Provide ffmpeg.compile_command() arguments from the UI
 			
-			The command is returned as a list of string tokens,
-			suitable for passing to subprocess.Popen, or ' '.join().
-			
-			If a command cannot be compiled due to missing or invalid
-			inputs, the return value will be an empty list.
+			The stream is also recorded if that's switched on, unless
+			`record` is false.
+			Returns None if the output size hasn't been set, and
+			raises ValueError if the output format is invalid.
 		"""
 		# We take as much as possible from the UI, so that the
 		# actual values we use are visible to the user.
@@ -497,7 +1317,10 @@ class DeviceUI(BaseUI):
 		output_height = self.get_widget('output_height').get_text()
 		invalids = [None, '', '0']
 		if output_width in invalids or output_height in invalids:
-			return []
+			return None
+		problem = self.check_output_format()
+		if problem:
+			raise ValueError(problem)
 		
 		# Ignore UI controls from unchosen sizing methods
 		if self.get_output_sizing_method() == self.OUTPUT_SIZE_SOURCE:
@@ -507,69 +1330,602 @@ class DeviceUI(BaseUI):
 			scale=True
 			maintain_aspect = self.get_widget('output_maintain_aspect').get_active()
 		
-		try:
-			cmd = ffmpeg.compile_command(
-				source_screen=self.get_widget('source_screen').get_text(),
-				source_x=self.get_widget('source_x').get_text(),
-				source_y=self.get_widget('source_y').get_text(),
-				source_width=self.get_widget('source_width').get_text(),
-				source_height=self.get_widget('source_height').get_text(),
-				output_filename=self.path,
-				output_width=output_width,
-				output_height=output_height,
-				fps=self.get_widget('output_fps').get_text(),
-				scale=scale,
-				maintain_aspect=maintain_aspect,
-				loglevel='info',
+		kwargs = dict(
+			regions=self.get_source_regions(),
+			source_screen=self.get_widget('source_screen').get_text(),
+			source_x=self.get_widget('source_x').get_text(),
+			source_y=self.get_widget('source_y').get_text(),
+			source_width=self.get_widget('source_width').get_text(),
+			source_height=self.get_widget('source_height').get_text(),
+			output_filename=self.path,
+			output_width=output_width,
+			output_height=output_height,
+			fps=self.get_widget('output_fps').get_text(),
+			profile=self.get_widget('output_profile').get_active_id(),
+			retarget=self.get_widget('output_retarget').get_active(),
+			codec=self.get_widget('output_codec').get_active_id(),
+			quality=self.get_widget('output_quality').get_text().strip() or None,
+			scale=scale,
+			maintain_aspect=maintain_aspect,
+			loglevel='info',
+		)
+		kwargs.update(self.tuning)
+		if self.placement and not self.tuning.get('threads'):
+			kwargs['threads'] = len(self.placement)
+		threads = self.get_widget('output_threads').get_text().strip()
+		if threads:
+			kwargs['threads'] = threads
+		if record and self.get_widget('output_record').get_active():
+			try:
+				kwargs['record_filename'] = self.get_record_filename()
+			except ValueError:
+				# The stream can go ahead without
+				pass
+		return kwargs
+		
+	def check_output_format(self):
+		"""
+			Check the quality and threads entered for the output format
+			
+			Each invalid entry is marked with what's wrong with it.
+			Returns what's wrong, or None if they're fine.
+		"""
+		problems = {}
+		quality = self.get_widget('output_quality').get_text().strip()
+		codec = self.get_widget('output_codec').get_active_id()
+		if codec == ffmpeg.CODEC_MJPEG and quality and not (
+			quality.isdecimal()
+			and ffmpeg.MJPEG_QUALITY_BEST <= int(quality) <= ffmpeg.MJPEG_QUALITY_WORST
+		):
+			problems['output_quality'] = 'Quality should be a number from {} to {}'.format(
+				ffmpeg.MJPEG_QUALITY_BEST, ffmpeg.MJPEG_QUALITY_WORST,
 			)
+		threads = self.get_widget('output_threads').get_text().strip()
+		if threads and not threads.isdecimal():
+			problems['output_threads'] = 'Threads should be a whole number, or empty for auto'
+			
+		for name in ['output_quality', 'output_threads']:
+			widget = self.get_widget(name)
+			problem = problems.get(name)
+			widget.set_icon_from_icon_name(
+				Gtk.EntryIconPosition.SECONDARY,
+				'dialog-warning' if problem else None,
+			)
+			widget.set_icon_tooltip_text(Gtk.EntryIconPosition.SECONDARY, problem)
+		return '; '.join(problems.values()) or None
+		
+	def get_record_filename(self):
+		"""
+			Returns a new filename to record the stream into
+			
+			Filenames are stamped with the current time, so that
+			each run of the process gets its own recording.
+		"""
+		record_dir = self.get_widget('output_record_dir').get_text()
+		if not record_dir:
+			raise ValueError('No directory to record into')
+		return os.path.join(
+			os.path.expanduser(record_dir),
+			'{}-{}.mkv'.format(
+				os.path.basename(self.path),
+				time.strftime('%Y%m%d-%H%M%S'),
+			),
+		)
+		
+	def check_record_dir(self):
+		"""
+			Make sure there's a directory to record the stream into
+			
+			Returns why the stream can't be recorded, or None if it
+			can (or recording is off).
+		"""
+		if not self.get_widget('output_record').get_active():
+			return None
+		record_dir = os.path.expanduser(self.get_widget('output_record_dir').get_text())
+		if not record_dir:
+			return 'Not recording: no directory to record into'
+		try:
+			os.makedirs(record_dir, exist_ok=True)
+		except OSError as err:
+			return 'Not recording: {}'.format(err)
+		if not os.access(record_dir, os.W_OK | os.X_OK):
+			return 'Not recording: {} isn\'t writable'.format(record_dir)
+		return None
+		
+	def get_process_command(self, record=True):
+		"""
+			Provide ffmpeg command based on what the UI displays
+			
+			The command is returned as a list of string tokens,
+			suitable for passing to subprocess.Popen, or ' '.join().
+			See get_command_kwargs() for `record`.
+			
+			If a command cannot be compiled due to missing or invalid
+			inputs, the return value will be an empty list.
+		"""
+		try:
+			kwargs = self.get_command_kwargs(record=record)
+			if kwargs is None:
+				return []
+			cmd = ffmpeg.compile_command(**kwargs)
 		except ValueError:
 			cmd = []
 		return cmd
 		
+	def get_snapshot(self):
+		"""
+			Returns the state of the device, for session.save()
+		"""
+		return {
+			'path': self.path,
+			'label': self.label,
+			'source': self.get_source_config(),
+			'source_window_id': self.source_window_id,
+			'source_regions': self.source_regions,
+			'source_layout': self.get_widget('source_layout').get_active_id(),
+			'output_sizing': self.get_output_sizing_method(),
+			'output_size': self.get_widget('output_size_select').get_active_text(),
+			'output_maintain_aspect': self.get_widget('output_maintain_aspect').get_active(),
+			'output_force_even': self.get_widget('output_force_even').get_active(),
+			'output_fps': self.get_widget('output_fps').get_text(),
+			'output_profile': self.get_widget('output_profile').get_active_id(),
+			'output_record': self.get_widget('output_record').get_active(),
+			'output_record_dir': self.get_widget('output_record_dir').get_text(),
+			'output_retarget': self.get_widget('output_retarget').get_active(),
+			'output_codec': self.get_widget('output_codec').get_active_id(),
+			'output_quality': self.get_widget('output_quality').get_text(),
+			'output_threads': self.get_widget('output_threads').get_text(),
+			'running': self.is_process_running(),
+		}
+		
+	def apply_snapshot(self, snapshot):
+		"""
+			Set up the device as it was in a get_snapshot()
+			
+			This doesn't start the process.
+		"""
+		for name, value in snapshot['source'].items():
+			self.get_widget('source_' + name).set_text(value)
+		self.source_window_id = snapshot['source_window_id']
+		self.source_regions = list(snapshot['source_regions'])
+		self.get_widget('source_layout').set_active_id(snapshot['source_layout'])
+		self.get_widget('output_size_stack').set_visible_child_name(snapshot['output_sizing'])
+		self.get_widget('output_size_select').get_child().set_text(snapshot['output_size'])
+		self.get_widget('output_maintain_aspect').set_active(snapshot['output_maintain_aspect'])
+		self.get_widget('output_force_even').set_active(snapshot['output_force_even'])
+		self.get_widget('output_fps').set_text(snapshot['output_fps'])
+		self.get_widget('output_profile').set_active_id(
+			snapshot.get('output_profile', ffmpeg.PROFILE_DEFAULT)
+		)
+		self.get_widget('output_record').set_active(snapshot.get('output_record', False))
+		if snapshot.get('output_record_dir'):
+			self.get_widget('output_record_dir').set_text(snapshot['output_record_dir'])
+		self.get_widget('output_retarget').set_active(snapshot.get('output_retarget', False))
+		self.get_widget('output_codec').set_active_id(
+			snapshot.get('output_codec', ffmpeg.CODEC_RAW)
+		)
+		self.get_widget('output_quality').set_text(
+			snapshot.get('output_quality', str(ffmpeg.MJPEG_QUALITY))
+		)
+		self.get_widget('output_threads').set_text(snapshot.get('output_threads', ''))
+		self.handler.refresh_output_config()
+		
+	def show_tuning(self, result=None):
+		"""
+			Show the ffmpeg options in use from autotune
+			
+			The `result` can be an autotune.Result to show how the
+			options performed, STATE_RELOADING while tuning is under
+			way, or a message string.
+		"""
+		button = self.get_widget('process_autotune')
+		button.set_sensitive(result != self.STATE_RELOADING)
+		if result == self.STATE_RELOADING:
+			text = 'Tuning...'
+		elif isinstance(result, str):
+			text = result
+		elif not self.tuning:
+			text = 'ffmpeg defaults'
+		else:
+			text = ', '.join(
+				'{}={}'.format(name, value)
+				for name, value in sorted(self.tuning.items())
+			)
+			if result is not None:
+				text += '\n{fps:.1f} fps using {cpu:.0f}% CPU when trialled'.format(
+					fps=result.fps,
+					cpu=result.cpu_percent,
+				)
+		self.get_widget('process_tuning').set_label(text)
+		
+	def show_pacing(self, result):
+		"""
+			Show how evenly the stream's frames arrive at the device
+			
+			The `result` can be from pacing.analyse_device(),
+			STATE_RELOADING while it's under way, or a message string.
+			The full report, with histograms, is in the tooltip.
+		"""
+		self.get_widget('process_analyse_pacing').set_sensitive(
+			result != self.STATE_RELOADING
+		)
+		label = self.get_widget('process_pacing')
+		if result == self.STATE_RELOADING:
+			label.set_label('Analysing...')
+			label.set_tooltip_text(None)
+		elif isinstance(result, str):
+			label.set_label(result)
+			label.set_tooltip_text(None)
+		else:
+			label.set_label(pacing.summarise(result))
+			label.set_tooltip_markup('<tt>{}</tt>'.format(
+				GLib.markup_escape_text(pacing.format_report(result))
+			))
+			
+	def show_loopback_memory(self):
+		"""
+			Show how much memory the device's buffers take for this stream
+			
+			Along with how far behind the buffers let a reader fall,
+			which is what more buffers cost in latency.
+		"""
+		label = self.get_widget('process_loopback')
+		module_params = v4l2.get_module_params()
+		buffers = module_params['max_buffers']
+		try:
+			kwargs = self.get_command_kwargs()
+			width = int(kwargs['output_width'])
+			height = int(kwargs['output_height'])
+			fps = float(kwargs['fps'] or 0)
+		except (TypeError, ValueError):
+			kwargs = None
+		if kwargs is None:
+			label.set_label('{} buffers: up to {} at {}x{}'.format(
+				buffers,
+				procstats.format_bytes(v4l2.get_memory(
+					buffers, module_params['max_width'], module_params['max_height'],
+				)),
+				module_params['max_width'],
+				module_params['max_height'],
+			))
+			return
+			
+		if kwargs.get('codec', ffmpeg.CODEC_RAW) == ffmpeg.CODEC_RAW:
+			bytes_per_pixel = v4l2.BYTES_PER_PIXEL.get(
+				kwargs.get('pix_fmt') or 'yuv420p',
+				v4l2.MAX_BYTES_PER_PIXEL,
+			)
+		else:
+			bytes_per_pixel = v4l2.MAX_BYTES_PER_PIXEL
+		text = '{buffers} buffers of {width}x{height}: {memory}'.format(
+			buffers=buffers,
+			width=width,
+			height=height,
+			memory=procstats.format_bytes(v4l2.get_memory(buffers, width, height, bytes_per_pixel)),
+		)
+		if fps:
+			text += '; readers can fall up to {:.0f} ms behind'.format(buffers / fps * 1000)
+		if width > module_params['max_width'] or height > module_params['max_height']:
+			text += '\nLarger than the module allows ({}x{}), so it won\'t start'.format(
+				module_params['max_width'],
+				module_params['max_height'],
+			)
+		label.set_label(text)
+		
+	def show_buffer_latency(self, result):
+		"""
+			Show how long frames wait in the device's buffers
+			
+			The `result` can be a list of latencies from
+			latency.measure_device(), STATE_RELOADING while it's
+			under way, or a message string.
+		"""
+		self.get_widget('process_check_latency').set_sensitive(
+			result != self.STATE_RELOADING
+		)
+		if result == self.STATE_RELOADING:
+			text = 'Measuring...'
+		elif isinstance(result, str):
+			text = result
+		elif not result:
+			text = 'No frames could be matched; is the source changing on every frame?'
+		else:
+			text = 'median {median:.1f} ms, p95 {p95:.1f} ms, max {max:.1f} ms over {frames} frames'.format(
+				**latency.summarise(result)
+			)
+		self.get_widget('process_buffer_latency').set_label(text)
+		
+	def set_tuning(self, result):
+		"""
+			Use (and remember) the options found by autotune
+		"""
+		if result is None:
+			self.show_tuning('No working configuration was found')
+			return
+		options = dict(result.options)
+		fps = options.pop('fps')
+		self.tuning = options
+		config.update_device(self.path, tuning=options)
+		fps_widget = self.get_widget('output_fps')
+		if fps_widget.get_text() != str(fps):
+			# NB. This updates the process command too
+			fps_widget.set_text(str(fps))
+		else:
+			self.update_process_command()
+		self.show_tuning(result)
+		
 	def update_process_command(self):
 		"""
 			Update the display of the ffmpeg command to use
 		"""
 		cmd = self.get_process_command()
-		self.get_widget('process_command').set_text(' '.join(cmd))
+		command_widget = self.get_widget('process_command')
+		command_widget.set_text(' '.join(cmd))
+		# Say why there's no command, if it's down to the format
+		command_widget.set_placeholder_text(
+			None if cmd else self.check_output_format()
+		)
+		self.show_loopback_memory()
+		
+	def is_process_running(self):
+		"""
+			Whether there is an ffmpeg process which hasn't yet exited
+			
+			NB. We rely on the GLib child watch to notice the exit,
+			rather than Popen.poll(), so that the two don't race to
+			reap the process.
+		"""
+		return self.process is not None and self.process.returncode is None
 		
 	def show_process_state(self):
 		if self.process is None:
 			state = 'Stopped'
-		elif self.process.poll() is not None:
+		elif not self.is_process_running():
 			state = 'Stopped ({})'.format(self.process.returncode)
+		elif self.process_stopping:
+			state = 'Stopping (pid {})'.format(self.process.pid)
 		else:
 			state = 'Running (pid {})'.format(self.process.pid)
 		
+		if self.source_warning:
+			state += '\n' + self.source_warning
+		if self.record_warning and self.is_process_running():
+			state += '\n' + self.record_warning
 		self.get_widget('process_state').set_label(state)
+		self.show_placement()
+		self.show_capacity()
+		
+	def show_placement(self):
+		"""
+			Show which CPUs the process has been placed on
+		"""
+		if not self.is_process_running():
+			text = ''
+		elif self.placement is None:
+			text = 'Any CPU'
+		else:
+			text = 'CPUs {cpus}, nice {nice}, IO priority {io}'.format(
+				cpus=placement.format_cpu_list(self.placement),
+				nice=placement.NICE,
+				io=placement.IONICE_LEVEL,
+			)
+		self.get_widget('process_placement').set_label(text)
+		
+	def set_placement(self, cpus):
+		"""
+			Move the running process onto the given set of `cpus`
+		"""
+		if cpus == self.placement:
+			# Including a stream which was just started there
+			return
+		self.placement = cpus
+		placement.apply(self.process.pid, cpus)
+		self.show_placement()
+		
+	def get_capacity_cost(self):
+		"""
+			Returns the estimated cores the configured stream would use
+		"""
+		def to_int(text):
+			return int(text) if text.isdigit() else 0
+			
+		fps = to_int(self.get_widget('output_fps').get_text()) or capacity.UNLIMITED_FPS
+		if len(self.source_regions) > 1:
+			pixels = ffmpeg.get_grab_cost(self.source_regions)[0]
+			mode = capacity.get_mode(0, 0, 0, 0, composite=True)
+		else:
+			width = to_int(self.get_widget('source_width').get_text())
+			height = to_int(self.get_widget('source_height').get_text())
+			pixels = width * height
+			mode = capacity.get_mode(
+				width,
+				height,
+				to_int(self.get_widget('output_width').get_text()),
+				to_int(self.get_widget('output_height').get_text()),
+			)
+		return capacity.get_cost(pixels, fps, mode, rates=self.main_ui.capacity_rates)
+		
+	def show_capacity(self):
+		"""
+			Show the estimated cost of the stream, and any warnings
+		"""
+		if self.is_process_running():
+			cost = self.process_cost
+		else:
+			try:
+				cost = self.get_capacity_cost()
+			except (KeyError, ValueError):
+				cost = 0
+		text = '~{cost:.2f} cores, of {budget:.1f} budgeted for all streams'.format(
+			cost=cost,
+			budget=capacity.get_budget(),
+		)
+		if self.capacity_message:
+			text += '\n' + self.capacity_message
+		self.get_widget('process_capacity').set_label(text)
+		
+	def update_drop_rate(self):
+		"""
+			Work out the fraction of frames dropped since last time
+		"""
+		progress = self.process_progress or {}
+		try:
+			counts = (int(progress['frame']), int(progress['drop']))
+		except (KeyError, ValueError):
+			self.drop_rate = 0
+			return
+			
+		last = self.last_frame_counts
+		self.last_frame_counts = counts
+		if last is None:
+			return
+		frames = counts[0] - last[0]
+		drops = counts[1] - last[1]
+		if frames + drops > 0:
+			self.drop_rate = drops / (frames + drops)
+			
+	def degrade(self):
+		"""
+			Restart the stream at a lower fps, to relieve the CPU
+			
+			Returns whether the fps could be lowered.
+		"""
+		fps_widget = self.get_widget('output_fps')
+		fps = fps_widget.get_text()
+		fps = int(fps) if fps.isdigit() else 0
+		new_fps = capacity.get_degraded_fps(fps or capacity.UNLIMITED_FPS)
+		if new_fps is None:
+			return False
+		logger.warning(
+			'%s: dropping %.0f%% of frames; lowering fps from %s to %d',
+			self.path,
+			self.drop_rate * 100,
+			fps or 'unlimited',
+			new_fps,
+		)
+		fps_widget.set_text(str(new_fps))
+		self.capacity_message = 'Degraded to {} fps after dropping frames'.format(new_fps)
+		self.restart_process()
+		return True
+		
+	def update_process_stats(self):
+		"""
+			Sample the resource usage of the ffmpeg process, and show it
+			
+			Returns the latest stats (see procstats.ProcessMonitor),
+			or None if the process isn't running.
+		"""
+		widget = self.get_widget('process_stats')
+		stats = None
+		if self.is_process_running():
+			stats = self.process_monitor.update()
+		metrics.REGISTRY.set('stream_up', int(stats is not None), device=self.path)
+		if stats is None:
+			widget.set_label('')
+			return None
+		self.update_drop_rate()
+		
+		metrics.REGISTRY.set('stream_cpu_percent', stats['cpu_percent'], device=self.path)
+		metrics.REGISTRY.set('stream_rss_bytes', stats['rss'], device=self.path)
+		if self.process_progress:
+			try:
+				fps = float(self.process_progress.get('fps', 0))
+			except ValueError:
+				fps = 0
+			metrics.REGISTRY.set('stream_fps', fps, device=self.path)
+		
+		monitor = self.process_monitor
+		widget.set_label(
+			'CPU {cpu:.0f}% (mean {mean:.0f}%, peak {peak:.0f}%), '
+			'RSS {rss}, {threads} threads\n'
+			'{vol:.0f}/s voluntary, {invol:.0f}/s involuntary switches, '
+			'{wait:.1f}% waiting for CPU'.format(
+				cpu=stats['cpu_percent'],
+				mean=monitor.get_mean('cpu_percent'),
+				peak=monitor.get_peak('cpu_percent'),
+				rss=procstats.format_bytes(stats['rss']),
+				threads=stats['threads'],
+				vol=stats['voluntary_switches'],
+				invol=stats['involuntary_switches'],
+				wait=stats['wait_percent'],
+			)
+		)
+		return stats
 		
 	def clear_process_stdout(self):
 		"""
 			Clear the display of the process STDOUT
 		"""
-		stdout_widget = self.get_widget('process_stdout')
-		stdout_widget.get_buffer().set_text('')
+		self.stdout_log.clear()
+		self.show_process_output()
 		
 	def clear_process_stderr(self):
 		"""
 			Clear the display of the process STDERR
 		"""
-		stderr_widget = self.get_widget('process_stderr')
-		stderr_widget.get_buffer().set_text('')
+		self.stderr_log.clear()
+		self.show_process_output()
 		
 	def append_process_stdout(self, output):
 		"""
-			Append some text to the process STDOUT display
+			Append some text to the process STDOUT log
+			
+			The display is only updated by flush_process_output().
 		"""
-		stdout_buffer = self.get_widget('process_stdout').get_buffer()
-		stdout_buffer.insert(stdout_buffer.get_end_iter(), output)
+		self.stdout_log.append(output)
 		
 	def append_process_stderr(self, output):
 		"""
-			Append some text to the process STDERR display
+			Append some text to the process STDERR log
+			
+			The display is only updated by flush_process_output().
 		"""
-		stderr_buffer = self.get_widget('process_stderr').get_buffer()
-		stderr_buffer.insert(stderr_buffer.get_end_iter(), output)
+		self.stderr_log.append(output)
+		progress = ffmpeg.parse_progress(output)
+		if progress:
+			if self.process_progress is None:
+				# The first frame is out
+				self.main_ui.finish_restoring(self)
+			self.process_progress = progress
+			self.process_progress_received = time.monotonic()
+		
+	def show_process_output(self):
+		"""
+			Update the process output displays from their logs
+			
+			Only the retained tail of each log is shown, and nothing
+			is done unless the log has changed. New output is added
+			to the end, and old output trimmed from the start, so
+			that the whole buffer needn't be laid out again.
+		"""
+		for log, name in [
+			(self.stdout_log, 'process_stdout'),
+			(self.stderr_log, 'process_stderr'),
+		]:
+			if not log.dirty:
+				continue
+			buff = self.get_widget(name).get_buffer()
+			reset, text = log.take_changes()
+			if reset:
+				buff.set_text(text)
+				continue
+			# Replace the partial last line
+			buff.delete(buff.get_iter_at_line(buff.get_line_count() - 1), buff.get_end_iter())
+			buff.insert(buff.get_end_iter(), text)
+			excess = buff.get_line_count() - 1 - len(log.lines)
+			if excess > 0:
+				buff.delete(buff.get_start_iter(), buff.get_iter_at_line(excess))
+		
+	def flush_process_output(self):
+		"""
+			Periodically update the process output displays
+		"""
+		self.show_process_output()
+		# Keep going for as long as there might be more output
+		if self.is_process_running():
+			return True
+		self.log_flush_source = None
+		return False
 		
 	def scroll_process_output(self, text_widget):
 		"""
@@ -583,19 +1939,60 @@ class DeviceUI(BaseUI):
 		if bottom + 20 > adj.get_upper():
 			adj.set_value(adj.get_upper() - adj.get_page_size())
 		
+	@trace.traced()
 	def start_process(self):
 		"""
 			Start the ffmpeg subprocess
 		"""
-		if self.process and self.process.poll() is None:
+		if self.is_process_running():
 			raise RuntimeError('Refusing to start process when already running')
-		
-		cmd = self.get_process_command()
+			
+		allowed, self.capacity_message = self.main_ui.check_capacity(self)
+		if not allowed:
+			self.show_process_state()
+			return
+		self.process_cost = self.get_capacity_cost()
+		
+		placements = self.main_ui.plan_placement(starting=self)
+		self.placement = placements[self.path] if placements else None
+		
+		# A recording which can't be written mustn't take the stream down
+		self.record_warning = self.check_record_dir()
+		if self.record_warning:
+			logger.warning('%s: %s', self.path, self.record_warning)
+		record = self.record_warning is None
+		cmd = self.get_process_command(record=record)
+		self.process_kwargs = self.get_command_kwargs(record=record) if cmd else None
+		retarget = bool(self.process_kwargs and self.process_kwargs.get('retarget'))
+		if self.placement:
+			# Placed by the command itself, so that all of ffmpeg's
+			# threads inherit it; NB. the pid is still ffmpeg's, as
+			# each tool in the prefix execs the next
+			cmd = placement.get_command_prefix(self.placement) + cmd
 		self.process = subprocess.Popen(
 			cmd,
 			stdout=subprocess.PIPE,
 			stderr=subprocess.PIPE,
-			stdin=subprocess.DEVNULL,
+			# Retargetable streams are steered through ffmpeg's stdin
+			stdin=subprocess.PIPE if retarget else subprocess.DEVNULL,
+		)
+		self.process_stopping = False
+		self.exit_callbacks = []
+		self.process_progress = None
+		self.drop_rate = 0
+		self.last_frame_counts = None
+		self.process_monitor = procstats.ProcessMonitor(self.process.pid)
+		metrics.REGISTRY.inc('stream_starts', device=self.path)
+		metrics.REGISTRY.set(
+			'stream_configured_fps',
+			float(self.get_widget('output_fps').get_text() or 0),
+			device=self.path,
+		)
+		GLib.child_watch_add(
+			GLib.PRIORITY_DEFAULT,
+			self.process.pid,
+			self.on_process_exit,
+			self.process,
 		)
 		# Make the pipes non-blocking
 		flags = fcntl.fcntl(self.process.stdout, fcntl.F_GETFL)
@@ -610,10 +2007,13 @@ class DeviceUI(BaseUI):
 		def output_callback(fd, condition, pipe, func):
 			""" Read from pipe, and pass to the given func """
 			output = pipe.read()
-			if not output:
+			if output:
+				func(output.decode('utf-8', errors='replace'))
+			if not output or condition == GLib.IO_HUP:
+				# Make sure the final words get shown
+				self.show_process_output()
 				return False
-			func(output.decode('utf-8'))
-			return condition != GLib.IO_HUP
+			return True
 			
 		stdout_read_cb = GLib.io_add_watch(
 			self.process.stdout,
@@ -632,23 +2032,136 @@ class DeviceUI(BaseUI):
 			self.append_process_stderr,
 		)
 		
+		# Coalesce output into a few display updates per second
+		if self.log_flush_source is None:
+			self.log_flush_source = GLib.timeout_add(
+				self.LOG_FLUSH_INTERVAL,
+				self.flush_process_output,
+			)
+		
 		# Update the UI
 		self.show_process_state()
+		self.update_process_command()
+		# Make room for the new stream
+		self.main_ui.rebalance_streams()
+		
+	def on_process_exit(self, pid, status, process):
+		"""
+			Called by GLib once an ffmpeg `process` has exited
+		"""
+		# GLib has reaped the process, so Popen never will
+		if process.returncode is None:
+			if os.WIFSIGNALED(status):
+				process.returncode = -os.WTERMSIG(status)
+			else:
+				process.returncode = os.WEXITSTATUS(status)
+		GLib.spawn_close_pid(pid)
+		if process.stdin:
+			process.stdin.close()
+		if process is not self.process:
+			return
+		
+		if self.stop_timeout_source is not None:
+			GLib.source_remove(self.stop_timeout_source)
+			self.stop_timeout_source = None
+		self.process_stopping = False
+		self.show_process_state()
+		metrics.REGISTRY.set('stream_up', 0, device=self.path)
+		metrics.REGISTRY.set('stream_fps', 0, device=self.path)
+		self.placement = None
+		self.main_ui.rebalance_streams()
+		self.main_ui.finish_restoring(self)
+		
+		callbacks = self.exit_callbacks
+		self.exit_callbacks = []
+		for callback in callbacks:
+			callback()
+		
+	def kill_process(self, process):
+		"""
+			Forcibly stop a `process` which didn't stop when asked
+		"""
+		self.stop_timeout_source = None
+		if process is self.process and self.is_process_running():
+			logger.warning(
+				'%s: pid %d ignored SIGTERM for %ds; killing',
+				self.path,
+				process.pid,
+				self.STOP_TIMEOUT,
+			)
+			process.send_signal(signal.SIGKILL)
+		return False
 		
-	def stop_process(self):
+	def stop_process(self, callback=None):
 		"""
 			Stop any ffmpeg subprocess
 			
-			NB: This function blocks until the subprocess is finished!
-		"""
-		if not self.process or self.process.poll() is not None:
+			This returns immediately, after asking the process to stop.
+			If it hasn't exited after STOP_TIMEOUT seconds, it is
+			killed instead.
+			The `callback`, if given, is called without arguments once
+			the process has exited (or immediately, if there is no
+			running process).
+		"""
+		if not self.is_process_running():
 			# Already stopped
 			self.show_process_state()
+			if callback:
+				callback()
 			return
 		
-		self.process.terminate()
-		## TODO: Handle this in an async manner
-		self.process.wait()
+		if callback:
+			self.exit_callbacks.append(callback)
+		if not self.process_stopping:
+			self.process_stopping = True
+			self.process.terminate()
+			self.stop_timeout_source = GLib.timeout_add_seconds(
+				self.STOP_TIMEOUT,
+				self.kill_process,
+				self.process,
+			)
 		self.show_process_state()
 		
+	def restart_process(self):
+		"""
+			Stop any ffmpeg subprocess, then start a new one
+		"""
+		self.stop_process(callback=self.start_process)
+		
+	@trace.traced()
+	def retarget_process(self):
+		"""
+			Move the running stream onto the current source, in place
+			
+			Returns whether the stream could be moved; if not, it
+			needs restarting to pick up the new source.
+		"""
+		if not self.is_process_running() or self.process_stopping:
+			return False
+		try:
+			kwargs = self.get_command_kwargs()
+		except ValueError:
+			return False
+		if kwargs is None or not ffmpeg.can_retarget(self.process_kwargs, kwargs):
+			return False
+		
+		# Where the stream is now: the time of the latest frame
+		# ffmpeg has reported, plus how long ago it reported it.
+		# Before the first report, the stream is at its start.
+		stream_time = 0
+		progress_time = ffmpeg.parse_time((self.process_progress or {}).get('time'))
+		if progress_time is not None:
+			stream_time = progress_time + time.monotonic() - self.process_progress_received
+		try:
+			self.process.stdin.write(
+				ffmpeg.get_retarget_input(self.process_kwargs, kwargs, stream_time)
+			)
+			self.process.stdin.flush()
+		except OSError:
+			# It's on its way out
+			return False
+		self.process_kwargs = kwargs
+		metrics.REGISTRY.inc('stream_retargets', device=self.path)
+		return True
+		
 	
@@ -27,3 +27,24 @@ def find_child_by_id(root, name):
 				next_level.extend(child.get_children())
 	# Hierarchy exhausted. Ho hum.
 	
+
+def index_widgets(builder):
+	"""
+		Returns a dict of {name: widget} for everything in `builder`
+		
+		This lets us look widgets up by name without walking the
+		whole widget hierarchy each time.
+		Objects which weren't given an ID in the glade file are
+		not included.
+	"""
+	index = {}
+	for obj in builder.get_objects():
+		if not isinstance(obj, Gtk.Buildable):
+			continue
+		name = Gtk.Buildable.get_name(obj)
+		# Gtk.Builder makes up names for anonymous objects
+		if not name or name.startswith('___object_'):
+			continue
+		index[name] = obj
+	return index
+	
@@ -0,0 +1,193 @@
+"""
+	Gubbins for measuring the latency of a stream
+	
+	x11grab stamps each frame with the monotonic clock at the time
+	it was grabbed. With -copyts, ffmpeg's showinfo filter reports
+	those timestamps, along with a checksum of each frame, just
+	before the frame is encoded. The stream is written to a pipe
+	rather than the device, and each frame's arrival is timed with
+	the same clock. Frames are matched up by their checksums, so
+	the source should be changing on every frame (eg. a playing
+	video); frames whose checksums aren't unique are ignored.
+"""
+import re
+import time
+import zlib
+import threading
+import subprocess
+
+from x112v4l2 import ffmpeg
+
+
+# How long to measure for
+MEASURE_SECONDS = 10
+
+SHOWINFO_RE = re.compile(r'pts_time:\s*([-\d.]+).*?checksum:([0-9A-Fa-f]+)')
+
+# Bytes per frame for the raw formats we can measure
+FRAME_SIZES = {
+	'yuv420p': lambda width, height: width * height * 3 // 2,
+	'yuyv422': lambda width, height: width * height * 2,
+}
+
+
+def read_frames(pipe, frame_size, arrivals):
+	"""
+		Read raw frames from `pipe`, noting when each one arrived
+		
+		Each (arrival time, checksum) is appended to `arrivals`,
+		until the pipe is closed.
+	"""
+	while True:
+		frame = pipe.read(frame_size)
+		if len(frame) < frame_size:
+			return
+		arrivals.append((time.monotonic(), zlib.adler32(frame, 0)))
+		
+def read_grabs(pipe, grabs):
+	"""
+		Read ffmpeg's log from `pipe`, noting when each frame was grabbed
+		
+		Each (grab time, checksum) reported by showinfo is appended
+		to `grabs`, until the pipe is closed.
+	"""
+	for line in pipe:
+		found = SHOWINFO_RE.search(line.decode('utf8', errors='replace'))
+		if found:
+			grabs.append((float(found.group(1)), int(found.group(2), 16)))
+			
+def match(grabs, arrivals):
+	"""
+		Returns the latency, in seconds, of each frame which can be
+		matched between `grabs` and `arrivals`
+		
+		Both should be iterables of (time, checksum).
+	"""
+	def unique(pairs):
+		times = {}
+		for when, checksum in pairs:
+			times.setdefault(checksum, []).append(when)
+		return {
+			checksum: whens[0]
+			for checksum, whens in times.items()
+			if len(whens) == 1
+		}
+		
+	grabbed = unique(grabs)
+	arrived = unique(arrivals)
+	return sorted(
+		arrived[checksum] - grabbed[checksum]
+		for checksum in grabbed.keys() & arrived.keys()
+	)
+	
+def measure(command_kwargs, seconds=MEASURE_SECONDS):
+	"""
+		Measure the latency of the stream described by `command_kwargs`
+		
+		`command_kwargs` are as for ffmpeg.compile_command(), with
+		a single source; the output is replaced by a pipe.
+		Returns a sorted list of frame latencies, in milliseconds.
+	"""
+	kwargs = dict(command_kwargs)
+	kwargs.pop('regions', None)
+	# Only raw frames can be matched up
+	kwargs.pop('codec', None)
+	pix_fmt = kwargs.setdefault('pix_fmt', 'yuv420p')
+	if pix_fmt not in FRAME_SIZES:
+		raise ValueError('Unable to measure pix_fmt {!r}'.format(pix_fmt))
+	kwargs.update(
+		output_filename='-',
+		output_format='rawvideo',
+		loglevel='info',
+		record_filename=None,
+		# Checksum exactly what gets written
+		extra_filters=['format={}'.format(pix_fmt), 'showinfo'],
+	)
+	cmd = ffmpeg.compile_command(**kwargs)
+	frame_size = FRAME_SIZES[pix_fmt](
+		int(kwargs.get('output_width') or kwargs['source_width']),
+		int(kwargs.get('output_height') or kwargs['source_height']),
+	)
+	
+	proc = subprocess.Popen(
+		['ffmpeg', '-nostdin', '-copyts'] + cmd[1:],
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.PIPE,
+		stderr=subprocess.PIPE,
+	)
+	arrivals = []
+	grabs = []
+	readers = [
+		threading.Thread(target=read_frames, args=(proc.stdout, frame_size, arrivals)),
+		threading.Thread(target=read_grabs, args=(proc.stderr, grabs)),
+	]
+	for reader in readers:
+		reader.start()
+		
+	time.sleep(seconds)
+	proc.terminate()
+	proc.wait()
+	for reader in readers:
+		reader.join()
+	return [latency * 1000 for latency in match(grabs, arrivals)]
+	
+def measure_device(path, width, height, seconds=MEASURE_SECONDS):
+	"""
+		Measure how long frames wait in a loopback device's buffers
+		
+		The device must already be receiving a `width`x`height`
+		stream. The loopback stamps each frame with the monotonic
+		clock as it's written; ffmpeg's default timestamp handling
+		passes those through (-ts abs would convert them to wall
+		clock time), and with -copyts they're matched up with when
+		each frame is read back out, as for measure(). The more
+		buffers the device has, the further a reader can fall
+		behind the writer.
+		Returns a sorted list of frame latencies, in milliseconds.
+	"""
+	pix_fmt = 'yuv420p'
+	proc = subprocess.Popen(
+		[
+			'ffmpeg', '-nostdin', '-loglevel', 'info', '-copyts',
+			'-f', 'v4l2', '-ts', 'default', '-i', path,
+			'-vf', 'format={},showinfo'.format(pix_fmt),
+			'-f', 'rawvideo', '-',
+		],
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.PIPE,
+		stderr=subprocess.PIPE,
+	)
+	arrivals = []
+	grabs = []
+	readers = [
+		threading.Thread(target=read_frames, args=(
+			proc.stdout, FRAME_SIZES[pix_fmt](int(width), int(height)), arrivals,
+		)),
+		threading.Thread(target=read_grabs, args=(proc.stderr, grabs)),
+	]
+	for reader in readers:
+		reader.start()
+		
+	time.sleep(seconds)
+	proc.terminate()
+	proc.wait()
+	for reader in readers:
+		reader.join()
+	return [latency * 1000 for latency in match(grabs, arrivals)]
+	
+def summarise(latencies):
+	"""
+		Returns a dict of statistics of a list of sorted `latencies`
+	"""
+	if not latencies:
+		return {'frames': 0}
+	def percentile(pct):
+		return latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))]
+	return {
+		'frames': len(latencies),
+		'min': latencies[0],
+		'median': percentile(50),
+		'p95': percentile(95),
+		'max': latencies[-1],
+	}
+	
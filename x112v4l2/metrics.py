@@ -0,0 +1,249 @@
+"""
+	Gubbins for exporting metrics in the Prometheus text format
+	
+	Metrics are only rendered when they're asked for, so recording
+	them is just a dictionary update; cheap enough to leave on.
+	
+	The exporters are enabled through environment variables:
+		X112V4L2_METRICS_PORT: serve metrics over HTTP on this
+			port of localhost
+		X112V4L2_METRICS_TEXTFILE: periodically write metrics to
+			this file (eg. for node_exporter's textfile collector)
+"""
+import os
+import logging
+import threading
+import http.server
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_port(value):
+	"""
+		Returns the port to serve metrics on, or None for no port
+		
+		A `value` which isn't a valid port is logged and ignored,
+		so that a typo doesn't stop the application starting.
+	"""
+	if not value:
+		return None
+	try:
+		port = int(value)
+	except ValueError:
+		port = -1
+	if not 0 < port < 65536:
+		logger.warning('Ignoring invalid X112V4L2_METRICS_PORT: %r', value)
+		return None
+	return port
+	
+	
+PREFIX = 'x112v4l2_'
+PORT = get_port(os.environ.get('X112V4L2_METRICS_PORT'))
+TEXTFILE = os.environ.get('X112V4L2_METRICS_TEXTFILE') or None
+# Seconds between writes of the textfile
+TEXTFILE_INTERVAL = 15
+
+GAUGE = 'gauge'
+COUNTER = 'counter'
+SUMMARY = 'summary'
+
+
+class Registry(object):
+	"""
+		A thread-safe collection of metric values
+		
+		Each value is identified by a metric name, plus any number
+		of labels given as keyword arguments. Eg:
+			registry.set('stream_up', 1, device='/dev/video0')
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		# {name: (type, help)}
+		self.descriptions = {}
+		# {name: {labels: value}}, where labels is a sorted tuple of pairs
+		self.values = {}
+		
+	
+	def describe(self, name, metric_type, help_text):
+		"""
+			Declare the type and help text of the `name`d metric
+		"""
+		with self.lock:
+			self.descriptions[name] = (metric_type, help_text)
+			self.values.setdefault(name, {})
+			
+	def set(self, name, value, **labels):
+		"""
+			Set the current value of a gauge
+		"""
+		key = tuple(sorted(labels.items()))
+		with self.lock:
+			self.values.setdefault(name, {})[key] = value
+			
+	def inc(self, name, amount=1, **labels):
+		"""
+			Increase the value of a counter
+		"""
+		key = tuple(sorted(labels.items()))
+		with self.lock:
+			series = self.values.setdefault(name, {})
+			series[key] = series.get(key, 0) + amount
+			
+	def observe(self, name, value, **labels):
+		"""
+			Add an observation (eg. a duration) to a summary
+		"""
+		self.inc(name + '_sum', value, **labels)
+		self.inc(name + '_count', 1, **labels)
+		
+	def remove(self, **labels):
+		"""
+			Forget all values which have all the given `labels`
+		"""
+		labels = set(labels.items())
+		with self.lock:
+			for series in self.values.values():
+				for key in list(series):
+					if labels <= set(key):
+						del series[key]
+						
+	def render(self):
+		"""
+			Returns all the metrics in the Prometheus text format
+		"""
+		lines = []
+		with self.lock:
+			for name in sorted(self.values):
+				description = self.descriptions.get(name)
+				if description is not None:
+					metric_type, help_text = description
+					lines.append('# HELP {}{} {}'.format(PREFIX, name, help_text))
+					lines.append('# TYPE {}{} {}'.format(PREFIX, name, metric_type))
+				for key, value in sorted(self.values[name].items()):
+					lines.append('{prefix}{name}{labels} {value}'.format(
+						prefix=PREFIX,
+						name=name,
+						labels=format_labels(key),
+						value=float(value),
+					))
+		return '\n'.join(lines) + '\n'
+		
+	
+def format_labels(labels):
+	"""
+		Returns a Prometheus label string for the given pairs
+	"""
+	if not labels:
+		return ''
+	return '{' + ','.join(
+		'{}="{}"'.format(
+			key,
+			str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'),
+		)
+		for key, value in labels
+	) + '}'
+	
+
+# The registry used by the application
+REGISTRY = Registry()
+REGISTRY.describe('stream_up', GAUGE, 'Whether the device has a running ffmpeg stream')
+REGISTRY.describe('stream_starts', COUNTER, 'Number of times a stream has been started')
+REGISTRY.describe('stream_retargets', COUNTER, 'Number of times a running stream has been moved onto a new source')
+REGISTRY.describe('stream_fps', GAUGE, 'Frames per second achieved by the stream')
+REGISTRY.describe('stream_configured_fps', GAUGE, 'Frames per second the stream was configured for')
+REGISTRY.describe('stream_cpu_percent', GAUGE, 'CPU usage of the stream process, where 100 is one core')
+REGISTRY.describe('stream_rss_bytes', GAUGE, 'Resident memory of the stream process')
+REGISTRY.describe('thumb_refresh_seconds', SUMMARY, 'Time taken to refresh thumbnails')
+REGISTRY.describe('probe_seconds', SUMMARY, 'Time taken to probe the state of the system')
+REGISTRY.describe('restore_seconds', GAUGE, 'Time from launch until all streams of a restored session were running')
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+	"""
+		Serves the metrics of the server's registry
+	"""
+	def do_GET(self):
+		if self.path not in ['/', '/metrics']:
+			self.send_error(404)
+			return
+		body = self.server.registry.render().encode('utf8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+		
+	def log_message(self, *args):
+		# Don't spam stderr with every scrape
+		pass
+		
+	
+class HTTPExporter(object):
+	"""
+		Serves metrics over HTTP on localhost, from its own thread
+	"""
+	def __init__(self, port, registry=REGISTRY):
+		self.server = http.server.HTTPServer(('127.0.0.1', port), Handler)
+		self.server.registry = registry
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+		
+	
+class TextfileExporter(object):
+	"""
+		Periodically writes metrics to a file, from its own thread
+		
+		The file is replaced atomically, so readers never see a
+		partially-written file.
+	"""
+	def __init__(self, filename, interval=TEXTFILE_INTERVAL, registry=REGISTRY):
+		self.filename = filename
+		self.interval = interval
+		self.registry = registry
+		self.stopping = threading.Event()
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+		
+	def run(self):
+		while True:
+			try:
+				self.write()
+			except OSError:
+				# Keep trying; the problem may well be temporary
+				logger.exception('Unable to write metrics to %s', self.filename)
+			if self.stopping.wait(self.interval):
+				break
+				
+	def write(self):
+		temp_filename = '{}.{}.tmp'.format(self.filename, os.getpid())
+		with open(temp_filename, 'w') as metrics_file:
+			metrics_file.write(self.registry.render())
+		os.replace(temp_filename, self.filename)
+		
+	def stop(self):
+		self.stopping.set()
+		self.thread.join()
+		
+	
+def start(registry=REGISTRY):
+	"""
+		Start whichever exporters have been configured
+		
+		Returns a list of exporters, each of which has a stop() method.
+	"""
+	exporters = []
+	if PORT:
+		try:
+			exporters.append(HTTPExporter(PORT, registry=registry))
+		except OSError:
+			# eg. the port's in use; carry on without
+			logger.exception('Unable to serve metrics on port %s', PORT)
+	if TEXTFILE:
+		exporters.append(TextfileExporter(TEXTFILE, registry=registry))
+	return exporters
+	
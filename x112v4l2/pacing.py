@@ -0,0 +1,257 @@
+"""
+	Gubbins for analysing how evenly a stream's frames are delivered
+	
+	A stream can average the right fps while delivering its frames in
+	bursts, or repeating frames, which looks awful to whoever's
+	watching. This reads frames back from a loopback device (through
+	ffmpeg's showinfo filter, which reports each frame's timestamp and
+	checksum) and reports on the intervals between them.
+	
+	The intervals between all frames show how evenly the stream is
+	delivered. Consecutive frames with the same checksum are counted
+	as duplicates, and the intervals between *different* frames are
+	reported too; but an idle source legitimately repeats itself, so
+	those only mean stutter if the source is known to be changing.
+	
+	From the command line:
+		python3 -m x112v4l2.pacing [--seconds N] DEVICE [DEVICE ...]
+		python3 -m x112v4l2.pacing --raw WIDTHxHEIGHT[:PIX_FMT] FILE
+	where a FILE of "-" reads raw frames from stdin, timing them
+	as they arrive.
+"""
+import re
+import sys
+import math
+import time
+import argparse
+import threading
+import subprocess
+
+from x112v4l2 import latency
+
+
+# How long to analyse for
+ANALYSE_SECONDS = 10
+# Upper bounds (in ms) of the buckets of the interval histograms
+HISTOGRAM_BOUNDS = [5, 10, 20, 30, 40, 50, 70, 100, 200, math.inf]
+PERCENTILES = [50, 90, 95, 99]
+
+
+def read_device(path, seconds=ANALYSE_SECONDS):
+	"""
+		Returns (timestamp, checksum) of each frame read from a device
+		
+		Frames are read for the given number of `seconds`, by an
+		ffmpeg which discards them after noting their details.
+		The device should already be receiving a stream; if not,
+		no frames are returned.
+	"""
+	proc = subprocess.Popen(
+		[
+			'ffmpeg', '-nostdin', '-loglevel', 'info',
+			'-f', 'v4l2', '-i', path,
+			'-vf', 'showinfo',
+			'-f', 'null', '-',
+		],
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.PIPE,
+	)
+	frames = []
+	reader = threading.Thread(target=latency.read_grabs, args=(proc.stderr, frames))
+	reader.start()
+	time.sleep(seconds)
+	proc.terminate()
+	proc.wait()
+	reader.join()
+	return frames
+	
+def read_raw(pipe, width, height, pix_fmt='yuv420p'):
+	"""
+		Returns (arrival time, checksum) of each raw frame in `pipe`
+		
+		Frames are read until the pipe is closed.
+	"""
+	if pix_fmt not in latency.FRAME_SIZES:
+		raise ValueError('Unable to read pix_fmt {!r}'.format(pix_fmt))
+	frames = []
+	latency.read_frames(pipe, latency.FRAME_SIZES[pix_fmt](width, height), frames)
+	return frames
+	
+def get_percentile(values, pct):
+	"""
+		Returns the `pct` percentile of a sorted list of `values`
+	"""
+	return values[min(len(values) - 1, int(len(values) * pct / 100))]
+	
+def get_histogram(intervals, bounds=HISTOGRAM_BOUNDS):
+	"""
+		Returns a list of (upper bound, count) of `intervals` in ms
+	"""
+	counts = [0] * len(bounds)
+	for interval in intervals:
+		for idx, bound in enumerate(bounds):
+			if interval <= bound:
+				counts[idx] += 1
+				break
+	return list(zip(bounds, counts))
+	
+def get_interval_stats(intervals):
+	"""
+		Returns a dict of statistics of a list of `intervals` in ms
+	"""
+	if not intervals:
+		return None
+	mean = sum(intervals) / len(intervals)
+	ordered = sorted(intervals)
+	stats = {
+		'count': len(intervals),
+		'mean': mean,
+		'min': ordered[0],
+		'max': ordered[-1],
+		# Jitter, as the standard deviation of the intervals
+		'jitter': math.sqrt(sum((val - mean) ** 2 for val in intervals) / len(intervals)),
+		'histogram': get_histogram(intervals),
+	}
+	for pct in PERCENTILES:
+		stats['p{}'.format(pct)] = get_percentile(ordered, pct)
+	return stats
+	
+def analyse(frames):
+	"""
+		Returns a dict of the pacing of `frames`
+		
+		`frames` should be a list of (time in seconds, checksum), in
+		the order they were delivered. The dict has:
+			frames: how many frames there were
+			duplicates: how many repeated the frame before
+			fps: the rate of all frames
+			unique_fps: the rate of frames which weren't duplicates
+			intervals: stats of the intervals between all frames
+			unique_intervals: stats of the intervals between
+				frames which differ from the one before
+		Intervals are in milliseconds; see get_interval_stats().
+	"""
+	results = {
+		'frames': len(frames),
+		'duplicates': 0,
+		'fps': 0,
+		'unique_fps': 0,
+		'intervals': None,
+		'unique_intervals': None,
+	}
+	if len(frames) < 2:
+		return results
+		
+	intervals = []
+	unique_intervals = []
+	last_unique = frames[0][0]
+	for (prev_time, prev_checksum), (when, checksum) in zip(frames, frames[1:]):
+		intervals.append((when - prev_time) * 1000)
+		if checksum == prev_checksum:
+			results['duplicates'] += 1
+		else:
+			unique_intervals.append((when - last_unique) * 1000)
+			last_unique = when
+			
+	duration = frames[-1][0] - frames[0][0]
+	if duration > 0:
+		results['fps'] = len(intervals) / duration
+		results['unique_fps'] = len(unique_intervals) / duration
+	results['intervals'] = get_interval_stats(intervals)
+	results['unique_intervals'] = get_interval_stats(unique_intervals)
+	return results
+	
+def analyse_device(path, seconds=ANALYSE_SECONDS):
+	"""
+		Returns the analyse() results of reading from a device
+	"""
+	return analyse(read_device(path, seconds))
+	
+def summarise(results):
+	"""
+		Returns a one-line summary of analyse() `results`
+	"""
+	if not results['intervals']:
+		return 'No frames received; is the stream running?'
+	return (
+		'{fps:.1f} fps; interval p50 {p50:.1f} ms, p99 {p99:.1f} ms, '
+		'max {max:.1f} ms, jitter {jitter:.1f} ms; '
+		'{dup_pct:.0f}% duplicate frames'.format(
+			fps=results['fps'],
+			dup_pct=results['duplicates'] / results['frames'] * 100,
+			**results['intervals']
+		)
+	)
+	
+def format_report(results):
+	"""
+		Returns a multi-line report of analyse() `results`
+	"""
+	lines = [summarise(results)]
+	for name, title in [
+		('intervals', 'All frames'),
+		('unique_intervals', 'Unique frames'),
+	]:
+		stats = results[name]
+		if not stats:
+			continue
+		lines.append('{}: mean {:.1f} ms, {}'.format(
+			title,
+			stats['mean'],
+			', '.join(
+				'p{} {:.1f} ms'.format(pct, stats['p{}'.format(pct)])
+				for pct in PERCENTILES
+			),
+		))
+		widest = max(count for bound, count in stats['histogram']) or 1
+		for bound, count in stats['histogram']:
+			lines.append('  {:>8} {:6d} {}'.format(
+				'<= {:g}'.format(bound) if bound != math.inf else '> {:g}'.format(HISTOGRAM_BOUNDS[-2]),
+				count,
+				'#' * int(count / widest * 40),
+			))
+	return '\n'.join(lines)
+	
+
+def main(args):
+	parser = argparse.ArgumentParser(description='Analyse the frame pacing of v4l2 devices')
+	parser.add_argument('sources', nargs='+', metavar='SOURCE',
+		help='loopback devices, or with --raw, a file of raw frames ("-" for stdin)')
+	parser.add_argument('--seconds', type=float, default=ANALYSE_SECONDS,
+		help='how long to read each device for (default: {})'.format(ANALYSE_SECONDS))
+	parser.add_argument('--raw', metavar='WIDTHxHEIGHT[:PIX_FMT]',
+		help='read raw frames of this size and format, instead of devices')
+	args = parser.parse_args(args)
+	
+	if args.raw:
+		found = re.match(r'(\d+)x(\d+)(?::(\w+))?$', args.raw)
+		if not found:
+			parser.error('--raw should look like 1280x720 or 1280x720:yuyv422')
+		width, height = int(found.group(1)), int(found.group(2))
+		pix_fmt = found.group(3) or 'yuv420p'
+		for source in args.sources:
+			if source == '-':
+				frames = read_raw(sys.stdin.buffer, width, height, pix_fmt)
+			else:
+				with open(source, 'rb') as raw_file:
+					frames = read_raw(raw_file, width, height, pix_fmt)
+			print('{}:\n{}'.format(source, format_report(analyse(frames))))
+		return 0
+		
+	# Read all the devices at once, so they're compared like for like
+	results = {}
+	def run(path):
+		results[path] = analyse_device(path, args.seconds)
+	readers = [threading.Thread(target=run, args=(path,)) for path in args.sources]
+	for reader in readers:
+		reader.start()
+	for reader in readers:
+		reader.join()
+	for path in args.sources:
+		print('{}:\n{}'.format(path, format_report(results[path])))
+	return 0
+	
+if __name__ == '__main__':
+	sys.exit(main(sys.argv[1:]))
+	
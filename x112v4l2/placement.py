@@ -0,0 +1,191 @@
+"""
+	Gubbins for deciding which CPU cores our ffmpeg streams run on
+	
+	Placement works in whole physical cores, so that hyperthread
+	siblings end up with the same stream.
+	The policy is chosen with the X112V4L2_PLACEMENT environment
+	variable, as one of the POLICY_* values below.
+"""
+import os
+import math
+import shutil
+import subprocess
+
+
+# Let the kernel put streams wherever it likes (the default)
+POLICY_NONE = 'none'
+# Give each stream its own share of the cores
+POLICY_SPREAD = 'spread'
+# Squeeze streams onto as few cores as possible
+POLICY_PACK = 'pack'
+# Keep some cores free for the X server, and spread over the rest
+POLICY_RESERVE_X = 'reserve-x'
+POLICIES = [POLICY_NONE, POLICY_SPREAD, POLICY_PACK, POLICY_RESERVE_X]
+
+POLICY = os.environ.get('X112V4L2_PLACEMENT') or POLICY_NONE
+# With POLICY_PACK, this many streams share each core
+STREAMS_PER_CORE = 2
+# With POLICY_RESERVE_X, this many cores are left for X
+RESERVED_CORES = 1
+# Niceness and best-effort IO priority (0-7) given to streams
+# under any policy other than POLICY_NONE
+NICE = 5
+IONICE_LEVEL = 7
+
+TOPOLOGY_PATH = '/sys/devices/system/cpu/cpu{}/topology/thread_siblings_list'
+
+
+def parse_cpu_list(text):
+	"""
+		Turns a kernel CPU list (eg. "0-3,8") into a set of ints
+	"""
+	cpus = set()
+	for part in text.strip().split(','):
+		if not part:
+			continue
+		first, sep, last = part.partition('-')
+		cpus.update(range(int(first), int(last if sep else first) + 1))
+	return cpus
+	
+def format_cpu_list(cpus):
+	"""
+		Turns an iterable of CPU numbers into a kernel-style CPU list
+	"""
+	ranges = []
+	for cpu in sorted(cpus):
+		if ranges and ranges[-1][1] == cpu - 1:
+			ranges[-1][1] = cpu
+		else:
+			ranges.append([cpu, cpu])
+	return ','.join(
+		str(first) if first == last else '{}-{}'.format(first, last)
+		for first, last in ranges
+	)
+	
+def get_cores(cpus=None):
+	"""
+		Returns a list of physical cores, as sorted lists of CPUs
+		
+		Only the given `cpus` (by default, all those we're allowed
+		to run on) are included.
+	"""
+	if cpus is None:
+		cpus = os.sched_getaffinity(0)
+	cpus = set(cpus)
+	cores = []
+	seen = set()
+	for cpu in sorted(cpus):
+		if cpu in seen:
+			continue
+		try:
+			with open(TOPOLOGY_PATH.format(cpu)) as topology_file:
+				siblings = parse_cpu_list(topology_file.read())
+		except (OSError, ValueError):
+			siblings = {cpu}
+		core = sorted(siblings & cpus) or [cpu]
+		seen.update(core)
+		cores.append(core)
+	return cores
+	
+
+def plan(stream_ids, policy=POLICY, cores=None):
+	"""
+		Decide which CPUs each stream should run on
+		
+		`stream_ids` should be an ordered iterable of stream IDs
+		(eg. device paths). Cores are handed out from the highest
+		numbered down, as the lowest tend to get the most interrupts.
+		
+		Returns a dict of {stream_id: set of CPUs}, or None if the
+		policy is POLICY_NONE.
+	"""
+	if policy == POLICY_NONE:
+		return None
+	if policy not in POLICIES:
+		raise ValueError('Unknown placement policy: {!r}'.format(policy))
+	stream_ids = list(stream_ids)
+	if cores is None:
+		cores = get_cores()
+	cores = list(reversed(cores))
+	
+	if policy == POLICY_RESERVE_X and len(cores) > RESERVED_CORES:
+		# The reserved cores are the lowest numbered
+		cores = cores[:-RESERVED_CORES]
+		
+	placements = {}
+	if policy == POLICY_PACK:
+		for idx, stream_id in enumerate(stream_ids):
+			core = cores[(idx // STREAMS_PER_CORE) % len(cores)]
+			placements[stream_id] = set(core)
+			
+	else:
+		# Spread the cores out as evenly as we can
+		for idx, stream_id in enumerate(stream_ids):
+			if len(stream_ids) >= len(cores):
+				share = [cores[idx % len(cores)]]
+			else:
+				per_stream = len(cores) / len(stream_ids)
+				share = cores[math.floor(idx * per_stream):math.floor((idx + 1) * per_stream)]
+			placements[stream_id] = set(cpu for core in share for cpu in core)
+			
+	return placements
+	
+
+def get_command_prefix(cpus, nice=NICE, ionice_level=IONICE_LEVEL):
+	"""
+		Returns a command prefix which runs a command already placed
+		
+		Placing the command before it starts means every thread it
+		goes on to start inherits the placement.
+		Any of taskset, nice and ionice which isn't installed is
+		left out.
+	"""
+	prefix = []
+	for args in [
+		['taskset', '-c', format_cpu_list(cpus)],
+		['nice', '-n', str(nice)],
+		['ionice', '-c', '2', '-n', str(ionice_level)],
+	]:
+		if shutil.which(args[0]):
+			prefix += args
+	return prefix
+	
+def get_threads(pid):
+	"""
+		Returns the IDs of all the threads of process `pid`
+	"""
+	try:
+		return [int(tid) for tid in os.listdir('/proc/{}/task'.format(pid))]
+	except FileNotFoundError:
+		return []
+		
+def apply(pid, cpus, nice=NICE, ionice_level=IONICE_LEVEL):
+	"""
+		(Re-)Place all threads of an already-running process
+	"""
+	threads = get_threads(pid)
+	for tid in threads:
+		try:
+			os.sched_setaffinity(tid, cpus)
+			os.setpriority(os.PRIO_PROCESS, tid, nice)
+		except (ProcessLookupError, PermissionError):
+			# Thread ended, or we're not allowed to make it nicer
+			pass
+	set_ionice(threads, ionice_level)
+	
+def set_ionice(pids, level=IONICE_LEVEL):
+	"""
+		Put the given processes/threads in the best-effort IO class
+	"""
+	if not pids:
+		return
+	try:
+		subprocess.run(
+			['ionice', '-c', '2', '-n', str(level), '-p'] + [str(pid) for pid in pids],
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.DEVNULL,
+		)
+	except FileNotFoundError:
+		# No ionice installed; never mind
+		pass
+		
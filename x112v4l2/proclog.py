@@ -0,0 +1,152 @@
+"""
+	Bounded storage for the output of our subprocesses
+"""
+import os
+import collections
+import logging
+import logging.handlers
+
+
+# How much output to keep in memory for each stream
+MAX_LINES = 1000
+MAX_BYTES = 256 * 1024
+# If set, the full output is also written to rotating files in here
+SPOOL_PATH = os.environ.get('X112V4L2_LOG_DIR') or None
+SPOOL_MAX_BYTES = 10 * 1024 * 1024
+SPOOL_BACKUPS = 3
+
+
+class RingLog(object):
+	"""
+		Keeps the most recent lines of a process's output
+		
+		Once more than `max_lines` lines, or `max_bytes` bytes (of
+		UTF-8), have been appended, the oldest lines are discarded.
+		
+		A carriage return rewinds to the start of the current line,
+		as it would in a terminal, so ffmpeg's progress updates don't
+		push everything else out of the buffer.
+		
+		If a `spool_filename` is given, everything appended is also
+		written to that file, which is rotated as it grows.
+	"""
+	def __init__(
+		self,
+		max_lines=MAX_LINES,
+		max_bytes=MAX_BYTES,
+		spool_filename=None,
+	):
+		self.max_lines = max_lines
+		self.max_bytes = max_bytes
+		self.lines = collections.deque()
+		self.size = 0
+		# Text after the last newline
+		self.partial = ''
+		# Whether anything has changed since the last get_text()
+		self.dirty = False
+		# Lines completed since the last take_changes()
+		self.pending = []
+		# Whether the changes since then are best shown from scratch
+		self.reset = True
+		
+		self.spool = None
+		if spool_filename:
+			os.makedirs(os.path.dirname(spool_filename), exist_ok=True)
+			self.spool = logging.handlers.RotatingFileHandler(
+				spool_filename,
+				maxBytes=SPOOL_MAX_BYTES,
+				backupCount=SPOOL_BACKUPS,
+				encoding='utf8',
+			)
+			self.spool.terminator = ''
+			
+		
+	def append(self, text):
+		"""
+			Add some `text` to the end of the log
+		"""
+		if not text:
+			return
+		self.dirty = True
+		if self.spool:
+			self.spool.emit(logging.makeLogRecord({'msg': text}))
+			
+		chunks = (self.partial + text).split('\n')
+		self.partial = chunks.pop().rsplit('\r', 1)[-1]
+		for line in chunks:
+			line = line.rsplit('\r', 1)[-1] + '\n'
+			self.lines.append(line)
+			self.size += len(line.encode('utf8'))
+			if not self.reset:
+				self.pending.append(line)
+		if len(self.pending) > self.max_lines:
+			# More has come in than is kept
+			self.reset = True
+			self.pending = []
+			
+		# Trim from the start
+		while self.lines and (
+			len(self.lines) > self.max_lines
+			or self.size > self.max_bytes
+		):
+			self.size -= len(self.lines.popleft().encode('utf8'))
+			
+	def get_text(self):
+		"""
+			Returns the retained output as a single string
+		"""
+		self.dirty = False
+		self.pending = []
+		self.reset = False
+		return ''.join(self.lines) + self.partial
+		
+	def take_changes(self):
+		"""
+			Returns what's changed since the last call, or get_text()
+			
+			The return value is (reset, text). If `reset` is true,
+			the `text` is the whole of the retained output. Otherwise
+			the current partial line should be replaced with the
+			`text` (new whole lines, then the new partial line), and
+			all but the last len(lines) whole lines dropped.
+		"""
+		if self.reset:
+			return (True, self.get_text())
+		text = ''.join(self.pending) + self.partial
+		self.dirty = False
+		self.pending = []
+		return (False, text)
+		
+	def clear(self):
+		"""
+			Forget all retained output
+		"""
+		self.lines.clear()
+		self.size = 0
+		self.partial = ''
+		self.dirty = True
+		self.pending = []
+		self.reset = True
+		
+	def close(self):
+		"""
+			Stop spooling to file
+		"""
+		if self.spool:
+			self.spool.close()
+			self.spool = None
+			
+		
+def get_spool_filename(device_path, name):
+	"""
+		Returns where to spool `name`d output for the given device
+		
+		Returns None if spooling isn't enabled.
+	"""
+	if not SPOOL_PATH:
+		return None
+	return os.path.join(
+		SPOOL_PATH,
+		'{dev}.{name}.log'.format(dev=os.path.basename(device_path), name=name),
+	)
+	
@@ -0,0 +1,177 @@
+"""
+	Gubbins for reading process statistics out of /proc
+"""
+import os
+import time
+import collections
+
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+# How many samples of history to keep
+HISTORY_LENGTH = 60
+
+
+Sample = collections.namedtuple('Sample', [
+	'time',
+	# Seconds of CPU time used (user + system)
+	'cpu_time',
+	'rss',
+	'threads',
+	'voluntary_switches',
+	'involuntary_switches',
+	# Nanoseconds spent on a CPU, and waiting for one
+	'run_time',
+	'wait_time',
+])
+
+
+def read_stat(pid):
+	"""
+		Returns a list of the fields of /proc/<pid>/stat
+		
+		The fields are numbered as in proc(5), so the first field
+		(the pid) is at index 1.
+	"""
+	with open('/proc/{}/stat'.format(pid), 'rb') as stat_file:
+		stat = stat_file.read().decode('utf8', errors='replace')
+	# The command name can contain spaces and brackets,
+	# but is always the thing in the outermost brackets
+	before, command = stat.split(' (', 1)
+	command, after = command.rsplit(') ', 1)
+	return [None, before, command] + after.split()
+	
+def read_status(pid):
+	"""
+		Returns a dict of the values in /proc/<pid>/status
+	"""
+	status = {}
+	with open('/proc/{}/status'.format(pid), 'rb') as status_file:
+		for line in status_file:
+			key, sep, value = line.decode('utf8', errors='replace').partition(':')
+			if sep:
+				status[key] = value.strip()
+	return status
+	
+def read_schedstat(pid):
+	"""
+		Returns a 3-tuple of the values in /proc/<pid>/schedstat
+		
+		These are nanoseconds spent running, nanoseconds spent
+		waiting to run, and number of timeslices run.
+		If the kernel doesn't provide schedstats, returns zeroes.
+	"""
+	try:
+		with open('/proc/{}/schedstat'.format(pid), 'rb') as schedstat_file:
+			return tuple(int(val) for val in schedstat_file.read().split()[:3])
+	except (FileNotFoundError, ValueError):
+		return (0, 0, 0)
+		
+def sample(pid):
+	"""
+		Take a Sample of the given process's resource usage
+		
+		Returns None if there is no such process.
+	"""
+	try:
+		stat = read_stat(pid)
+		status = read_status(pid)
+	except (FileNotFoundError, ProcessLookupError):
+		return None
+	run_time, wait_time, slices = read_schedstat(pid)
+	
+	return Sample(
+		time=time.monotonic(),
+		cpu_time=(int(stat[14]) + int(stat[15])) / CLOCK_TICKS,
+		rss=int(stat[24]) * PAGE_SIZE,
+		threads=int(stat[20]),
+		voluntary_switches=int(status.get('voluntary_ctxt_switches', 0)),
+		involuntary_switches=int(status.get('nonvoluntary_ctxt_switches', 0)),
+		run_time=run_time,
+		wait_time=wait_time,
+	)
+	
+
+class ProcessMonitor(object):
+	"""
+		Keeps a short rolling history of a process's resource usage
+		
+		Call update() periodically to take a new sample.
+		Each entry in the `history` is a dict of:
+			cpu_percent: CPU usage since the previous sample,
+				where 100 is one whole core
+			rss: resident memory, in bytes
+			threads: number of threads
+			voluntary_switches, involuntary_switches:
+				context switches per second since the previous sample
+			wait_percent: percentage of time spent runnable, but
+				waiting for a CPU
+	"""
+	def __init__(self, pid, history_length=HISTORY_LENGTH):
+		self.pid = pid
+		self.history = collections.deque(maxlen=history_length)
+		self.last_sample = sample(pid)
+		
+	
+	def update(self):
+		"""
+			Take a new sample, and return the derived stats
+			
+			Returns None if the process has gone away.
+		"""
+		new = sample(self.pid)
+		old = self.last_sample
+		if new is None or old is None:
+			self.last_sample = new
+			return None
+			
+		elapsed = new.time - old.time
+		if elapsed <= 0:
+			return self.latest
+			
+		self.last_sample = new
+		stats = {
+			'cpu_percent': (new.cpu_time - old.cpu_time) / elapsed * 100,
+			'rss': new.rss,
+			'threads': new.threads,
+			'voluntary_switches':
+				(new.voluntary_switches - old.voluntary_switches) / elapsed,
+			'involuntary_switches':
+				(new.involuntary_switches - old.involuntary_switches) / elapsed,
+			'wait_percent': (new.wait_time - old.wait_time) / 1e9 / elapsed * 100,
+		}
+		self.history.append(stats)
+		return stats
+		
+	@property
+	def latest(self):
+		"""
+			The most recent stats, or None if there aren't any yet
+		"""
+		return self.history[-1] if self.history else None
+		
+	def get_peak(self, key):
+		"""
+			Returns the highest value of `key` in the history
+		"""
+		return max((stats[key] for stats in self.history), default=0)
+		
+	def get_mean(self, key):
+		"""
+			Returns the average value of `key` over the history
+		"""
+		if not self.history:
+			return 0
+		return sum(stats[key] for stats in self.history) / len(self.history)
+		
+	
+def format_bytes(num):
+	"""
+		Returns a human-friendly string for a number of bytes
+	"""
+	for unit in ['B', 'KiB', 'MiB']:
+		if num < 1024:
+			return '{:.0f} {}'.format(num, unit)
+		num /= 1024
+	return '{:.1f} GiB'.format(num)
+	
@@ -0,0 +1,56 @@
+"""
+	Gubbins for saving the state of a session, and restoring it later
+	
+	A snapshot is a JSON-able dict of:
+		saved: when the snapshot was taken (seconds since the epoch)
+		probes: the last results of probing the system, by name
+			(see MainUI.PROBES)
+		devices: a list of device snapshots (see DeviceUI.get_snapshot)
+		
+	Restoring is enabled with the X112V4L2_RESTORE environment variable.
+"""
+import os
+import json
+import time
+
+from x112v4l2 import config
+
+
+SESSION_FILENAME = os.path.join(
+	os.path.dirname(config.CONFIG_FILENAME),
+	'session.json',
+)
+RESTORE = bool(os.environ.get('X112V4L2_RESTORE'))
+# Bump this when snapshots change incompatibly
+VERSION = 1
+
+
+def save(probes, devices, filename=SESSION_FILENAME):
+	"""
+		Write a snapshot of the given `probes` and `devices`
+	"""
+	snapshot = {
+		'version': VERSION,
+		'saved': time.time(),
+		'probes': probes,
+		'devices': devices,
+	}
+	os.makedirs(os.path.dirname(filename), exist_ok=True)
+	temp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+	with open(temp_filename, 'w') as session_file:
+		json.dump(snapshot, session_file, indent='\t', sort_keys=True)
+	os.replace(temp_filename, filename)
+	
+def load(filename=SESSION_FILENAME):
+	"""
+		Returns the saved snapshot, or None if there isn't a usable one
+	"""
+	try:
+		with open(filename) as session_file:
+			snapshot = json.load(session_file)
+	except (OSError, ValueError):
+		return None
+	if not isinstance(snapshot, dict) or snapshot.get('version') != VERSION:
+		return None
+	return snapshot
+	
@@ -6,7 +6,6 @@ import time
 import tempfile
 import shutil
 
-from x112v4l2 import x11
 from x112v4l2 import ffmpeg
 
 
@@ -14,6 +13,24 @@ THUMB_WIDTH = 160
 THUMB_HEIGHT = 90
 CACHE_PATH = os.path.join(tempfile.gettempdir(), 'x112v4l2', 'thumbs')
 
+# Live refreshing is limited to spending this fraction of wall time
+# creating thumbnails (and checking windows for changes)
+REFRESH_BUDGET = 0.05
+# Never wait longer than this many seconds between refreshes...
+REFRESH_MAX_DELAY = 30
+# ...or less than this many
+REFRESH_MIN_DELAY = 1
+# Each running stream stretches the delay by this factor
+REFRESH_STREAM_BACKOFF = 1.0
+# How many windows to check for title/geometry changes per refresh
+REFRESH_STATE_CHECKS = 8
+
+# Bounds on how many thumbnails are made at once
+MIN_PARALLEL = 1
+MAX_PARALLEL = 8
+# Milliseconds between checks on running thumbnail jobs
+JOBS_INTERVAL = 100
+
 
 def mkdir():
 	""" Create the directory in which we store thumbnails """
@@ -29,43 +46,267 @@ def get_win_filename(window):
 		Return the base filename to be used for the given `window`
 	"""
 	return '{scr}.{win}.png'.format(
-		scr=window.screen['full_id'],
+		scr=window.screen_id,
 		win=window.id,
 	)
 
-def create_all(parallel=4):
+def create(window):
+	"""
+		Start creating a thumbnail for a single x11.WindowInfo `window`
+		
+		Returns a 2-tuple of (filename, subprocess.Popen instance).
+	"""
+	filename = os.path.join(CACHE_PATH, get_win_filename(window))
+	proc = ffmpeg.capture_window(
+		window=window,
+		filename=filename,
+		max_width=THUMB_WIDTH,
+		max_height=THUMB_HEIGHT,
+	)
+	return (filename, proc)
+	
+def get_parallel(stream_cpu_percent=0, cores=None):
+	"""
+		Returns how many thumbnails should be made at once
+		
+		One per core which isn't busy with streams (going by their
+		total `stream_cpu_percent`, where 100 is one core), within
+		the bounds of MIN_PARALLEL and MAX_PARALLEL.
+	"""
+	if cores is None:
+		cores = os.cpu_count() or 1
+	spare = int(cores - stream_cpu_percent / 100)
+	return max(MIN_PARALLEL, min(MAX_PARALLEL, spare))
+	
+def get_priority(window, visible_ids=(), active_ids=()):
+	"""
+		Returns a sort key putting the most wanted thumbnails first
+		
+		Windows whose thumbnails are on-screen come first, then any
+		which have the focus, then the rest from largest to smallest.
+	"""
+	return (
+		window.id not in visible_ids,
+		window.id not in active_ids,
+		-window.width * window.height,
+	)
+	
+def create_all(windows, parallel=None):
 	"""
-		Create thumbnails for all (interesting) X11 windows
+		Create thumbnails for all the given x11.WindowInfo `windows`
 		
 		The `parallel` parameter determines how many simultaneous
-		processes will be started to create the thumbnails
+		processes will be started to create the thumbnails; by
+		default, one per core.
 		
 		Returns a dict of {win_id: filename}
 	"""
-	windows = list(x11.get_windows())
-	procs = {}
-	thumbs = {}
-	while windows or procs:
-		while windows and len(procs) < parallel:
-			# Start a new process
-			window = windows.pop()
-			win_id = get_win_filename(window)
-			filename = os.path.join(CACHE_PATH, win_id)
-			procs[win_id] = ffmpeg.capture_window(
-				window=window,
-				filename=filename,
-				max_width=THUMB_WIDTH,
-				max_height=THUMB_HEIGHT,
-			)
-			thumbs[win_id] = filename
+	jobs = ThumbJobs()
+	jobs.start(windows)
+	while not jobs.is_done():
+		jobs.poll(parallel or get_parallel())
+		time.sleep(JOBS_INTERVAL / 1000)
+	return jobs.results
+	
+
+class ThumbJobs(object):
+	"""
+		Makes a batch of thumbnails, the most wanted first
+		
+		Nothing happens in the background: poll() should be called
+		regularly (eg. every JOBS_INTERVAL ms) to reap finished
+		ffmpeg processes and start more. Starting a new batch cancels
+		whatever's left of the old one.
+	"""
+	def __init__(self):
+		# Windows yet to be started, the most wanted first
+		self.pending = []
+		# {win.id: (window, ffmpeg process)}
+		self.running = {}
+		# {win_id: filename} of the current batch, as create_all()
+		self.results = {}
+		# IDs of the windows with the focus
+		self.active_ids = set()
 		
-		# Check for finished processes
-		for win_id, proc in procs.copy().items():
-			if proc.poll() is not None:
-				procs.pop(win_id)
+	
+	def start(self, windows, visible_ids=(), active_ids=()):
+		"""
+			Start a new batch of thumbnails of x11.WindowInfo `windows`
 			
-		# Wait a bit
-		time.sleep(0.4)
+			See get_priority() for the meanings of `visible_ids` and
+			`active_ids`.
+		"""
+		self.cancel()
+		self.active_ids = set(active_ids)
+		self.pending = list(windows)
+		self.prioritise(visible_ids)
+		
+	def prioritise(self, visible_ids):
+		"""
+			Move the windows with the given `visible_ids` to the front
+		"""
+		visible_ids = set(visible_ids)
+		self.pending.sort(
+			key=lambda window: get_priority(window, visible_ids, self.active_ids),
+		)
+		
+	def cancel(self):
+		"""
+			Abandon the rest of the current batch
+		"""
+		self.pending = []
+		self.results = {}
+		for window, proc in self.running.values():
+			if proc.poll() is None:
+				proc.kill()
+				proc.wait()
+		self.running = {}
+		
+	def poll(self, parallel):
+		"""
+			Reap finished processes, and start up to `parallel` more
+			
+			Returns a list of the windows whose thumbnails were
+			successfully made since the last poll.
+		"""
+		finished = []
+		for win_id, (window, proc) in list(self.running.items()):
+			if proc.poll() is None:
+				continue
+			del self.running[win_id]
+			if not proc.returncode:
+				finished.append(window)
+				
+		while self.pending and len(self.running) < parallel:
+			window = self.pending.pop(0)
+			filename, proc = create(window)
+			self.results[get_win_filename(window)] = filename
+			self.running[window.id] = (window, proc)
+			
+		return finished
+		
+	def is_done(self):
+		"""
+			Whether the whole batch has finished (or been cancelled)
+		"""
+		return not self.pending and not self.running
+		
+	
+
+class RefreshScheduler(object):
+	"""
+		Decides which window thumbnail to refresh next, and when
+		
+		Windows which have changed since their thumbnail was last
+		made are refreshed first, followed by those which are
+		currently visible in the UI, and then the stalest of the rest.
+		
+		The delay between refreshes is chosen so that the time spent
+		refreshing stays within the `budget` fraction of wall time,
+		and is stretched further for every running stream.
+	"""
+	def __init__(
+		self,
+		budget=REFRESH_BUDGET,
+		min_delay=REFRESH_MIN_DELAY,
+		max_delay=REFRESH_MAX_DELAY,
+		stream_backoff=REFRESH_STREAM_BACKOFF,
+		state_checks=REFRESH_STATE_CHECKS,
+	):
+		self.budget = budget
+		self.min_delay = min_delay
+		self.max_delay = max_delay
+		self.stream_backoff = stream_backoff
+		self.state_checks = state_checks
+		# {win.id: time.monotonic() of the last refresh}
+		self.refreshed = {}
+		# {win.id: (title, geometry) at the last refresh/check}
+		self.states = {}
+		# Window IDs known to have changed since their last refresh
+		self.changed = set()
+		# Where we're up to in checking windows for changes
+		self.check_cursor = 0
 		
-	return thumbs
 	
+	def forget_missing(self, windows):
+		"""
+			Drop any records of windows not in the `windows` iterable
+		"""
+		win_ids = set(win.id for win in windows)
+		for records in [self.refreshed, self.states]:
+			for win_id in list(records):
+				if win_id not in win_ids:
+					del records[win_id]
+		self.changed &= win_ids
+		
+	def get_state(self, window):
+		"""
+			Returns a comparable snapshot of the `window`s appearance
+		"""
+		return (window.title, window.x, window.y, window.width, window.height)
+		
+	def get_checks(self, windows):
+		"""
+			Returns the next few of the `windows` to check for changes
+			
+			Only `state_checks` windows are returned per call, so as to
+			keep the X round-trips down; successive calls work their
+			way through the whole list.
+		"""
+		if not windows:
+			return []
+		checks = [
+			windows[(self.check_cursor + idx) % len(windows)]
+			for idx in range(min(self.state_checks, len(windows)))
+		]
+		self.check_cursor = (self.check_cursor + self.state_checks) % len(windows)
+		return checks
+		
+	def check_states(self, windows):
+		"""
+			Note any changes in freshly-read `windows`
+		"""
+		for window in windows:
+			state = self.get_state(window)
+			previous = self.states.get(window.id)
+			if previous is not None and previous != state:
+				self.changed.add(window.id)
+			self.states[window.id] = state
+		
+	def choose(self, windows, visible_ids=()):
+		"""
+			Returns the window whose thumbnail most needs refreshing
+			
+			`visible_ids` should be the IDs of windows whose thumbnails
+			can currently be seen by the user.
+			Returns None if there are no `windows`.
+		"""
+		if not windows:
+			return None
+		visible_ids = set(visible_ids)
+		def priority(window):
+			return (
+				window.id not in self.changed,
+				window.id not in visible_ids,
+				self.refreshed.get(window.id, 0),
+			)
+		return min(windows, key=priority)
+		
+	def record(self, window):
+		"""
+			Note that the `window`s thumbnail was just refreshed
+		"""
+		self.refreshed[window.id] = time.monotonic()
+		self.changed.discard(window.id)
+		
+	def get_delay(self, duration, running_streams=0):
+		"""
+			Returns the number of seconds to wait before the next refresh
+			
+			`duration` is how long the previous refresh took, and
+			`running_streams` how many ffmpeg streams are running.
+		"""
+		delay = duration / self.budget - duration
+		delay *= 1 + self.stream_backoff * running_streams
+		return max(self.min_delay, min(self.max_delay, delay))
+		
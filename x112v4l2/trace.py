@@ -0,0 +1,222 @@
+"""
+	Gubbins for tracing where the time goes, as timed spans
+	
+	Spans are recorded in memory, and written out on exit in the
+	Chrome trace event format, which can be opened in Perfetto
+	(https://ui.perfetto.dev) or chrome://tracing.
+	
+	Tracing is off unless the X112V4L2_TRACE environment variable
+	(or the --trace option) names a file to write the trace to.
+	While it's off, spans cost one attribute check.
+"""
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+
+
+FILENAME = os.environ.get('X112V4L2_TRACE') or None
+
+
+def get_timestamp():
+	"""
+		Returns the current time in microseconds, as traces want
+	"""
+	return time.perf_counter() * 1000000
+	
+
+class NullSpan(object):
+	"""
+		A span which records nothing, for when tracing is off
+	"""
+	def __enter__(self):
+		return self
+		
+	def __exit__(self, *exc_info):
+		return False
+		
+	
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+	"""
+		A timed section of code on the current thread
+	"""
+	def __init__(self, tracer, name, category, args):
+		self.tracer = tracer
+		self.name = name
+		self.category = category
+		self.args = args
+		self.start = None
+		
+	def __enter__(self):
+		self.start = get_timestamp()
+		return self
+		
+	def __exit__(self, *exc_info):
+		end = get_timestamp()
+		if exc_info[0] is not None:
+			self.args['error'] = exc_info[0].__name__
+		self.tracer.add_complete(self.name, self.category, self.start, end, self.args)
+		return False
+		
+	
+class Tracer(object):
+	"""
+		A thread-safe recorder of trace events
+	"""
+	def __init__(self):
+		self.enabled = False
+		self.lock = threading.Lock()
+		self.events = []
+		# {thread id: thread name}
+		self.threads = {}
+		self.next_id = 0
+		
+	
+	def enable(self):
+		self.enabled = True
+		
+	def span(self, name, category='app', **args):
+		"""
+			Returns a context manager which times its body
+			
+			Eg:
+				with tracer.span('load glade', filename=filename):
+					builder.add_from_file(filename)
+		"""
+		if not self.enabled:
+			return NULL_SPAN
+		return Span(self, name, category, args)
+		
+	def add_complete(self, name, category, start, end, args=None):
+		"""
+			Record a span of the current thread, from `start` to `end`
+		"""
+		thread = threading.current_thread()
+		event = {
+			'ph': 'X',
+			'name': name,
+			'cat': category,
+			'ts': start,
+			'dur': end - start,
+			'pid': os.getpid(),
+			'tid': thread.ident,
+		}
+		if args:
+			event['args'] = args
+		with self.lock:
+			self.threads[thread.ident] = thread.name
+			self.events.append(event)
+			
+	def begin_async(self, name, category='async', **args):
+		"""
+			Start a span which may end on another thread
+			
+			Returns an ID to pass to end_async(), or None if tracing
+			is off.
+		"""
+		if not self.enabled:
+			return None
+		with self.lock:
+			span_id = self.next_id
+			self.next_id += 1
+			self.events.append({
+				'ph': 'b',
+				'name': name,
+				'cat': category,
+				'id': span_id,
+				'ts': get_timestamp(),
+				'pid': os.getpid(),
+				'tid': threading.get_ident(),
+				'args': args,
+			})
+		return span_id
+		
+	def end_async(self, span_id, name, category='async'):
+		"""
+			End a span started by begin_async()
+		"""
+		if span_id is None:
+			return
+		event = {
+			'ph': 'e',
+			'name': name,
+			'cat': category,
+			'id': span_id,
+			'ts': get_timestamp(),
+			'pid': os.getpid(),
+			'tid': threading.get_ident(),
+		}
+		with self.lock:
+			self.events.append(event)
+			
+	def get_trace(self):
+		"""
+			Returns the recorded events, as a Chrome trace dict
+		"""
+		with self.lock:
+			events = list(self.events)
+			threads = dict(self.threads)
+		pid = os.getpid()
+		metadata = [
+			{
+				'ph': 'M',
+				'name': 'thread_name',
+				'pid': pid,
+				'tid': tid,
+				'args': {'name': name},
+			}
+			for tid, name in threads.items()
+		]
+		return {
+			'traceEvents': metadata + events,
+			'displayTimeUnit': 'ms',
+		}
+		
+	def dump(self, filename):
+		"""
+			Write the trace to `filename`
+		"""
+		with open(filename, 'w') as trace_file:
+			json.dump(self.get_trace(), trace_file)
+			
+		
+TRACER = Tracer()
+
+
+def traced(name=None, category='app'):
+	"""
+		Decorator to time every call of a function as a span
+		
+		The span is named after the function, unless a `name` is
+		given.
+	"""
+	def decorator(func):
+		span_name = name or func.__qualname__
+		
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			if not TRACER.enabled:
+				return func(*args, **kwargs)
+			with Span(TRACER, span_name, category, {}):
+				return func(*args, **kwargs)
+				
+		return wrapper
+		
+	return decorator
+	
+def start(filename=FILENAME):
+	"""
+		Start tracing, if there's a `filename` to write the trace to
+		
+		The trace is written when the program exits.
+	"""
+	if not filename:
+		return
+	TRACER.enable()
+	atexit.register(TRACER.dump, filename)
+	
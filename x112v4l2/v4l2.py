@@ -2,10 +2,38 @@
 	Gubbins for interfacing with the v4l2 side of things
 """
 import os
+import re
+import mmap
 import subprocess
 
 
 DEFAULT_LABEL = 'Virtual camera'
+# Where the loaded module's parameters can be read
+MODULE_PARAMS_PATH = '/sys/module/v4l2loopback/parameters'
+# The module's own defaults, for when it isn't loaded
+MODULE_DEFAULTS = {
+	'max_buffers': 2,
+	'max_width': 8192,
+	'max_height': 8192,
+}
+MIN_BUFFERS = 2
+MAX_BUFFERS = 32
+# Per-device settings, as they're written after a device's label
+DEVICE_PARAMS = ['buffers', 'max_width', 'max_height', 'video_nr']
+# Per-device settings which the module only has one of, and its name for them
+SHARED_PARAMS = [
+	('buffers', 'max_buffers'),
+	('max_width', 'max_width'),
+	('max_height', 'max_height'),
+]
+# The most bytes per pixel of any format the module supports
+MAX_BYTES_PER_PIXEL = 4
+# Bytes per pixel of the raw formats we stream; compressed frames
+# get room for the worst case
+BYTES_PER_PIXEL = {
+	'yuv420p': 1.5,
+	'yuyv422': 2,
+}
 
 
 def get_module_available():
@@ -38,6 +66,7 @@ def get_devices():
 		Each item is a dictionary of: {
 			'path': '/path/to/dev/video#',
 			'label': 'The user-defined label for the device',
+			'video_nr': the # of the path,
 		}
 	"""
 	proc = subprocess.Popen(
@@ -53,12 +82,160 @@ def get_devices():
 		info['label'] = line.decode('utf8').rsplit(' ', 1)[0]
 		next_line = proc.stdout.readline()
 		info['path'] = next_line.decode('utf8').strip()
+		found = re.search(r'(\d+)$', info['path'])
+		info['video_nr'] = int(found.group(1)) if found else None
 		devices.append(info)
 		
 	return devices
 	
 
-def configure_devices(labels=None):
+def get_module_params(path=MODULE_PARAMS_PATH):
+	"""
+		Returns a dict of the loaded module's buffer and size params
+		
+		The keys are as MODULE_DEFAULTS, whose values are used for
+		any which can't be read (eg. if the module isn't loaded).
+	"""
+	params = dict(MODULE_DEFAULTS)
+	for name in params:
+		try:
+			with open(os.path.join(path, name)) as param_file:
+				params[name] = int(param_file.read().strip())
+		except (OSError, ValueError):
+			pass
+	return params
+	
+def parse_device_line(line):
+	"""
+		Returns (label, params) of a line describing a device
+		
+		Lines look like:
+			Desktop | buffers=4 max_width=1920 max_height=1080 video_nr=10
+		where everything from the "|" on is optional, as is each
+		of the params (see DEVICE_PARAMS). Raises ValueError if
+		the params don't make sense.
+	"""
+	label, _, param_text = line.partition('|')
+	label = label.strip()
+	if not label:
+		raise ValueError('Devices need a label: {!r}'.format(line))
+	if ',' in label:
+		raise ValueError('Device labels can\'t contain commas: {!r}'.format(label))
+	params = {}
+	for item in param_text.split():
+		name, _, value = item.partition('=')
+		if name not in DEVICE_PARAMS:
+			raise ValueError('Unknown device param: {!r}'.format(name))
+		try:
+			params[name] = int(value)
+		except ValueError:
+			raise ValueError('{} should be a whole number, not {!r}'.format(name, value))
+		if params[name] < 0:
+			raise ValueError('{} can\'t be negative'.format(name))
+	if 'buffers' in params and not MIN_BUFFERS <= params['buffers'] <= MAX_BUFFERS:
+		raise ValueError('buffers should be from {} to {}'.format(MIN_BUFFERS, MAX_BUFFERS))
+	for name in ['max_width', 'max_height']:
+		if params.get(name) == 0:
+			raise ValueError('{} can\'t be zero'.format(name))
+	return (label, params)
+	
+def parse_device_lines(text):
+	"""
+		Returns a list of (label, params) of each line of `text`
+		
+		Blank lines are skipped; see parse_device_line() for the
+		rest. Raises ValueError if any line doesn't make sense, or
+		devices share a video_nr.
+	"""
+	devices = [parse_device_line(line) for line in text.split('\n') if line.strip()]
+	check_video_nrs([params for label, params in devices])
+	return devices
+	
+def check_video_nrs(params):
+	"""
+		Raises ValueError if devices' `params` share a video_nr
+	"""
+	fixed = [device['video_nr'] for device in params if device.get('video_nr') is not None]
+	if len(set(fixed)) < len(fixed):
+		raise ValueError('Devices can\'t share a video_nr')
+		
+def format_device_line(label, params):
+	"""
+		Returns a line describing a device, as parse_device_line() reads
+	"""
+	items = [
+		'{}={}'.format(name, params[name])
+		for name in DEVICE_PARAMS
+		if params.get(name) is not None
+	]
+	if not items:
+		return label
+	return '{} | {}'.format(label, ' '.join(items))
+	
+def get_module_args(labels, params=None):
+	"""
+		Returns the modprobe arguments for devices with the given
+		`labels` and per-device `params`
+		
+		`params`, if given, should be a list of dicts of
+		DEVICE_PARAMS, one for each label. The module only has one
+		buffer count and maximum size for all its devices, so each
+		of those is the largest asked of any device.
+	"""
+	params = params or [{} for label in labels]
+	args = [
+		'exclusive_caps=1',
+		'devices={}'.format(len(labels)),
+		'card_label={}'.format(','.join(labels)),
+	]
+	check_video_nrs(params)
+	video_nrs = [device.get('video_nr') for device in params]
+	if any(nr is not None for nr in video_nrs):
+		args.append('video_nr={}'.format(','.join(
+			str(nr) if nr is not None else '-1'
+			for nr in video_nrs
+		)))
+	args.extend(
+		'{}={}'.format(name, value)
+		for name, value in sorted(get_shared_params(params).items())
+	)
+	return args
+	
+def get_shared_params(params):
+	"""
+		Returns the module params for devices' per-device `params`
+		
+		Only the module params which any device asks for are
+		included; each is the largest value asked for.
+	"""
+	shared = {}
+	for name, module_name in SHARED_PARAMS:
+		values = [device[name] for device in params if device.get(name)]
+		if values:
+			shared[module_name] = max(values)
+	return shared
+	
+def get_buffer_size(width, height, bytes_per_pixel):
+	"""
+		Returns the bytes the module allocates for one frame
+		
+		Buffers are rounded up to whole pages.
+	"""
+	size = int(width * height * bytes_per_pixel)
+	return -(-size // mmap.PAGESIZE) * mmap.PAGESIZE
+	
+def get_memory(buffers, width, height, bytes_per_pixel=MAX_BYTES_PER_PIXEL):
+	"""
+		Returns the bytes a device's buffers take up
+		
+		A device's buffers are allocated when a stream sets its
+		format, for frames of that size; by default, this gives the
+		most they could ever take up, at the module's maximum size.
+	"""
+	return buffers * get_buffer_size(width, height, bytes_per_pixel)
+	
+
+def configure_devices(labels=None, params=None):
 	"""
 		Configures one or more v4l2 loopback devices
 		
@@ -70,23 +247,26 @@ def configure_devices(labels=None):
 		If no labels are given, a single device will be created, with
 		some boring default label.
 		
+		The `params` parameter, if given, should be a list of dicts
+		of per-device settings, as for get_module_args().
+		
 		Returns an iterable of the new devices
 	"""
 	# Sanity-check the labels
 	if not labels:
 		labels = [DEFAULT_LABEL]
+		params = None
 	if any(not isinstance(label, str) for label in labels):
 		raise TypeError('Device labels must be strings')
+	if params is not None and len(params) != len(labels):
+		raise ValueError('Device params must be given for every label')
 	
 	# Re-modprobe the kernel module with the new params
 	proc = subprocess.Popen(
 		[
 			'pkexec',
 			os.path.join(os.path.dirname(__file__), '..', 'v4l2-reload.sh'),
-			'exclusive_caps=1',
-			'devices={}'.format(len(labels)),
-			'card_label={}'.format(','.join(labels)),
-		],
+		] + get_module_args(labels, params),
 		stdout=subprocess.DEVNULL,
 		stderr=subprocess.PIPE,
 	)
@@ -1,16 +1,68 @@
 """
 	Gubbins for interfacing with X11/xlib
+	
+	Xlib objects make round trips to the X server whenever they're
+	asked anything, and can't be pickled, so the rest of the app
+	deals in WindowInfo records instead. These are made by an
+	X11Worker, which does all its talking to X from its own thread.
 """
+import collections
+from concurrent import futures
+
 import Xlib.X
 import Xlib.error
 import Xlib.display
 import Xlib.xobject.drawable
 
+from x112v4l2 import trace
+
 
 # We ignore windows with a dimension under this value
 MIN_SIZE = 64
 
 
+class WindowInfo(collections.namedtuple('WindowInfo', [
+	'id',
+	# The full ID of the window's screen, eg. ":0.0"
+	'screen_id',
+	'title',
+	# Absolute geometry, clipped to the screen
+	'x',
+	'y',
+	'width',
+	'height',
+])):
+	"""
+		An immutable snapshot of an X11 window
+	"""
+	__slots__ = ()
+	
+	@property
+	def geometry(self):
+		"""
+			A dict of x, y, width and height
+		"""
+		return {
+			'x': self.x,
+			'y': self.y,
+			'width': self.width,
+			'height': self.height,
+		}
+		
+	
+# The results of X11Worker.probe()
+Probe = collections.namedtuple('Probe', [
+	# Names of the displays, eg. ":0"
+	'displays',
+	# Full IDs of the screens, eg. ":0.0"
+	'screens',
+	# WindowInfo records of the interesting windows
+	'windows',
+	# IDs of the windows which have the focus, if the WM says so
+	'active_ids',
+])
+
+
 def get_display(name):
 	"""
 		Returns the named X Display instance
@@ -90,33 +142,41 @@ def get_screens(displays=None):
 
 def get_windows(screens=None):
 	"""
-		Returns an iterable of X window objects
+		Returns an iterable of WindowInfo records of X windows
 		
 		If an iterable of `screens` is given, only windows of
 		those screens will be returned, otherwise the return
 		iterable will include windows from all screens.
+		
+		The records are made from what was asked of X to filter
+		the windows, rather than asking it all over again.
 	"""
 	if screens is None:
 		screens = get_screens().values()
 		
 	for screen in screens:
 		for win in get_subwindows(screen.root):
-			attribs = win.get_attributes()
-			geom = win.get_abs_geometry()
 			# Disregard any that aren't visible
-			if attribs.map_state != Xlib.X.IsViewable:
+			if win.get_attributes().map_state != Xlib.X.IsViewable:
 				continue
 			# Disregard any with no title
-			if not win.get_wm_name():
+			title = win.get_wm_name()
+			if not title:
 				continue
 			# Disregard teeny windows
+			geom = win.get_abs_geometry()
 			if geom['width'] < MIN_SIZE or geom['height'] < MIN_SIZE:
 				continue
 			
-			# Additional useful info that we don't already get
-			win.screen = screen
-			
-			yield win
+			yield WindowInfo(
+				id=win.id,
+				screen_id=screen.full_id,
+				title=title,
+				x=geom['x'],
+				y=geom['y'],
+				width=geom['width'],
+				height=geom['height'],
+			)
 			
 		
 	
@@ -208,17 +268,149 @@ def get_window_wm_name(window):
 	
 Xlib.xobject.drawable.Window.get_wm_name = get_window_wm_name
 
+def get_active_window_id(screen):
+	"""
+		Returns the ID of the focused window of a `screen`, or None
+		
+		This relies on the window manager setting _NET_ACTIVE_WINDOW.
+	"""
+	root = screen.root
+	prop = root.get_full_property(
+		root.display.get_atom('_NET_ACTIVE_WINDOW'),
+		Xlib.X.AnyPropertyType,
+	)
+	if not prop or not prop.value:
+		return None
+	return prop.value[0] or None
+	
+def get_window_info(window, screen_id):
+	"""
+		Returns a WindowInfo record of the given Xlib `window`
+	"""
+	geom = window.get_abs_geometry()
+	return WindowInfo(
+		id=window.id,
+		screen_id=screen_id,
+		title=window.get_wm_name() or '',
+		x=geom['x'],
+		y=geom['y'],
+		width=geom['width'],
+		height=geom['height'],
+	)
+	
+
+class X11Worker(object):
+	"""
+		Queries X11 from a dedicated thread, with its own connections
+		
+		The methods return futures, whose results are plain-data
+		records which are safe to use from any thread (or process).
+		Connections to displays are kept open between queries.
+	"""
+	def __init__(self):
+		self.executor = futures.ThreadPoolExecutor(max_workers=1)
+		# {name: Display}, only used from the worker thread
+		self.displays = {}
+		
+	
+	def probe(self):
+		"""
+			Find all the displays, screens and interesting windows
+			
+			Returns a future of a Probe.
+		"""
+		return self.executor.submit(self.do_probe)
+		
+	def refresh(self, windows):
+		"""
+			Re-read the given WindowInfo `windows` from X
+			
+			Returns a future of a list of new WindowInfo records,
+			leaving out any windows which have gone away.
+		"""
+		return self.executor.submit(self.do_refresh, list(windows))
+		
+	def shutdown(self):
+		"""
+			Stop the worker thread, and disconnect from X
+		"""
+		self.executor.submit(self.disconnect)
+		self.executor.shutdown(wait=True)
+		
+	
+	def connect(self):
+		"""
+			Connect to any new displays, and drop any which have gone
+		"""
+		displays = {}
+		idx = 0
+		while True:
+			name = ':{}'.format(idx)
+			display = self.displays.pop(name, None) or get_display(name)
+			if not display:
+				break
+			displays[name] = display
+			idx += 1
+		self.disconnect()
+		self.displays = displays
+		
+	def disconnect(self):
+		for display in self.displays.values():
+			try:
+				display.close()
+			except Xlib.error.ConnectionClosedError:
+				pass
+		self.displays = {}
+		
+	@trace.traced(category='x11')
+	def do_probe(self):
+		self.connect()
+		try:
+			screens = get_screens(self.displays.values())
+			windows = list(get_windows(screens.values()))
+			active_ids = set(
+				get_active_window_id(screen)
+				for screen in screens.values()
+			) - {None}
+		except Xlib.error.ConnectionClosedError:
+			# A display went away; start afresh next time
+			self.disconnect()
+			raise
+		return Probe(
+			displays=sorted(self.displays),
+			screens=sorted(screens),
+			windows=windows,
+			active_ids=active_ids,
+		)
+		
+	@trace.traced(category='x11')
+	def do_refresh(self, windows):
+		refreshed = []
+		for info in windows:
+			display_name = info.screen_id.rsplit('.', 1)[0]
+			display = self.displays.get(display_name)
+			if display is None:
+				continue
+			window = display.create_resource_object('window', info.id)
+			try:
+				refreshed.append(get_window_info(window, info.screen_id))
+			except (Xlib.error.XError, Xlib.error.ConnectionClosedError):
+				# It's gone
+				continue
+		return refreshed
+		
+	
 #
 # Somewhat more high-level functions
 #
 def search_windows(title):
 	"""
-		Find and return a subset of all Window instances
+		Find and return a subset of all windows, as WindowInfo records
 		
 		Use the `title` parameter to perform a partial (case-
 		insensitive) match against the window's title/name.
 	"""
 	for win in get_windows():
-		if title.lower() in win.get_wm_name().lower():
+		if title.lower() in win.title.lower():
 			yield win
 	